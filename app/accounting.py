@@ -0,0 +1,221 @@
+import os
+import math
+import base64
+import threading
+import contextvars
+from collections import deque
+from dotenv import load_dotenv
+import metrics
+from image_header import read_image_size
+
+# Token and cost accounting for provider calls. upstream records every chat
+# completion (prompt, completion and estimated image tokens, latency, cost)
+# and every Eden AI call (latency and the cost Eden reports), attributed to
+# the route and (verified, see auth.py) user of the request that made it. Totals are exported as
+# metrics and summarised per route, user and model by summary().
+#
+# Observed completion sizes also drive output-token limits: once enough
+# responses of a kind have been seen, max_tokens is set a margin above the
+# largest recent one instead of a blanket 3000.
+#
+#   ADAPTIVE_MAX_TOKENS   enable adaptive output limits
+
+load_dotenv()
+
+ADAPTIVE_MAX_TOKENS = os.getenv('ADAPTIVE_MAX_TOKENS', 'true').lower() in ('1', 'true', 'yes')
+
+# USD per million (prompt, completion) tokens
+MODEL_PRICES = {
+    'gpt-4o': (2.50, 10.00),
+    'gpt-4': (30.00, 60.00),
+    'llama-3.3-70b-specdec': (0.59, 0.99),
+}
+
+# Vision image tokens as (base tokens, tokens per 512px tile) for high detail
+IMAGE_TOKEN_MODELS = {
+    'gpt-4o': (85, 170),
+}
+
+# Adaptive max_tokens: recent completion sizes per (model, purpose)
+MAX_TOKENS_CEILING = 3000
+MAX_TOKENS_FLOOR = 256
+MIN_SAMPLES = 20
+SAMPLE_WINDOW = 200
+MAX_TOKENS_MARGIN = 1.5
+
+_route = contextvars.ContextVar('accounting_route', default='unknown')
+_user = contextvars.ContextVar('accounting_user', default='anonymous')
+
+metrics.describe('provider_calls_total', 'counter', 'Provider calls by route and model')
+metrics.describe('provider_tokens_total', 'counter', 'Provider tokens by route, model and kind')
+metrics.describe('provider_cost_usd_total', 'counter', 'Estimated provider cost in USD')
+metrics.describe('provider_latency_seconds_total', 'counter', 'Total provider call latency')
+metrics.describe('provider_max_tokens', 'gauge', 'Current output-token limit by model and purpose')
+
+_lock = threading.Lock()
+_totals = {'route': {}, 'user': {}, 'model': {}}
+_completion_sizes = {}
+
+def begin(route, user=None):
+    """Attribute provider calls made from the current context to a route and user.
+
+    Returns:
+        tuple: Tokens to pass to end()
+    """
+    return _route.set(route), _user.set(user or 'anonymous')
+
+def end(tokens):
+    route_token, user_token = tokens
+    _route.reset(route_token)
+    _user.reset(user_token)
+
+def image_tokens(width, height, detail='auto', model='gpt-4o'):
+    """Estimate the prompt tokens a vision model charges for one image.
+
+    High detail scales the image to fit 2048x2048, then its short side to 768,
+    and charges per 512px tile; low detail is a flat base cost.
+
+    Returns:
+        int: Estimated tokens, or None for models without a known formula
+    """
+    costs = next((v for k, v in IMAGE_TOKEN_MODELS.items() if model.startswith(k)), None)
+    if costs is None:
+        return None
+    base, per_tile = costs
+    if detail == 'low':
+        return base
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    return base + per_tile * math.ceil(width / 512) * math.ceil(height / 512)
+
+def _count_image_tokens(model, messages):
+    total = 0
+    for message in messages or []:
+        content = message.get('content')
+        if not isinstance(content, list):
+            continue
+        for part in content:
+            if part.get('type') != 'image_url':
+                continue
+            url = part['image_url'].get('url', '')
+            if not url.startswith('data:'):
+                return None
+            size = read_image_size(base64.b64decode(url.partition(',')[2]))
+            tokens = size and image_tokens(*size, part['image_url'].get('detail', 'auto'), model)
+            if tokens is None:
+                return None
+            total += tokens
+    return total
+
+def _cost(model, prompt_tokens, completion_tokens):
+    prices = next((v for k, v in sorted(MODEL_PRICES.items(), key=lambda kv: -len(kv[0]))
+                   if model.startswith(k)), None)
+    if prices is None:
+        return 0.0
+    return (prompt_tokens * prices[0] + completion_tokens * prices[1]) / 1_000_000
+
+def _add(kind, name, record):
+    totals = _totals[kind].setdefault(name, {
+        'calls': 0, 'prompt_tokens': 0, 'completion_tokens': 0, 'image_tokens': 0,
+        'cost_usd': 0.0, 'latency_seconds': 0.0,
+    })
+    for key, value in record.items():
+        totals[key] += value
+
+def _record(model, record):
+    route, user = _route.get(), _user.get()
+    with _lock:
+        _add('route', route, record)
+        _add('user', user, record)
+        _add('model', model, record)
+    metrics.inc('provider_calls_total', route=route, model=model)
+    metrics.inc('provider_cost_usd_total', record['cost_usd'], route=route, model=model)
+    metrics.inc('provider_latency_seconds_total', record['latency_seconds'], route=route, model=model)
+    for kind in ('prompt', 'completion', 'image'):
+        if record[f'{kind}_tokens']:
+            metrics.inc('provider_tokens_total', record[f'{kind}_tokens'], route=route, model=model, kind=kind)
+
+def record_completion(kwargs, response, latency):
+    """Record the usage of a chat completion.
+
+    Args:
+        kwargs (dict): Arguments the completion was created with
+        response: Chat completion with ``usage``
+        latency (float): Call latency in seconds
+    """
+    model = kwargs.get('model', 'unknown')
+    usage = getattr(response, 'usage', None)
+    prompt_tokens = getattr(usage, 'prompt_tokens', 0) or 0
+    completion_tokens = getattr(usage, 'completion_tokens', 0) or 0
+    try:
+        image = _count_image_tokens(model, kwargs.get('messages')) or 0
+    except Exception:
+        image = 0
+    _record(model, {
+        'calls': 1,
+        'prompt_tokens': prompt_tokens,
+        'completion_tokens': completion_tokens,
+        'image_tokens': image,
+        'cost_usd': _cost(model, prompt_tokens, completion_tokens),
+        'latency_seconds': latency,
+    })
+
+def record_http(service, response, latency):
+    """Record an HTTP provider call, using the cost Eden AI reports per provider."""
+    cost = 0.0
+    try:
+        body = response.json()
+        if isinstance(body, dict):
+            cost = sum(float(v.get('cost') or 0) for v in body.values() if isinstance(v, dict))
+    except ValueError:
+        pass
+    _record(service, {
+        'calls': 1, 'prompt_tokens': 0, 'completion_tokens': 0, 'image_tokens': 0,
+        'cost_usd': cost, 'latency_seconds': latency,
+    })
+
+def max_tokens(model, purpose):
+    """Output-token limit for a kind of call, adapted to observed response sizes.
+
+    Args:
+        model (str): Model name
+        purpose (str): What the call is for, e.g. 'analyze_image'
+
+    Returns:
+        int: Limit between MAX_TOKENS_FLOOR and MAX_TOKENS_CEILING
+    """
+    with _lock:
+        sizes = _completion_sizes.get((model, purpose))
+        if not ADAPTIVE_MAX_TOKENS or sizes is None or len(sizes) < MIN_SAMPLES:
+            return MAX_TOKENS_CEILING
+        limit = int(max(sizes) * MAX_TOKENS_MARGIN)
+    return min(MAX_TOKENS_CEILING, max(MAX_TOKENS_FLOOR, limit))
+
+def observe_completion(model, purpose, response):
+    """Feed a completion's size into the adaptive limit for its kind of call."""
+    usage = getattr(response, 'usage', None)
+    if usage is None or not usage.completion_tokens:
+        return
+    with _lock:
+        sizes = _completion_sizes.setdefault((model, purpose), deque(maxlen=SAMPLE_WINDOW))
+        sizes.append(usage.completion_tokens)
+    metrics.set_gauge('provider_max_tokens', max_tokens(model, purpose), model=model, purpose=purpose)
+
+def summary():
+    """Return accounting totals per route, user and model.
+
+    Returns:
+        dict: {'by_route': {...}, 'by_user': {...}, 'by_model': {...}} with call
+        counts, token totals, estimated cost and mean latency
+    """
+    def finish(totals):
+        result = dict(totals)
+        result['cost_usd'] = round(result['cost_usd'], 6)
+        result['mean_latency_seconds'] = round(result.pop('latency_seconds') / max(result['calls'], 1), 3)
+        return result
+
+    with _lock:
+        return {f'by_{kind}': {name: finish(totals) for name, totals in groups.items()}
+                for kind, groups in _totals.items()}
@@ -0,0 +1,263 @@
+import os
+import time
+import asyncio
+import itertools
+import threading
+from dotenv import load_dotenv
+import metrics
+
+# Admission control for the Flask service. All routes share ADMISSION_CAPACITY
+# concurrent request slots; each route also has its own in-flight cap and a
+# bounded wait queue. When a slot frees up the waiting request with the best
+# priority goes first, so cheap routes (/proxy-image, /blobs) are not stuck
+# behind a backlog of /detect calls. Requests that cannot queue are shed
+# immediately with 429, and ones that wait too long get 503.
+#
+#   ADMISSION_CAPACITY       total concurrent requests across routes
+#   ADMISSION_QUEUE_TIMEOUT  longest a request may wait for a slot, in seconds
+#   ADMISSION_<ROUTE>        per-route 'max_inflight,max_queue',
+#                            e.g. ADMISSION_DETECT=4,8
+#
+# The async service mode uses AsyncAdmissionController with much higher limits
+# (waiting there costs a coroutine, not a thread), configured with the same
+# variables prefixed ASYNC_, e.g. ASYNC_ADMISSION_CAPACITY.
+
+load_dotenv()
+
+CAPACITY = int(os.getenv('ADMISSION_CAPACITY', 16))
+QUEUE_TIMEOUT = float(os.getenv('ADMISSION_QUEUE_TIMEOUT', 10))
+
+# route: (max_inflight, max_queue, priority); lower priority values go first
+DEFAULT_POLICIES = {
+    'proxy-image': (16, 64, 0),
+    'blobs': (16, 64, 0),
+    'detect-jobs': (16, 64, 0),
+    'analyze': (4, 16, 1),
+    'read-receipt': (4, 16, 1),
+    'detect': (4, 8, 2),
+    'detect-video': (2, 4, 3),
+    'redact': (2, 4, 3),
+}
+DEFAULT_POLICY = (8, 16, 1)
+
+ASYNC_CAPACITY = int(os.getenv('ASYNC_ADMISSION_CAPACITY', 512))
+ASYNC_POLICIES = {
+    'proxy-image': (128, 256, 0),
+    'blobs': (128, 256, 0),
+    'detect-jobs': (128, 256, 0),
+    'analyze': (64, 128, 1),
+    'read-receipt': (64, 128, 1),
+    'detect': (256, 256, 2),
+    # Video decoding still runs on threads
+    'detect-video': (4, 8, 3),
+    'redact': (4, 8, 3),
+}
+
+metrics.describe('admission_inflight', 'gauge', 'Requests currently being served')
+metrics.describe('admission_queue_depth', 'gauge', 'Requests waiting for a slot')
+metrics.describe('admission_admitted_total', 'counter', 'Requests admitted')
+metrics.describe('admission_shed_total', 'counter', 'Requests rejected by admission control')
+
+def route_name(url_rule):
+    """Name a matched route for admission, accounting and memory profiles.
+
+    Names come from the app's URL rules, not the request path, so paths that
+    match no route cannot create new per-route state or metric labels.
+
+    Args:
+        url_rule: The request's matched URL rule, or None
+
+    Returns:
+        str: First segment of the rule, e.g. 'detect-jobs' for
+        '/detect-jobs/<job_id>', or None when no route matched
+    """
+    if url_rule is None:
+        return None
+    return url_rule.rule.strip('/').split('/')[0]
+
+class Rejected(Exception):
+    """Raised when a request is shed instead of admitted.
+
+    Attributes:
+        status (int): HTTP status to return (429 queue full, 503 wait timed out)
+        retry_after (int): Suggested Retry-After in seconds
+    """
+
+    def __init__(self, route, status, retry_after, reason):
+        super().__init__(f"Server busy ({reason} for /{route}), retry after {retry_after}s")
+        self.status = status
+        self.retry_after = retry_after
+
+class _Ticket:
+    def __init__(self, route, priority, seq):
+        self.route = route
+        self.priority = priority
+        self.seq = seq
+
+class AdmissionController:
+    """Shared-capacity admission controller with per-route limits and priorities.
+
+    Args:
+        capacity (int): Total concurrent requests across all routes
+        policies (dict): route -> (max_inflight, max_queue, priority)
+        queue_timeout (float): Longest a request may wait, in seconds
+    """
+
+    env_prefix = 'ADMISSION_'
+
+    def __init__(self, capacity=CAPACITY, policies=None, queue_timeout=QUEUE_TIMEOUT):
+        self.capacity = capacity
+        self.policies = dict(DEFAULT_POLICIES if policies is None else policies)
+        self.queue_timeout = queue_timeout
+        self._cond = threading.Condition()
+        self._total = 0
+        self._inflight = {}
+        self._queued = {}
+        self._waiting = []
+        self._seq = itertools.count()
+        # Smoothed service time per route, used to estimate Retry-After
+        self._service_time = {}
+
+    def policy(self, route):
+        spec = os.getenv(f"{self.env_prefix}{route.upper().replace('-', '_')}")
+        max_inflight, max_queue, priority = self.policies.get(route, DEFAULT_POLICY)
+        if spec:
+            inflight, _, queue = spec.partition(',')
+            max_inflight, max_queue = int(inflight), int(queue or max_queue)
+        return max_inflight, max_queue, priority
+
+    def _retry_after(self, route):
+        max_inflight = self.policy(route)[0]
+        backlog = self._queued.get(route, 0) + self._inflight.get(route, 0)
+        estimate = self._service_time.get(route, 1.0) * backlog / max(max_inflight, 1)
+        return max(1, int(estimate + 0.5))
+
+    def _publish(self, route):
+        metrics.set_gauge('admission_inflight', self._inflight.get(route, 0), route=route)
+        metrics.set_gauge('admission_queue_depth', self._queued.get(route, 0), route=route)
+
+    def _next_eligible(self):
+        """Return the best-priority waiting ticket whose route is under its cap."""
+        eligible = [t for t in self._waiting if self._inflight.get(t.route, 0) < self.policy(t.route)[0]]
+        return min(eligible, key=lambda t: (t.priority, t.seq), default=None)
+
+    def _shed(self, route, status, reason):
+        metrics.inc('admission_shed_total', route=route, reason=reason)
+        raise Rejected(route, status, self._retry_after(route), reason)
+
+    def acquire(self, route):
+        """Wait for a slot for ``route``.
+
+        Raises:
+            Rejected: If the route's queue is full or the wait timed out
+        """
+        max_inflight, max_queue, priority = self.policy(route)
+        with self._cond:
+            free = self._total < self.capacity and self._inflight.get(route, 0) < max_inflight
+            if not (free and self._next_eligible() is None):
+                if self._queued.get(route, 0) >= max_queue:
+                    self._shed(route, 429, 'queue full')
+
+                ticket = _Ticket(route, priority, next(self._seq))
+                self._waiting.append(ticket)
+                self._queued[route] = self._queued.get(route, 0) + 1
+                self._publish(route)
+                deadline = time.monotonic() + self.queue_timeout
+                try:
+                    while not (self._total < self.capacity and self._next_eligible() is ticket):
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._shed(route, 503, 'queue timeout')
+                        self._cond.wait(remaining)
+                finally:
+                    self._waiting.remove(ticket)
+                    self._queued[route] -= 1
+                    self._publish(route)
+                    # Our place in line may have been blocking someone else
+                    self._cond.notify_all()
+
+            self._take(route)
+        return time.monotonic()
+
+    def release(self, route, started):
+        """Free the slot taken by ``acquire``."""
+        with self._cond:
+            self._free(route, started)
+            self._cond.notify_all()
+
+    def _take(self, route):
+        self._total += 1
+        self._inflight[route] = self._inflight.get(route, 0) + 1
+        self._publish(route)
+        metrics.inc('admission_admitted_total', route=route)
+
+    def _free(self, route, started):
+        elapsed = time.monotonic() - started
+        self._total -= 1
+        self._inflight[route] -= 1
+        previous = self._service_time.get(route, elapsed)
+        self._service_time[route] = 0.8 * previous + 0.2 * elapsed
+        self._publish(route)
+
+class AsyncAdmissionController(AdmissionController):
+    """asyncio counterpart of AdmissionController, for one event loop.
+
+    Same policies, priorities, shedding and metrics; acquire and release are
+    coroutines.
+    """
+
+    env_prefix = 'ASYNC_ADMISSION_'
+
+    def __init__(self, capacity=ASYNC_CAPACITY, policies=None, queue_timeout=QUEUE_TIMEOUT):
+        super().__init__(capacity, ASYNC_POLICIES if policies is None else policies, queue_timeout)
+        # Created on first use so it binds to the serving loop
+        self._cond = None
+
+    def _condition(self):
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        return self._cond
+
+    async def acquire(self, route):
+        """Wait for a slot for ``route``.
+
+        Raises:
+            Rejected: If the route's queue is full or the wait timed out
+        """
+        max_inflight, max_queue, priority = self.policy(route)
+        cond = self._condition()
+        async with cond:
+            free = self._total < self.capacity and self._inflight.get(route, 0) < max_inflight
+            if not (free and self._next_eligible() is None):
+                if self._queued.get(route, 0) >= max_queue:
+                    self._shed(route, 429, 'queue full')
+
+                ticket = _Ticket(route, priority, next(self._seq))
+                self._waiting.append(ticket)
+                self._queued[route] = self._queued.get(route, 0) + 1
+                self._publish(route)
+                deadline = time.monotonic() + self.queue_timeout
+                try:
+                    while not (self._total < self.capacity and self._next_eligible() is ticket):
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._shed(route, 503, 'queue timeout')
+                        try:
+                            await asyncio.wait_for(cond.wait(), remaining)
+                        except asyncio.TimeoutError:
+                            pass
+                finally:
+                    self._waiting.remove(ticket)
+                    self._queued[route] -= 1
+                    self._publish(route)
+                    cond.notify_all()
+
+            self._take(route)
+        return time.monotonic()
+
+    async def release(self, route, started):
+        """Free the slot taken by ``acquire``."""
+        cond = self._condition()
+        async with cond:
+            self._free(route, started)
+            cond.notify_all()
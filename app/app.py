@@ -1,27 +1,109 @@
 # Import required dependencies
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, send_file, url_for, g
 from flask_cors import CORS
 import os
 import random
 import base64
 from dotenv import load_dotenv
-from convert_image import url_to_base64
-import json
-import requests
+from convert_image import download, download_to_file, normalize_url, DownloadTooLarge
+from urllib.parse import urlparse
+from singleflight import SingleFlight
+from ratelimit import RateLimitExceeded
+from admission import AdmissionController, Rejected, route_name
+import metrics
+import warmup
+import accounting
+import auth
+import memprof
+import contextvars
+from idempotency import idempotent
+from incremental import find_reusable
+from video import detect_video_objects, MAX_VIDEO_BYTES
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from jobs import get_job_store
 
 # Add image-detection directory to Python path
 import sys
 sys.path.append(os.path.join(os.path.dirname(__file__), '../image-detection'))
 from detection import detect_and_crop_objects
+from results import (parse_crop_options, parse_detect_request, detect_key, detect_response, error_response,
+                     merge_priced, analyzed_object, fallback_object, pending_object, pricing_order, pricing_image)
+from blobstore import get_blob_store, is_valid_key, content_type
 from pricing import analyze_image, analyze_receipt_text
-from receipts import read_ocr
+from receipts import read_receipt_indexed
+from redaction import parse_redact_options, redact_batch
 
 # Load environment variables
 load_dotenv()
 
 # Initialize Flask app and enable CORS
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=['Retry-After', 'Idempotent-Replayed', memprof.HEADER])
+
+# Identical concurrent requests share one in-flight computation
+inflight = SingleFlight()
+
+# Per-route concurrency limits with bounded queues; excess load is shed early
+admission = AdmissionController()
+UNLIMITED_ROUTES = {'metrics', 'health', 'usage'}
+
+# Trace allocations per request when MEMORY_PROFILE is set
+memprof.start()
+
+@app.before_request
+def admit_request():
+    """Wait for an admission slot, or shed the request with 429/503 and Retry-After."""
+    route = route_name(request.url_rule)
+    # Unmatched paths go straight to their 404
+    if route is None or request.method == 'OPTIONS' or route in UNLIMITED_ROUTES:
+        return None
+    try:
+        g.admission = (route, admission.acquire(route))
+    except Rejected as e:
+        print(f"[/{route}] Shed: {e}")
+        return jsonify({'error': str(e)}), e.status, {'Retry-After': str(e.retry_after)}
+
+@app.teardown_request
+def release_admission(exc):
+    if 'admission' in g:
+        admission.release(*g.pop('admission'))
+
+@app.before_request
+def begin_accounting():
+    """Attribute provider calls made while serving this request to its route and user."""
+    route = route_name(request.url_rule)
+    if route is None:
+        return
+    g.accounting = accounting.begin(route, auth.verified_user(request.headers.get('Authorization')))
+
+@app.teardown_request
+def end_accounting(exc):
+    if 'accounting' in g:
+        accounting.end(g.pop('accounting'))
+
+@app.before_request
+def begin_memory_profile():
+    """Profile this request's memory use by stage (only with MEMORY_PROFILE)."""
+    route = route_name(request.url_rule)
+    if route is not None:
+        g.memory_profile = memprof.begin(route)
+
+@app.after_request
+def add_memory_profile(response):
+    memprof.finish(g.pop('memory_profile', None), response.headers)
+    return response
+
+@app.teardown_request
+def end_memory_profile(exc):
+    # Requests that failed before a response was built
+    if 'memory_profile' in g:
+        memprof.end(g.pop('memory_profile'))
+
+# Pricing for requests with a time budget runs on a shared pool, so objects
+# left over when the budget runs out keep being priced after the response
+PRICING_WORKERS = int(os.getenv('PRICING_WORKERS', 4))
+pricing_executor = ThreadPoolExecutor(max_workers=PRICING_WORKERS, thread_name_prefix='pricing')
 
 # Configure allowed file extensions for image uploads
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
@@ -37,6 +119,22 @@ def allowed_file(filename):
     """
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def analyze_detected_object(obj):
+    """Analyze a single detected object, falling back to its label if analysis fails.
+
+    Args:
+        obj (dict): Detected object with base64 image data and pricing crop
+
+    Returns:
+        dict: Analyzed object with name, description and estimated price
+    """
+    try:
+        return analyzed_object(obj, analyze_image(*pricing_image(obj)))
+    except Exception as e:
+        print(f"Error analyzing object: {str(e)}")
+        # Add a fallback object if analysis fails
+        return fallback_object(obj)
+
 def analyze_detected_objects(detected_objects):
     """Analyze detected objects and return their details.
 
@@ -46,42 +144,103 @@ def analyze_detected_objects(detected_objects):
     Returns:
         list: List of analyzed objects with their details
     """
-    analyzed_objects = []
+    return [analyze_detected_object(obj) for obj in detected_objects]
+
+def analyze_within_deadline(detected_objects, deadline):
+    """Analyze detected objects until a deadline, most prominent objects first.
+
+    Objects are priced on the shared pricing pool in descending order of
+    confidence times crop area. Whatever has not finished by the deadline is
+    returned as a 'pending' placeholder and keeps running in the background.
+
+    Args:
+        detected_objects (list): List of detected objects with base64 image data
+        deadline (float): time.monotonic() value to return by
+
+    Returns:
+        tuple: (analyzed objects with placeholders, dict of unfinished future -> index)
+    """
+    # Each task carries the request's context so usage is attributed to it
+    futures = {pricing_executor.submit(contextvars.copy_context().run, analyze_detected_object, detected_objects[i]): i
+               for i in pricing_order(detected_objects)}
+    done, not_done = wait(futures, timeout=max(deadline - time.monotonic(), 0))
+
+    analyzed_objects = [pending_object(obj) for obj in detected_objects]
+    for future in done:
+        analyzed_objects[futures[future]] = future.result()
+    return analyzed_objects, {future: futures[future] for future in not_done}
+
+def defer_pending(analyzed_objects, pending):
+    """Register a job that collects objects still being priced after the response.
+
+    Args:
+        analyzed_objects (list): Response objects, with placeholders for pending ones
+        pending (dict): Unfinished future -> index into analyzed_objects
+
+    Returns:
+        str: Job id, or None if nothing is pending
+    """
+    if not pending:
+        return None
+    job_id = get_job_store().create(analyzed_objects, pending.values())
+    for future, index in pending.items():
+        future.add_done_callback(lambda f, index=index: get_job_store().complete(job_id, index, f.result()))
+    print(f"Deadline reached with {len(pending)} objects still pricing, job {job_id}")
+    return job_id
+
+def run_detection(image_url, crop_format, crop_quality, crop_output, prior_objects=None, prior_image_url=None,
+                  tiled=False, deadline=None):
+    """Download an image, detect and crop its objects, and price them.
+
+    With prior objects (from an earlier /detect of the same room), objects
+    that match an unchanged prior object keep its name, description and price
+    and are marked 'reused' instead of being priced again.
+
+    Args:
+        image_url (str): URL of the room photo
+        crop_format (str): Crop encoding, one of CROP_FORMATS
+        crop_quality (int): Encoder quality, or None for the default
+        crop_output (str): 'inline' or 'reference'
+        prior_objects (list): Objects from an earlier /detect response, or None
+        prior_image_url (str): URL of the earlier photo, required with prior_objects
+        tiled (Union[bool, str]): Tiled detection mode, True, False or 'auto'
+        deadline (float): time.monotonic() value by which to return; objects
+            not priced by then are marked 'pending' and finished in a job
 
+    Returns:
+        tuple: (analyzed objects ready for the response, job id or None)
+    """
+    # Stream the image into a size-capped buffer and detect on it directly
+    with memprof.stage('download'):
+        body = download(image_url)
+    with body:
+        with memprof.stage('detect'):
+            detected_objects = detect_and_crop_objects(body.buffer(), crop_format, crop_quality, crop_output, tiled)
+        reusable = {}
+        if prior_objects:
+            with memprof.stage('reuse'):
+                with download(prior_image_url) as prior_body:
+                    reusable = find_reusable(body.buffer(), detected_objects, prior_objects, prior_body.buffer())
     for obj in detected_objects:
-        try:
-            analysis = analyze_image(obj['image_data'])
-
-            # Extract price value, removing '$' if present
-            price_str = analysis.get('price', '$0').replace('$', '').replace(',', '')
-            try:
-                price = float(price_str)
-            except (ValueError, TypeError):
-                price = 0
-
-            analyzed_objects.append({
-                'label': obj['label'],
-                'confidence': obj['confidence'],
-                'image_url': obj['image_data'],
-                'name': analysis.get('name', obj['label'].capitalize()),
-                'description': analysis.get('description', f'A {obj["label"]}'),
-                'estimated_price': f'${price:.2f}'
-            })
-        except Exception as e:
-            print(f"Error analyzing object: {str(e)}")
-            # Add a fallback object if analysis fails
-            analyzed_objects.append({
-                'label': obj['label'],
-                'confidence': obj['confidence'],
-                'image_url': obj['image_data'],
-                'name': obj['label'].capitalize(),
-                'description': f'A {obj["label"]}',
-                'estimated_price': f'${0:.2f}'
-            })
-
-    return analyzed_objects
+        if 'image_ref' in obj:
+            obj['image_url'] = url_for('get_blob', key=obj['image_ref'], _external=True)
+    # Log labels only; serializing the objects would copy every crop
+    print("Detected objects:", ', '.join(obj['label'] for obj in detected_objects)[:200])
+    print(f"Reusing {len(reusable)} of {len(detected_objects)} objects from the prior photo")
+
+    # Only price objects that are new or changed since the prior photo
+    to_price = [obj for i, obj in enumerate(detected_objects) if i not in reusable]
+    with memprof.stage('price'):
+        if deadline is None:
+            priced, pending = analyze_detected_objects(to_price), {}
+        else:
+            priced, pending = analyze_within_deadline(to_price, deadline)
+    analyzed_objects, pending = merge_priced(detected_objects, reusable, priced, pending)
+    job_id = defer_pending(analyzed_objects, pending)
+    return analyzed_objects, job_id
 
 @app.route('/detect', methods=['POST'])
+@idempotent('detect')
 def detect_objects():
     """Handle POST requests to detect objects in uploaded images.
 
@@ -89,35 +248,139 @@ def detect_objects():
     1. A file upload with key 'image'
     2. Base64 encoded image data in request.form['image']
 
+    With 'budget_ms', the response is returned within that budget: objects
+    not priced in time are marked 'pending' and can be collected later from
+    'job_url'.
+
     Returns:
         JSON: Detection results or error message with appropriate status code
     """
+    started = time.monotonic()
     try:
-        image_data = None
         json_s = request.get_json()
-        print(json_s)
+        # Not the whole body: prior_objects can carry every earlier crop inline
+        print(f"[/detect] Request: {json_s.get('url')}")
+
+        parsed, error = parse_detect_request(json_s)
+        if error:
+            return jsonify({'error': error}), 400
+        image_url, crop_options, detect_options = parsed
+        crop_output, crop_format, crop_quality = crop_options
+        prior_objects, prior_image_url, tiled, budget_ms = detect_options
+        deadline = started + budget_ms / 1000 if budget_ms else None
+
+        # Identical concurrent requests (retries, collaborators) share one run
+        analyzed_objects, job_id = inflight.do(detect_key(image_url, crop_options, detect_options), run_detection,
+                                               image_url, crop_format, crop_quality, crop_output, prior_objects,
+                                               prior_image_url, tiled, deadline)
 
-        image_url = json_s['url']
-        image_data = url_to_base64(image_url)
+        # Prepare and return successful response
+        job_url = job_id and url_for('get_detect_job', job_id=job_id, _external=True)
+        print(f"[/detect] Response: {len(analyzed_objects)} objects, job {job_id}")
+        with memprof.stage('respond'):
+            return jsonify(detect_response(analyzed_objects, job_id, job_url))
 
-        # Process the image for object detection
-        print("HERE")
-        detected_objects = detect_and_crop_objects(image_data)
-        print("Detected objects:", json.dumps(detected_objects)[:200])  # Print first 200 chars to avoid flooding logs
-        analyzed_objects = analyze_detected_objects(detected_objects)
-        print("HERE3")
+    except Exception as e:
+        error_data, status, headers = error_response(e)
+        print(f"[/detect] Error: {error_data}")
+        return jsonify(error_data), status, headers
+
+@app.route('/detect-jobs/<job_id>', methods=['GET'])
+def get_detect_job(job_id):
+    """Collect objects that were still being priced when a /detect budget ran out.
+
+    Returns:
+        JSON: All objects of the original response, with finished ones filled
+        in, and whether pricing is complete; 404 for unknown or expired jobs
+    """
+    job = get_job_store().get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    analyzed_objects, pending = job
+    return jsonify({
+        'success': True,
+        'complete': pending == 0,
+        'pending': pending,
+        'detected_objects': analyzed_objects
+    })
+
+def run_video_detection(video_url, crop_format, crop_quality, crop_output):
+    """Download a walkthrough video, detect objects in its keyframes and price them once.
+
+    Args:
+        video_url (str): URL of the video
+        crop_format (str): Crop encoding, one of CROP_FORMATS
+        crop_quality (int): Encoder quality, or None for the default
+        crop_output (str): 'inline' or 'reference'
+
+    Returns:
+        tuple: (number of keyframes, analyzed objects)
+    """
+    # OpenCV reads videos from a path, so stream to a capped temp file
+    path = download_to_file(video_url, MAX_VIDEO_BYTES, suffix=os.path.splitext(urlparse(video_url).path)[1])
+    try:
+        keyframe_count, detected_objects = detect_video_objects(path, crop_format, crop_quality, crop_output)
+    finally:
+        os.unlink(path)
+
+    for obj in detected_objects:
+        if 'image_ref' in obj:
+            obj['image_url'] = url_for('get_blob', key=obj['image_ref'], _external=True)
+    print(f"Found {len(detected_objects)} distinct objects in {keyframe_count} keyframes")
+
+    analyzed_objects = analyze_detected_objects(detected_objects)
+    for obj, analyzed in zip(detected_objects, analyzed_objects):
+        analyzed['frame_index'] = obj['frame_index']
+        analyzed['seen_in_frames'] = obj['seen_in_frames']
+    return keyframe_count, analyzed_objects
+
+@app.route('/detect-video', methods=['POST'])
+@idempotent('detect-video')
+def detect_video():
+    """Handle POST requests to detect objects in a walkthrough video.
+
+    This endpoint accepts a video URL in the request JSON (plus the same crop
+    options as /detect). A few sharp, distinct keyframes are detected and the
+    objects are deduplicated across them before a single pricing pass.
+
+    Returns:
+        JSON: Detected objects with the keyframes they were seen in, or error
+        message with appropriate status code
+    """
+    try:
+        json_data = request.get_json()
+        if not json_data or 'url' not in json_data:
+            return jsonify({'error': 'No video URL provided'}), 400
+
+        crop_options, error = parse_crop_options(json_data)
+        if error:
+            return jsonify({'error': error}), 400
+        crop_output, crop_format, crop_quality = crop_options
+
+        video_url = json_data['url']
+        key = ('detect-video', normalize_url(video_url), crop_output, crop_format, crop_quality)
+        keyframe_count, analyzed_objects = inflight.do(
+            key, run_video_detection, video_url, crop_format, crop_quality, crop_output)
 
-        # Prepare and return successful response
         response_data = {
             'success': True,
+            'keyframes': keyframe_count,
             'detected_objects': analyzed_objects
         }
-        print(f"[/detect] Response: {str(response_data)}")
+        print(f"[/detect-video] Response: {len(analyzed_objects)} objects from {keyframe_count} keyframes")
         return jsonify(response_data)
 
+    except DownloadTooLarge as e:
+        error_response = {'error': str(e)}
+        print(f"[/detect-video] Error: {error_response}")
+        return jsonify(error_response), 413
+    except RateLimitExceeded as e:
+        error_response = {'error': str(e)}
+        print(f"[/detect-video] Error: {error_response}")
+        return jsonify(error_response), 503, {'Retry-After': str(int(e.retry_after) + 1)}
     except Exception as e:
         error_response = {'error': str(e)[:100]}
-        print(f"[/detect] Error: {error_response}")
+        print(f"[/detect-video] Error: {error_response}")
         return jsonify(error_response), 500
 
 @app.route('/analyze', methods=['POST'])
@@ -174,12 +437,16 @@ def analyze_image_endpoint():
         return jsonify(error_response), 500
 
 @app.route('/read-receipt', methods=['POST'])
+@idempotent('read-receipt')
 def read_receipt():
     """Handle POST requests to read text from receipt images using OCR.
 
     This endpoint accepts:
     1. A URL to an image in the request JSON
 
+    Receipts the signed-in user (Firebase ID token) has uploaded before are answered from
+    their receipt index and flagged as duplicates.
+
     Returns:
         JSON: OCR results and analyzed data, or error message with appropriate status code
     """
@@ -189,21 +456,78 @@ def read_receipt():
             return jsonify({'error': 'No image URL provided'}), 400
 
         image_url = json_data['url']
-        result = read_ocr(image_url)
+        user_id = auth.verified_user(request.headers.get('Authorization'))
+        result = inflight.do(('read-receipt', normalize_url(image_url), user_id),
+                             read_receipt_indexed, image_url, user_id)
 
         response_data = {
             'success': True,
             'text': result['text'],
-            'analyzed_data': result['analyzed_data']
+            'analyzed_data': result['analyzed_data'],
+            'duplicate': result['duplicate']
         }
+        if result['duplicate']:
+            response_data['duplicate_of'] = result['duplicate_of']
         print(f"[/read-receipt] Response: {str(response_data)}")
         return jsonify(response_data)
 
+    except RateLimitExceeded as e:
+        error_response = {'error': str(e)}
+        print(f"[/read-receipt] Error: {error_response}")
+        return jsonify(error_response), 503, {'Retry-After': str(int(e.retry_after) + 1)}
     except Exception as e:
         error_response = {'error': str(e)[:100]}
         print(f"[/read-receipt] Error: {error_response}")
         return jsonify(error_response), 500
 
+@app.route('/redact', methods=['POST'])
+def redact_documents():
+    """Handle POST requests to redact faces and text in a set of documents.
+
+    This endpoint accepts a list of document URLs in the request JSON, plus
+    optional 'mode' ('pixelate' or 'blur') and 'targets' (any of 'faces' and
+    'text', default faces only, since text redaction also masks prices and
+    totals). Documents are redacted in parallel; ones redacted before with
+    the same settings are served from the cache.
+
+    Returns:
+        JSON: One entry per document with the redacted image URL and region
+        counts (or a per-document error), or error message with appropriate
+        status code
+    """
+    try:
+        json_data = request.get_json()
+        if not json_data:
+            return jsonify({'error': 'No document URLs provided'}), 400
+
+        options, error = parse_redact_options(json_data)
+        if error:
+            return jsonify({'error': error}), 400
+        urls, mode, targets = options
+
+        documents = redact_batch(urls, mode, targets)
+        for url, document in zip(urls, documents):
+            document['url'] = url
+            if 'image_ref' in document:
+                document['image_url'] = url_for('get_blob', key=document['image_ref'], _external=True)
+
+        redacted = sum('image_ref' in document for document in documents)
+        print(f"[/redact] Response: {redacted}/{len(documents)} documents redacted")
+        return jsonify({
+            'success': True,
+            'documents': documents
+        })
+
+    except Exception as e:
+        error_response = {'error': str(e)[:100]}
+        print(f"[/redact] Error: {error_response}")
+        return jsonify(error_response), 500
+
+def download_base64(url):
+    """Stream an image into a size-capped buffer and return it base64 encoded."""
+    with download(url) as body:
+        return base64.b64encode(body.buffer()).decode('utf-8')
+
 @app.route('/proxy-image', methods=['POST'])
 def proxy_image():
     """Handle POST requests to proxy image fetching from Firebase Storage.
@@ -221,21 +545,78 @@ def proxy_image():
             
         url = data['url']
         
-        # Fetch the image
-        response = requests.get(url)
-        response.raise_for_status()
-        
-        # Convert to base64
-        image_base64 = base64.b64encode(response.content).decode('utf-8')
+        image_base64 = inflight.do(('proxy-image', normalize_url(url)), download_base64, url)
         return jsonify({
             'base64Image': f'data:image/jpeg;base64,{image_base64}'
         })
-        
+
+    except DownloadTooLarge as e:
+        print('Error in proxy_image:', str(e))
+        return jsonify({'error': str(e)}), 413
     except Exception as e:
         print('Error in proxy_image:', str(e))
         return jsonify({'error': str(e)}), 500
 
+@app.route('/blobs/<key>', methods=['GET'])
+def get_blob(key):
+    """Serve a stored blob (e.g. a detected object crop) by its content address.
+
+    Supports conditional and Range requests, and blobs are immutable so they
+    can be cached indefinitely.
+
+    Returns:
+        The blob bytes, or an error message with appropriate status code
+    """
+    if not is_valid_key(key):
+        return jsonify({'error': 'Invalid blob key'}), 400
+
+    store = get_blob_store()
+    if not store.exists(key):
+        return jsonify({'error': 'Blob not found'}), 404
+
+    source = store.path(key) if hasattr(store, 'path') else store.open(key)
+    return send_file(source, mimetype=content_type(key), conditional=True, etag=key, max_age=31536000)
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Expose service metrics (admission queue depth, shed counts, ...) for Prometheus.
+
+    Returns:
+        Metrics in the Prometheus text exposition format
+    """
+    return metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4'}
+
+@app.route('/health', methods=['GET'])
+def health():
+    """Report worker readiness for load balancers and deploy checks.
+
+    Returns 503 until warm-up has finished, so traffic only reaches workers
+    whose connections and native libraries are already initialised.
+
+    Returns:
+        JSON: Warm-up status and per-step results
+    """
+    state = warmup.status()
+    return jsonify(state), 200 if state['status'] == 'ready' else 503
+
+@app.route('/usage', methods=['GET'])
+def usage():
+    """Summarise provider token usage, latency and estimated cost.
+
+    Operators only: requires the ADMIN_TOKEN secret in X-Admin-Token.
+
+    Returns:
+        JSON: Totals per route, per user and per model, or 403
+    """
+    if not auth.is_admin(request.headers.get(auth.ADMIN_HEADER)):
+        return jsonify({'error': 'Forbidden'}), 403
+    return jsonify(accounting.summary())
+
 # Start the Flask server if running directly
 if __name__ == '__main__':
+    # Open upstream connections and load native libraries before reporting
+    # ready; with the reloader, the serving process is the child it restarts
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        warmup.start()
     app.run(host='0.0.0.0', port=4000, debug=True)
 
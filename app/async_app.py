@@ -0,0 +1,489 @@
+# Asyncio service mode: the same routes as app.py, served by Quart.
+#
+# Provider calls and downloads go through async_upstream (one pooled
+# httpx.AsyncClient, AsyncOpenAI), so a request waiting on Eden AI or OpenAI
+# holds a coroutine instead of an OS thread. CPU-bound stages (OpenCV decode,
+# crop and encode, alignment, video keyframes) run on a thread pool via
+# asyncio.to_thread, which also carries the request's accounting context.
+#
+# Run with an ASGI server, e.g.:
+#   pip install -e '.[async]'
+#   hypercorn async_app:app --bind 0.0.0.0:4000
+#
+#   ASYNC_CPU_WORKERS   threads for the CPU-bound stages
+from quart import Quart, request, jsonify, send_file, url_for, g
+from quart_cors import cors
+import os
+import time
+import base64
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+from dotenv import load_dotenv
+from convert_image import normalize_url, DownloadTooLarge
+from singleflight import AsyncSingleFlight
+from ratelimit import RateLimitExceeded
+from admission import AsyncAdmissionController, Rejected, route_name
+import metrics
+import warmup
+import accounting
+import auth
+import memprof
+import async_upstream
+from idempotency import idempotent_async
+from incremental import find_reusable
+from video import detect_video_objects, MAX_VIDEO_BYTES
+from image_header import read_image_size
+from tiling import should_tile
+from detection import detect_and_crop_objects, load_image_bytes, detection_request, parse_detections
+from blobstore import get_blob_store, is_valid_key, content_type
+import pricing
+from pricing import analyze_image_async, analyze_receipt_text_async
+from receipts import ocr_request, parse_ocr
+from receipt_index import get_index, image_hash, text_fingerprint, duplicate_result, upload_owner, owned_match
+from redaction import parse_redact_options, redact_document
+from jobs import get_job_store
+from results import (parse_crop_options, parse_detect_request, detect_key, detect_response, error_response,
+                     merge_priced, analyzed_object, fallback_object, pending_object, pricing_order, pricing_image)
+
+load_dotenv()
+
+ASYNC_CPU_WORKERS = int(os.getenv('ASYNC_CPU_WORKERS', os.cpu_count() or 4))
+
+app = Quart(__name__)
+app = cors(app, expose_headers=['Retry-After', 'Idempotent-Replayed', memprof.HEADER])
+
+inflight = AsyncSingleFlight()
+admission = AsyncAdmissionController()
+UNLIMITED_ROUTES = {'metrics', 'health', 'usage'}
+# Pricing tasks that outlive their request (time budgets) and the job writes
+# they finish with; asyncio only keeps weak references to tasks
+background_tasks = set()
+
+@app.before_serving
+async def startup():
+    # asyncio.to_thread runs on the loop's default executor
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=ASYNC_CPU_WORKERS, thread_name_prefix='cpu'))
+    # Trace allocations per request when MEMORY_PROFILE is set
+    memprof.start()
+    warmup.start()
+    await async_upstream.warm_up([
+        (async_upstream.http_client(), warmup.EDENAI_URL),
+        (async_upstream.http_client(), warmup.STORAGE_URL),
+        (pricing.async_openai_http, str(pricing.async_client.base_url)),
+        (pricing.async_groq_http, str(pricing.async_client_groq.base_url)),
+    ])
+
+@app.after_serving
+async def shutdown():
+    await async_upstream.close()
+
+@app.before_request
+async def admit_request():
+    """Wait for an admission slot, or shed the request with 429/503 and Retry-After."""
+    route = route_name(request.url_rule)
+    # Unmatched paths go straight to their 404
+    if route is None:
+        return None
+    # Verifying the ID token can fetch Google's signing certificates; keep
+    # that off the event loop
+    g.user_id = await asyncio.to_thread(auth.verified_user, request.headers.get('Authorization'))
+    accounting.begin(route, g.user_id)
+    if request.method == 'OPTIONS' or route in UNLIMITED_ROUTES:
+        return None
+    try:
+        g.admission = (route, await admission.acquire(route))
+    except Rejected as e:
+        print(f"[/{route}] Shed: {e}")
+        return jsonify({'error': str(e)}), e.status, {'Retry-After': str(e.retry_after)}
+
+@app.teardown_request
+async def release_admission(exc):
+    # Each request runs in its own task and context, so the accounting
+    # attribution needs no reset
+    if 'admission' in g:
+        await admission.release(*g.pop('admission'))
+
+@app.before_request
+async def begin_memory_profile():
+    """Profile this request's memory use by stage (only with MEMORY_PROFILE)."""
+    route = route_name(request.url_rule)
+    if route is not None:
+        g.memory_profile = memprof.begin(route)
+
+@app.after_request
+async def add_memory_profile(response):
+    memprof.finish(g.pop('memory_profile', None), response.headers)
+    return response
+
+@app.teardown_request
+async def end_memory_profile(exc):
+    # Requests that failed before a response was built
+    if 'memory_profile' in g:
+        memprof.end(g.pop('memory_profile'))
+
+async def analyze_detected_object(obj):
+    """Analyze a single detected object, falling back to its label if analysis fails."""
+    try:
+        return analyzed_object(obj, await analyze_image_async(*pricing_image(obj)))
+    except Exception as e:
+        print(f"Error analyzing object: {str(e)}")
+        return fallback_object(obj)
+
+async def analyze_within_deadline(detected_objects, deadline):
+    """Price objects concurrently, most prominent first, until a deadline.
+
+    Returns:
+        tuple: (analyzed objects with placeholders, dict of unfinished task -> index)
+    """
+    tasks = {asyncio.ensure_future(analyze_detected_object(detected_objects[i])): i
+             for i in pricing_order(detected_objects)}
+    analyzed_objects = [pending_object(obj) for obj in detected_objects]
+    if not tasks:
+        return analyzed_objects, {}
+    timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+    done, not_done = await asyncio.wait(tasks, timeout=timeout)
+    for task in done:
+        analyzed_objects[tasks[task]] = task.result()
+    return analyzed_objects, {task: tasks[task] for task in not_done}
+
+def complete_job(job_id, index, task):
+    # Tasks still pricing are cancelled at shutdown; their job just stays pending
+    if task.cancelled():
+        return
+    write = asyncio.get_running_loop().run_in_executor(None, get_job_store().complete, job_id, index, task.result())
+    background_tasks.add(write)
+    write.add_done_callback(background_tasks.discard)
+
+async def defer_pending(analyzed_objects, pending):
+    """Register a job that collects objects still being priced after the response."""
+    if not pending:
+        return None
+    job_id = await asyncio.to_thread(get_job_store().create, analyzed_objects, pending.values())
+    for task, index in pending.items():
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+        task.add_done_callback(lambda t, index=index: complete_job(job_id, index, t))
+    print(f"Deadline reached with {len(pending)} objects still pricing, job {job_id}")
+    return job_id
+
+async def detect_objects_in(image_data, crop_format, crop_quality, crop_output, tiled):
+    """Detect and crop objects, awaiting the detection call instead of blocking on it."""
+    image_data = load_image_bytes(image_data)
+    image_size = read_image_size(image_data)
+    if image_size is None or should_tile(image_size, tiled):
+        # Tiled detection fans out its own calls; run the sync pipeline on a thread
+        return await asyncio.to_thread(detect_and_crop_objects, image_data, crop_format, crop_quality, crop_output,
+                                       tiled)
+    url, kwargs = detection_request(image_data)
+    detections = parse_detections(await async_upstream.post('edenai', url, **kwargs))
+    return await asyncio.to_thread(detect_and_crop_objects, image_data, crop_format, crop_quality, crop_output,
+                                   tiled, detections)
+
+async def run_detection(image_url, crop_format, crop_quality, crop_output, prior_objects=None, prior_image_url=None,
+                        tiled=False, deadline=None):
+    """Async counterpart of app.run_detection.
+
+    Returns:
+        tuple: (analyzed objects ready for the response, job id or None)
+    """
+    with memprof.stage('download'):
+        body = await async_upstream.download(image_url)
+    with body:
+        with memprof.stage('detect'):
+            detected_objects = await detect_objects_in(body.buffer(), crop_format, crop_quality, crop_output, tiled)
+        reusable = {}
+        if prior_objects:
+            with memprof.stage('reuse'):
+                with await async_upstream.download(prior_image_url) as prior_body:
+                    reusable = await asyncio.to_thread(find_reusable, body.buffer(), detected_objects,
+                                                       prior_objects, prior_body.buffer())
+    for obj in detected_objects:
+        if 'image_ref' in obj:
+            obj['image_url'] = url_for('get_blob', key=obj['image_ref'], _external=True)
+    print(f"Reusing {len(reusable)} of {len(detected_objects)} objects from the prior photo")
+
+    # Only price objects that are new or changed since the prior photo
+    to_price = [obj for i, obj in enumerate(detected_objects) if i not in reusable]
+    with memprof.stage('price'):
+        priced, pending = await analyze_within_deadline(to_price, deadline)
+    analyzed_objects, pending = merge_priced(detected_objects, reusable, priced, pending)
+    job_id = await defer_pending(analyzed_objects, pending)
+    return analyzed_objects, job_id
+
+def _error(route, e, status, headers=None):
+    error_response = {'error': str(e) if status != 500 else str(e)[:100]}
+    print(f"[/{route}] Error: {error_response}")
+    return jsonify(error_response), status, headers or {}
+
+@app.route('/detect', methods=['POST'])
+@idempotent_async('detect')
+async def detect_objects():
+    """Detect, crop and price the objects in a room photo (see app.detect_objects)."""
+    started = time.monotonic()
+    try:
+        parsed, error = parse_detect_request(await request.get_json())
+        if error:
+            return jsonify({'error': error}), 400
+        image_url, crop_options, detect_options = parsed
+        crop_output, crop_format, crop_quality = crop_options
+        prior_objects, prior_image_url, tiled, budget_ms = detect_options
+        deadline = started + budget_ms / 1000 if budget_ms else None
+
+        # Identical concurrent requests (retries, collaborators) share one run
+        analyzed_objects, job_id = await inflight.do(detect_key(image_url, crop_options, detect_options),
+                                                     run_detection, image_url, crop_format, crop_quality,
+                                                     crop_output, prior_objects, prior_image_url, tiled, deadline)
+
+        job_url = job_id and url_for('get_detect_job', job_id=job_id, _external=True)
+        print(f"[/detect] Response: {len(analyzed_objects)} objects")
+        with memprof.stage('respond'):
+            return jsonify(detect_response(analyzed_objects, job_id, job_url))
+
+    except Exception as e:
+        error_data, status, headers = error_response(e)
+        print(f"[/detect] Error: {error_data}")
+        return jsonify(error_data), status, headers
+
+@app.route('/detect-jobs/<job_id>', methods=['GET'])
+async def get_detect_job(job_id):
+    """Collect objects that were still being priced when a /detect budget ran out."""
+    job = await asyncio.to_thread(get_job_store().get, job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    analyzed_objects, pending = job
+    return jsonify({
+        'success': True,
+        'complete': pending == 0,
+        'pending': pending,
+        'detected_objects': analyzed_objects
+    })
+
+@app.route('/detect-video', methods=['POST'])
+@idempotent_async('detect-video')
+async def detect_video():
+    """Detect the distinct objects in a walkthrough video (see app.detect_video).
+
+    Keyframe selection and per-keyframe detection stay on a thread; the
+    download and the single pricing pass are async.
+    """
+    try:
+        json_data = await request.get_json()
+        if not json_data or 'url' not in json_data:
+            return jsonify({'error': 'No video URL provided'}), 400
+
+        crop_options, error = parse_crop_options(json_data)
+        if error:
+            return jsonify({'error': error}), 400
+        crop_output, crop_format, crop_quality = crop_options
+        video_url = json_data['url']
+
+        async def run():
+            path = await async_upstream.download_to_file(
+                video_url, MAX_VIDEO_BYTES, suffix=os.path.splitext(urlparse(video_url).path)[1])
+            try:
+                keyframe_count, detected_objects = await asyncio.to_thread(
+                    detect_video_objects, path, crop_format, crop_quality, crop_output)
+            finally:
+                os.unlink(path)
+            for obj in detected_objects:
+                if 'image_ref' in obj:
+                    obj['image_url'] = url_for('get_blob', key=obj['image_ref'], _external=True)
+            analyzed_objects = await asyncio.gather(*(analyze_detected_object(obj) for obj in detected_objects))
+            for obj, analyzed in zip(detected_objects, analyzed_objects):
+                analyzed['frame_index'] = obj['frame_index']
+                analyzed['seen_in_frames'] = obj['seen_in_frames']
+            return keyframe_count, list(analyzed_objects)
+
+        key = ('detect-video', normalize_url(video_url), crop_output, crop_format, crop_quality)
+        keyframe_count, analyzed_objects = await inflight.do(key, run)
+        return jsonify({
+            'success': True,
+            'keyframes': keyframe_count,
+            'detected_objects': analyzed_objects
+        })
+
+    except DownloadTooLarge as e:
+        return _error('detect-video', e, 413)
+    except RateLimitExceeded as e:
+        return _error('detect-video', e, 503, {'Retry-After': str(int(e.retry_after) + 1)})
+    except Exception as e:
+        return _error('detect-video', e, 500)
+
+@app.route('/analyze', methods=['POST'])
+async def analyze_image_endpoint():
+    """Analyze a single uploaded image (see app.analyze_image_endpoint)."""
+    files = await request.files
+    file = files.get('image')
+    if file is None:
+        return _error('analyze', 'No image file provided', 400)
+    if file.filename == '':
+        return _error('analyze', 'No selected file', 400)
+    if '.' not in file.filename or file.filename.rsplit('.', 1)[1].lower() not in {'png', 'jpg', 'jpeg'}:
+        return _error('analyze', 'Invalid file type', 400)
+
+    try:
+        image_base64 = base64.b64encode(file.read()).decode('utf-8')
+        analysis = await analyze_image_async(f"data:image/jpeg;base64,{image_base64}")
+        return jsonify({
+            'success': True,
+            'analysis': analysis
+        })
+    except Exception as e:
+        return _error('analyze', e, 500)
+
+async def hash_receipt_image(image_url):
+    """Async counterpart of receipts.hash_receipt_image."""
+    try:
+        with await async_upstream.download(image_url) as body:
+            return await asyncio.to_thread(image_hash, body.buffer())
+    except Exception as e:
+        print(f"Could not hash receipt image: {e}")
+        return None
+
+async def read_receipt_indexed(image_url, user_id=None):
+    """Async counterpart of receipts.read_receipt_indexed."""
+    async def read_text():
+        url, kwargs = ocr_request(image_url)
+        return parse_ocr(await async_upstream.post('edenai', url, **kwargs))
+
+    if not user_id or upload_owner(image_url) != user_id:
+        ocr_text = await read_text()
+        return {'text': ocr_text, 'analyzed_data': await analyze_receipt_text_async(ocr_text), 'duplicate': False}
+
+    index = get_index()
+    receipt_hash = await hash_receipt_image(image_url)
+    match = owned_match(receipt_hash is not None and await asyncio.to_thread(index.match_image, user_id, receipt_hash),
+                        user_id)
+    if match:
+        return duplicate_result(match, 'image')
+
+    ocr_text = await read_text()
+    fingerprint = text_fingerprint(ocr_text)
+    match = owned_match(fingerprint and await asyncio.to_thread(index.match_text, user_id, fingerprint), user_id)
+    if match:
+        await asyncio.to_thread(index.add, user_id, receipt_hash, fingerprint, image_url, original_id=match['id'])
+        return duplicate_result(match, 'text')
+
+    result = {'text': ocr_text, 'analyzed_data': await analyze_receipt_text_async(ocr_text)}
+    await asyncio.to_thread(index.add, user_id, receipt_hash, fingerprint, image_url, result)
+    return {**result, 'image_url': image_url, 'duplicate': False}
+
+@app.route('/read-receipt', methods=['POST'])
+@idempotent_async('read-receipt')
+async def read_receipt():
+    """Read and analyze a receipt image (see app.read_receipt)."""
+    try:
+        json_data = await request.get_json()
+        if not json_data or 'url' not in json_data:
+            return jsonify({'error': 'No image URL provided'}), 400
+        image_url = json_data['url']
+        # Verified once per request in admit_request
+        user_id = g.user_id
+
+        result = await inflight.do(('read-receipt', normalize_url(image_url), user_id),
+                                   read_receipt_indexed, image_url, user_id)
+        response_data = {
+            'success': True,
+            'text': result['text'],
+            'analyzed_data': result['analyzed_data'],
+            'duplicate': result['duplicate']
+        }
+        if result['duplicate']:
+            response_data['duplicate_of'] = result['duplicate_of']
+        return jsonify(response_data)
+
+    except RateLimitExceeded as e:
+        return _error('read-receipt', e, 503, {'Retry-After': str(int(e.retry_after) + 1)})
+    except Exception as e:
+        return _error('read-receipt', e, 500)
+
+@app.route('/proxy-image', methods=['POST'])
+async def proxy_image():
+    """Fetch an image from Firebase Storage and return it base64 encoded (see app.proxy_image)."""
+    try:
+        data = await request.get_json()
+        if not data or 'url' not in data:
+            return jsonify({'error': 'No image URL provided'}), 400
+        url = data['url']
+
+        async def run():
+            with await async_upstream.download(url) as body:
+                return base64.b64encode(body.buffer()).decode('utf-8')
+
+        image_base64 = await inflight.do(('proxy-image', normalize_url(url)), run)
+        return jsonify({
+            'base64Image': f'data:image/jpeg;base64,{image_base64}'
+        })
+
+    except DownloadTooLarge as e:
+        return _error('proxy-image', e, 413)
+    except Exception as e:
+        return _error('proxy-image', e, 500)
+
+async def redact_url(url, mode, targets):
+    """Download a document and redact it on the CPU threads (see redaction.redact_document)."""
+    try:
+        with await async_upstream.download(url) as body:
+            return await asyncio.to_thread(redact_document, body.buffer(), mode, targets)
+    except Exception as e:
+        print(f"Error redacting {url}: {str(e)}")
+        return {'error': str(e)[:100]}
+
+@app.route('/redact', methods=['POST'])
+async def redact_documents():
+    """Redact faces and text in a set of documents (see app.redact_documents)."""
+    try:
+        json_data = await request.get_json()
+        if not json_data:
+            return jsonify({'error': 'No document URLs provided'}), 400
+
+        options, error = parse_redact_options(json_data)
+        if error:
+            return jsonify({'error': error}), 400
+        urls, mode, targets = options
+
+        documents = await asyncio.gather(*(redact_url(url, mode, targets) for url in urls))
+        for url, document in zip(urls, documents):
+            document['url'] = url
+            if 'image_ref' in document:
+                document['image_url'] = url_for('get_blob', key=document['image_ref'], _external=True)
+        return jsonify({
+            'success': True,
+            'documents': documents
+        })
+
+    except Exception as e:
+        return _error('redact', e, 500)
+
+@app.route('/blobs/<key>', methods=['GET'])
+async def get_blob(key):
+    """Serve a stored blob by its content address (see app.get_blob)."""
+    if not is_valid_key(key):
+        return jsonify({'error': 'Invalid blob key'}), 400
+
+    store = get_blob_store()
+    if not store.exists(key):
+        return jsonify({'error': 'Blob not found'}), 404
+
+    source = store.path(key) if hasattr(store, 'path') else store.open(key)
+    return await send_file(source, mimetype=content_type(key), conditional=True, etag=key, max_age=31536000)
+
+@app.route('/metrics', methods=['GET'])
+async def metrics_endpoint():
+    return metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4'}
+
+@app.route('/health', methods=['GET'])
+async def health():
+    state = warmup.status()
+    return jsonify(state), 200 if state['status'] == 'ready' else 503
+
+@app.route('/usage', methods=['GET'])
+async def usage():
+    if not auth.is_admin(request.headers.get(auth.ADMIN_HEADER)):
+        return jsonify({'error': 'Forbidden'}), 403
+    return jsonify(accounting.summary())
+
+if __name__ == '__main__':
+    app.run(host='0.0.0.0', port=4000)
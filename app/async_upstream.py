@@ -0,0 +1,147 @@
+import os
+import time
+import asyncio
+import tempfile
+import httpx
+from dotenv import load_dotenv
+import cassette
+import ratelimit
+import upstream
+from singleflight import AsyncSingleFlight
+from convert_image import Download, DownloadTooLarge, MAX_DOWNLOAD_BYTES, DOWNLOAD_TIMEOUT, CHUNK_SIZE
+
+# asyncio counterparts of upstream.post, upstream.create_chat_completion and
+# convert_image.download for the async service mode. They share fingerprints,
+# cassettes, rate limits and accounting with the sync versions; only the
+# transport differs (one pooled httpx.AsyncClient, async provider SDKs), so a
+# slow upstream call costs a coroutine instead of a thread.
+#
+#   ASYNC_MAX_CONNECTIONS   connection pool size of the shared HTTP client
+#   UPSTREAM_TIMEOUT        timeout for provider calls, in seconds
+
+load_dotenv()
+
+ASYNC_MAX_CONNECTIONS = int(os.getenv('ASYNC_MAX_CONNECTIONS', 200))
+UPSTREAM_TIMEOUT = float(os.getenv('UPSTREAM_TIMEOUT', 120))
+
+# Created lazily: an httpx.AsyncClient is bound to the event loop it first runs on
+_client = None
+_inflight = AsyncSingleFlight()
+
+def http_client():
+    """Return the shared pooled HTTP client for Eden AI and Firebase Storage."""
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=ASYNC_MAX_CONNECTIONS,
+                                max_keepalive_connections=ASYNC_MAX_CONNECTIONS // 4),
+            timeout=UPSTREAM_TIMEOUT, follow_redirects=True)
+    return _client
+
+async def close():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+def _httpx_kwargs(kwargs):
+    """Adapt requests-style keyword arguments for httpx."""
+    kwargs = dict(kwargs)
+    if 'files' in kwargs:
+        # httpx wants bytes for file contents, not the download's memoryview
+        kwargs['files'] = {name: (filename, bytes(content), *rest)
+                           for name, (filename, content, *rest) in kwargs['files'].items()}
+    return kwargs
+
+async def post(service, url, **kwargs):
+    """Async counterpart of upstream.post.
+
+    Returns:
+        Live httpx.Response, or a replayed requests.Response in replay mode
+    """
+    key = upstream.http_fingerprint(service, url, kwargs)
+    if cassette.mode() == 'replay':
+        # Replay sleeps for the recorded latency
+        return await asyncio.to_thread(upstream.replay_http, key, service, url)
+    return await _inflight.do(key, _post, key, service, url, kwargs)
+
+async def _post(key, service, url, kwargs):
+    await ratelimit.acquire_async(service)
+    started = time.perf_counter()
+    response = await http_client().post(url, **_httpx_kwargs(kwargs))
+    upstream.finish_http(key, service, url, response, time.perf_counter() - started)
+    return response
+
+async def create_chat_completion(service, client, **kwargs):
+    """Async counterpart of upstream.create_chat_completion, on an AsyncOpenAI/AsyncGroq client."""
+    key = upstream.chat_fingerprint(service, kwargs)
+    if cassette.mode() == 'replay':
+        return await asyncio.to_thread(upstream.replay_chat, key, kwargs)
+    return await _inflight.do(key, _create_chat_completion, key, service, client, kwargs)
+
+async def _create_chat_completion(key, service, client, kwargs):
+    await ratelimit.acquire_async(service)
+    started = time.perf_counter()
+    response = await client.chat.completions.create(**kwargs)
+    upstream.finish_chat(key, service, kwargs, response, time.perf_counter() - started)
+    return response
+
+async def _stream_into(url, max_bytes, target):
+    async with http_client().stream('GET', url, timeout=DOWNLOAD_TIMEOUT) as response:
+        response.raise_for_status()
+
+        # Reject early when the server tells us the size up front
+        length = response.headers.get('Content-Length')
+        if length and length.isdigit() and int(length) > max_bytes:
+            raise DownloadTooLarge(f"Download of {length} bytes exceeds limit of {max_bytes} bytes")
+
+        size = 0
+        async for chunk in response.aiter_bytes(CHUNK_SIZE):
+            size += len(chunk)
+            if size > max_bytes:
+                raise DownloadTooLarge(f"Download exceeds limit of {max_bytes} bytes")
+            target.write(chunk)
+        return size, response.headers.get('Content-Type', '')
+
+async def download(url, max_bytes=None):
+    """Async counterpart of convert_image.download.
+
+    Returns:
+        Download: The downloaded body
+
+    Raises:
+        DownloadTooLarge: If Content-Length or the streamed body exceeds the cap
+        httpx.HTTPError: On network or HTTP errors
+    """
+    body = Download()
+    try:
+        _, body.content_type = await _stream_into(url, max_bytes or MAX_DOWNLOAD_BYTES, body)
+    except Exception:
+        body.close()
+        raise
+    return body
+
+async def download_to_file(url, max_bytes, suffix=''):
+    """Async counterpart of convert_image.download_to_file; the caller deletes the file."""
+    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as target:
+        try:
+            await _stream_into(url, max_bytes, target)
+        except Exception:
+            target.close()
+            os.unlink(target.name)
+            raise
+    return target.name
+
+async def warm_up(connections):
+    """Open pooled connections ahead of the first request.
+
+    Args:
+        connections (list): (httpx.AsyncClient, URL) pairs, e.g. the shared
+            client and the provider SDKs' clients with their base URLs
+    """
+    async def connect(client, url):
+        try:
+            await client.head(url, timeout=10)
+        except httpx.HTTPError as e:
+            print(f"Async warm-up of {url} failed: {e}")
+    await asyncio.gather(*(connect(client, url) for client, url in connections))
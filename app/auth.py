@@ -0,0 +1,69 @@
+import os
+import hmac
+import threading
+from dotenv import load_dotenv
+
+try:
+    import firebase_admin
+    from firebase_admin import auth as firebase_auth, exceptions as firebase_exceptions
+    from google.auth.credentials import AnonymousCredentials
+except ImportError:  # pip install -e '.[auth]'
+    firebase_admin = None
+
+# Caller identity. The frontend sends the signed-in user's Firebase ID token
+# as 'Authorization: Bearer <token>'; a user id is only taken from a token
+# that verifies against the Firebase project's signing keys, never from a
+# header the client can set to anything. Without firebase-admin installed or
+# FIREBASE_PROJECT_ID set, every request is anonymous.
+#
+# Operator endpoints (/usage) take a shared secret in the X-Admin-Token header
+# instead and are disabled while ADMIN_TOKEN is unset.
+#
+#   FIREBASE_PROJECT_ID  Firebase project whose ID tokens are accepted
+#   ADMIN_TOKEN          secret for operator endpoints
+
+load_dotenv()
+
+FIREBASE_PROJECT_ID = os.getenv('FIREBASE_PROJECT_ID')
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN')
+ADMIN_HEADER = 'X-Admin-Token'
+
+_app = None
+_app_lock = threading.Lock()
+
+def _get_app():
+    global _app
+    with _app_lock:
+        if _app is None:
+            # Verifying ID tokens needs only the project id and Google's public
+            # keys, no service account
+            _app = firebase_admin.initialize_app(AnonymousCredentials(), options={'projectId': FIREBASE_PROJECT_ID},
+                                                 name='auth')
+        return _app
+
+def verified_user(authorization):
+    """Return the Firebase uid of a verified ID token.
+
+    Args:
+        authorization (str): Authorization header value, 'Bearer <ID token>'
+
+    Returns:
+        str: The token's uid, or None if there is no token, it does not
+        verify, or verification is not configured
+    """
+    if firebase_admin is None or not FIREBASE_PROJECT_ID or not authorization:
+        return None
+    scheme, _, token = authorization.partition(' ')
+    if scheme.lower() != 'bearer' or not token:
+        return None
+    try:
+        return firebase_auth.verify_id_token(token.strip(), app=_get_app())['uid']
+    except (ValueError, firebase_exceptions.FirebaseError) as e:
+        print(f"Rejected ID token: {str(e)[:100]}")
+        return None
+
+def is_admin(token):
+    """Check an X-Admin-Token header value against ADMIN_TOKEN."""
+    if not ADMIN_TOKEN or not token:
+        return False
+    return hmac.compare_digest(token.encode('utf-8'), ADMIN_TOKEN.encode('utf-8'))
@@ -0,0 +1,138 @@
+import os
+import re
+import time
+import hashlib
+import importlib
+import tempfile
+import threading
+from dotenv import load_dotenv
+
+# Content-addressed storage for crops and other generated images, so responses
+# can carry short references instead of inline base64 data URLs.
+#
+#   BLOB_STORE_BACKEND  'local' (default) or 'package.module:ClassName' for a
+#                       custom backend implementing put/open/exists
+#   BLOB_STORE_DIR      root directory for the local backend
+#   BLOB_STORE_TTL      seconds a local blob is kept after it was last stored
+#                       (0 keeps blobs forever)
+#
+# The local backend sweeps expired blobs in the background at most once per
+# SWEEP_INTERVAL, triggered by writes. Storing existing content again
+# restarts its TTL.
+
+load_dotenv()
+
+CONTENT_TYPES = {
+    'jpg': 'image/jpeg',
+    'webp': 'image/webp',
+    'png': 'image/png',
+}
+TTL = int(os.getenv('BLOB_STORE_TTL', 24 * 60 * 60))
+SWEEP_INTERVAL = 60 * 60
+KEY_PATTERN = re.compile(r'^[0-9a-f]{64}\.(%s)$' % '|'.join(CONTENT_TYPES))
+
+def make_key(data, extension):
+    """Build the content address for a blob.
+
+    Args:
+        data (bytes-like): Blob contents
+        extension (str): File extension, one of CONTENT_TYPES
+
+    Returns:
+        str: '<sha256>.<extension>'
+    """
+    return f'{hashlib.sha256(data).hexdigest()}.{extension}'
+
+def is_valid_key(key):
+    return bool(KEY_PATTERN.match(key))
+
+def content_type(key):
+    return CONTENT_TYPES[key.rsplit('.', 1)[1]]
+
+class LocalBlobStore:
+    """Blob store backed by a local directory, fanned out by key prefix.
+
+    Args:
+        root (str): Directory to store blobs in
+        ttl (int): Seconds a blob is kept after it was last stored, 0 for ever
+    """
+
+    def __init__(self, root, ttl=TTL):
+        self.root = root
+        self.ttl = ttl
+        self._last_sweep = None
+        self._sweep_lock = threading.Lock()
+
+    def path(self, key):
+        return os.path.join(self.root, key[:2], key[2:4], key)
+
+    def exists(self, key):
+        return os.path.exists(self.path(key))
+
+    def put(self, data, extension):
+        """Store a blob, returning its key. Storing existing content is a no-op."""
+        key = make_key(data, extension)
+        target = self.path(key)
+        try:
+            # Restart the TTL of content that is already stored
+            os.utime(target)
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            # Write to a temp file first so readers never see a partial blob
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(target))
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, target)
+        self._schedule_sweep()
+        return key
+
+    def open(self, key):
+        return open(self.path(key), 'rb')
+
+    def sweep(self):
+        """Delete blobs (and abandoned temp files) older than the TTL.
+
+        Returns:
+            int: Number of files removed
+        """
+        cutoff = time.time() - self.ttl
+        removed = 0
+        for directory, _, names in os.walk(self.root):
+            for name in names:
+                path = os.path.join(directory, name)
+                try:
+                    if os.stat(path).st_mtime < cutoff:
+                        os.remove(path)
+                        removed += 1
+                except FileNotFoundError:
+                    pass
+        if removed:
+            print(f"Blob store: removed {removed} expired blobs")
+        return removed
+
+    def _schedule_sweep(self):
+        if not self.ttl:
+            return
+        now = time.monotonic()
+        with self._sweep_lock:
+            if self._last_sweep is not None and now - self._last_sweep < SWEEP_INTERVAL:
+                return
+            self._last_sweep = now
+        threading.Thread(target=self.sweep, name='blob-sweep', daemon=True).start()
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_blob_store():
+    """Return the configured blob store backend (created once per process)."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            backend = os.getenv('BLOB_STORE_BACKEND', 'local')
+            if backend == 'local':
+                root = os.getenv('BLOB_STORE_DIR', os.path.join(os.path.dirname(__file__), 'blobs'))
+                _store = LocalBlobStore(root)
+            else:
+                module_name, class_name = backend.split(':')
+                _store = getattr(importlib.import_module(module_name), class_name)()
+        return _store
@@ -0,0 +1,118 @@
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from dotenv import load_dotenv
+
+# Cassettes record upstream (Eden AI / OpenAI / Groq) responses so a slow or
+# failing request can be replayed locally without paying for the calls again.
+#
+#   CASSETTE_MODE=record  append every upstream response to the cassette
+#   CASSETTE_MODE=replay  serve responses from the cassette, never hit upstream
+#   CASSETTE_PATH         cassette file (gzip-compressed JSON lines)
+#   CASSETTE_LATENCY_SCALE  replayed latency multiplier (1 = original, 0 = none)
+
+load_dotenv()
+
+DEFAULT_PATH = os.path.join(os.path.dirname(__file__), 'cassettes', 'upstream.jsonl.gz')
+
+class CassetteMiss(LookupError):
+    """Raised in replay mode when no recorded response matches a request."""
+
+_lock = threading.Lock()
+_index = None
+_cursors = {}
+
+def mode():
+    """Return the active cassette mode: 'off', 'record' or 'replay'."""
+    return os.getenv('CASSETTE_MODE', 'off').lower()
+
+def path():
+    return os.getenv('CASSETTE_PATH', DEFAULT_PATH)
+
+def latency_scale():
+    return float(os.getenv('CASSETTE_LATENCY_SCALE', '1'))
+
+def _canonical(value):
+    """Turn request payloads into something json.dumps can hash stably."""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return {'sha256': hashlib.sha256(value).hexdigest()}
+    if isinstance(value, dict):
+        return {str(k): _canonical(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_canonical(v) for v in value]
+    return value
+
+def fingerprint(service, endpoint, payload):
+    """Hash a request into a stable fingerprint.
+
+    Credentials live in headers, which are deliberately left out so cassettes
+    recorded with one API key replay under another.
+
+    Args:
+        service (str): Upstream name, e.g. 'edenai' or 'openai'
+        endpoint (str): URL or API method being called
+        payload (dict): Request body/parameters
+
+    Returns:
+        str: Hex digest identifying the request
+    """
+    blob = json.dumps([service, endpoint, _canonical(payload)], sort_keys=True, default=str)
+    return hashlib.sha256(blob.encode('utf-8')).hexdigest()
+
+def _load_index():
+    global _index
+    if _index is None:
+        _index = {}
+        if os.path.exists(path()):
+            with gzip.open(path(), 'rt', encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        _index.setdefault(entry['fingerprint'], []).append(entry)
+    return _index
+
+def record(entry):
+    """Append an entry to the cassette.
+
+    Each write is its own gzip member, so the file stays valid if the process
+    dies mid-recording and can be read back with a single gzip.open.
+    """
+    line = json.dumps(entry, separators=(',', ':')) + '\n'
+    with _lock:
+        os.makedirs(os.path.dirname(os.path.abspath(path())), exist_ok=True)
+        with gzip.open(path(), 'at', encoding='utf-8') as f:
+            f.write(line)
+        if _index is not None:
+            _index.setdefault(entry['fingerprint'], []).append(entry)
+
+def replay(key):
+    """Return the recorded entry for a fingerprint, sleeping for its latency.
+
+    Repeated identical requests are served the recorded responses in order,
+    wrapping around once all of them have been used.
+
+    Raises:
+        CassetteMiss: If the fingerprint was never recorded
+    """
+    with _lock:
+        entries = _load_index().get(key)
+        if not entries:
+            raise CassetteMiss(f'No recorded response for request {key[:12]} in {path()}')
+        cursor = _cursors.get(key, 0)
+        _cursors[key] = cursor + 1
+        entry = entries[cursor % len(entries)]
+
+    delay = entry.get('latency', 0) * latency_scale()
+    if delay > 0:
+        time.sleep(delay)
+    return entry
+
+def reset():
+    """Forget the loaded index so the cassette is re-read on next replay."""
+    global _index
+    with _lock:
+        _index = None
+        _cursors.clear()
@@ -1,7 +1,187 @@
+import io
+import os
+import mmap
+import tempfile
 import requests
 import base64
 from typing import Optional
-from urllib.parse import urlparse
+from urllib.parse import urlparse, urlunparse, parse_qsl, urlencode
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Downloads are streamed into a spooled buffer: small bodies stay in memory,
+# larger ones roll over to a temporary file (read back through mmap), and
+# anything over the cap is rejected before it is read in full.
+MAX_DOWNLOAD_BYTES = int(os.getenv('MAX_DOWNLOAD_BYTES', 25 * 1024 * 1024))
+DOWNLOAD_SPOOL_BYTES = int(os.getenv('DOWNLOAD_SPOOL_BYTES', 8 * 1024 * 1024))
+DOWNLOAD_TIMEOUT = float(os.getenv('DOWNLOAD_TIMEOUT', 30))
+CHUNK_SIZE = 64 * 1024
+
+# Keep-alive connection pool shared by all downloads
+session = requests.Session()
+session.mount('https://', requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
+class DownloadTooLarge(ValueError):
+    """Raised when a download exceeds the configured size cap."""
+
+class Download:
+    """A downloaded body, in memory up to DOWNLOAD_SPOOL_BYTES and in a temporary file beyond.
+
+    Filled through write() while streaming. Use as a context manager so the
+    memory or temp file, and every view handed out by buffer(), are released
+    as soon as the caller is done with it.
+    """
+
+    def __init__(self, spool_bytes: int = DOWNLOAD_SPOOL_BYTES):
+        self._spool_bytes = spool_bytes
+        self._memory = io.BytesIO()
+        self._file = None
+        self._map = None
+        self._views = []
+        self.size = 0
+        self.content_type = ''
+
+    def write(self, data: bytes):
+        if self._file is None and self.size + len(data) > self._spool_bytes:
+            # Roll over to a temporary file
+            self._file = tempfile.TemporaryFile()
+            with self._memory.getbuffer() as spooled:
+                self._file.write(spooled)
+            self._memory.close()
+            self._memory = None
+        (self._file or self._memory).write(data)
+        self.size += len(data)
+
+    def buffer(self) -> memoryview:
+        """Return a zero-copy view of the body, suitable for np.frombuffer.
+
+        The view is released by close(); objects made from it (numpy arrays)
+        must not outlive the download.
+        """
+        if self.size == 0:
+            return memoryview(b'')
+        if self._file is not None:
+            if self._map is None:
+                self._file.flush()
+                self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+                # The mapping stays valid without the descriptor
+                self._file.close()
+            view = memoryview(self._map)
+        else:
+            view = self._memory.getbuffer()
+        self._views.append(view)
+        return view
+
+    def close(self):
+        """Release the views handed out by buffer(), then the body itself.
+
+        Raises:
+            BufferError: If something made from a view (e.g. a numpy array)
+            is still alive
+        """
+        while self._views:
+            self._views[-1].release()
+            self._views.pop()
+        if self._map is not None:
+            self._map.close()
+        if self._memory is not None:
+            self._memory.close()
+        if self._file is not None:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.close()
+        except BufferError:
+            if exc_type is None:
+                raise
+            # The failing call's traceback still holds arrays made from the
+            # body; it is freed along with them. Report the original error.
+            print(f"Download still referenced after {exc_type.__name__}, released with the traceback")
+
+def _stream_into(url: str, max_bytes: int, target) -> tuple:
+    """Stream a URL into a writable file object, enforcing the size cap.
+
+    Returns:
+        tuple: (bytes written, response Content-Type)
+    """
+    with session.get(url, stream=True, timeout=DOWNLOAD_TIMEOUT) as response:
+        response.raise_for_status()
+
+        # Reject early when the server tells us the size up front
+        length = response.headers.get('Content-Length')
+        if length and length.isdigit() and int(length) > max_bytes:
+            raise DownloadTooLarge(f"Download of {length} bytes exceeds limit of {max_bytes} bytes")
+
+        size = 0
+        for chunk in response.iter_content(CHUNK_SIZE):
+            size += len(chunk)
+            if size > max_bytes:
+                raise DownloadTooLarge(f"Download exceeds limit of {max_bytes} bytes")
+            target.write(chunk)
+        return size, response.headers.get('Content-Type', '')
+
+def download(url: str, max_bytes: Optional[int] = None) -> Download:
+    """Stream a URL into a size-capped spooled buffer.
+
+    Args:
+        url: URL to fetch
+        max_bytes: Size cap, defaults to MAX_DOWNLOAD_BYTES
+
+    Returns:
+        Download: The downloaded body
+
+    Raises:
+        DownloadTooLarge: If Content-Length or the streamed body exceeds the cap
+        requests.exceptions.RequestException: On network or HTTP errors
+    """
+    body = Download()
+    try:
+        _, body.content_type = _stream_into(url, max_bytes or MAX_DOWNLOAD_BYTES, body)
+    except Exception:
+        body.close()
+        raise
+    return body
+
+def download_to_file(url: str, max_bytes: int, suffix: str = '') -> str:
+    """Stream a URL into a named temporary file, for readers that need a path.
+
+    The caller is responsible for deleting the file.
+
+    Args:
+        url: URL to fetch
+        max_bytes: Size cap
+        suffix: File name suffix, e.g. '.mp4'
+
+    Returns:
+        str: Path of the temporary file
+
+    Raises:
+        DownloadTooLarge: If Content-Length or the streamed body exceeds the cap
+        requests.exceptions.RequestException: On network or HTTP errors
+    """
+    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as target:
+        try:
+            _stream_into(url, max_bytes, target)
+        except Exception:
+            target.close()
+            os.unlink(target.name)
+            raise
+    return target.name
+
+def normalize_url(url: str) -> str:
+    """Normalize a URL so equivalent spellings compare equal.
+
+    Lower-cases the scheme and host, drops the fragment and sorts the query
+    parameters (Firebase download tokens are kept, they select the object).
+    """
+    parts = urlparse(url.strip())
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunparse((parts.scheme.lower(), parts.netloc.lower(), parts.path, parts.params, query, ''))
 
 def url_to_base64(image_url: str) -> Optional[str]:
     try:
@@ -9,15 +189,11 @@ def url_to_base64(image_url: str) -> Optional[str]:
         result = urlparse(image_url)
         if not all([result.scheme, result.netloc]):
             raise ValueError("Invalid URL format")
-            
-        # Download the image
-        response = requests.get(image_url)
-        response.raise_for_status()
-        
-        # Convert to base64
-        image_base64 = base64.b64encode(response.content).decode('utf-8')
-        return image_base64
-        
+
+        # Download the image and convert to base64
+        with download(image_url) as body:
+            return base64.b64encode(body.buffer()).decode('utf-8')
+
     except requests.exceptions.RequestException as e:
         print(f"Error downloading image: {e}")
         return None
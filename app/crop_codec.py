@@ -0,0 +1,95 @@
+import os
+import cv2
+from dotenv import load_dotenv
+
+# Crop encoders, shared by detection and crop_pool's worker processes. The
+# pool pickles a reference to encode_crop_variants, so a worker imports this
+# module to run it: keep it a leaf that needs only OpenCV, not detection and
+# its upstream, blob store and profiling imports.
+#
+# Crops sent for pricing are resized for the vision model instead of going at
+# client resolution: high detail is billed per 512px tile, so high-detail crops
+# are fitted to a grid of at most PRICING_MAX_TILES tiles. Only crops that
+# already fit one tile go at low detail (one flat-cost 512px image): how much
+# detail the model needs to read brand or model text does not follow from
+# the detector's confidence, so larger crops always keep high detail.
+#
+#   PRICING_MAX_TILES     tile budget for a high-detail crop
+#   PRICING_CROP_QUALITY  JPEG quality of pricing crops
+
+load_dotenv()
+
+VISION_TILE_SIZE = 512
+PRICING_MAX_TILES = int(os.getenv('PRICING_MAX_TILES', 4))
+PRICING_CROP_QUALITY = int(os.getenv('PRICING_CROP_QUALITY', 85))
+
+# Crop encodings a client can ask for: (extension, content type, quality flag)
+CROP_FORMATS = {
+    'jpeg': ('jpg', 'image/jpeg', cv2.IMWRITE_JPEG_QUALITY),
+    'webp': ('webp', 'image/webp', cv2.IMWRITE_WEBP_QUALITY),
+}
+
+def encode_crop_bytes(cropped, crop_format='jpeg', quality=None):
+    """Encode a cropped image in the requested format.
+
+    Args:
+        cropped (numpy.ndarray): Cropped BGR image
+        crop_format (str): One of CROP_FORMATS
+        quality (int): Encoder quality (1-100), encoder default if None
+
+    Returns:
+        bytes: Encoded image
+    """
+    extension, _, quality_flag = CROP_FORMATS[crop_format]
+    params = [quality_flag, int(quality)] if quality else []
+    _, buffer = cv2.imencode(f'.{extension}', cropped, params)
+    return buffer.tobytes()
+
+def pricing_detail(width, height):
+    """Choose the vision detail level for pricing a crop.
+
+    Args:
+        width (int): Crop width in pixels
+        height (int): Crop height in pixels
+
+    Returns:
+        str: 'low' for crops that fit one tile, else 'high'
+    """
+    return 'low' if max(width, height) <= VISION_TILE_SIZE else 'high'
+
+def pricing_size(width, height, detail, max_tiles=None):
+    """Size a crop for pricing so it lands on the vision model's tile grid.
+
+    Low detail fits the crop inside one tile. High detail picks the grid of
+    at most ``max_tiles`` tiles (e.g. 2x2, 4x1) that keeps the most
+    resolution, and fits the crop inside it. Crops are never upscaled.
+
+    Returns:
+        tuple: (width, height) to resize to
+    """
+    max_tiles = max_tiles or PRICING_MAX_TILES
+    if detail == 'low':
+        scale = VISION_TILE_SIZE / max(width, height)
+    else:
+        scale = max(min(cols * VISION_TILE_SIZE / width, rows * VISION_TILE_SIZE / height)
+                    for cols in range(1, max_tiles + 1) for rows in range(1, max_tiles // cols + 1))
+    scale = min(scale, 1.0)
+    return max(1, int(width * scale)), max(1, int(height * scale))
+
+def encode_crop_variants(cropped, detail, crop_format='jpeg', quality=None):
+    """Encode a crop for the client and a resized JPEG copy for pricing.
+
+    Args:
+        cropped (numpy.ndarray): Cropped BGR image
+        detail (str): Vision detail level the pricing copy is sized for
+        crop_format (str): Client crop encoding, one of CROP_FORMATS
+        quality (int): Client encoder quality (1-100), encoder default if None
+
+    Returns:
+        tuple: (client crop bytes, pricing crop bytes)
+    """
+    height, width = cropped.shape[:2]
+    size = pricing_size(width, height, detail)
+    resized = cropped if size == (width, height) else cv2.resize(cropped, size, interpolation=cv2.INTER_AREA)
+    _, buffer = cv2.imencode('.jpg', resized, [cv2.IMWRITE_JPEG_QUALITY, PRICING_CROP_QUALITY])
+    return encode_crop_bytes(cropped, crop_format, quality), buffer.tobytes()
@@ -0,0 +1,117 @@
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+from dotenv import load_dotenv
+import crop_worker
+
+# Execution backend for the crop-and-encode stage of detection.
+#
+# Small jobs run in the calling thread. Large ones (many objects or big crops)
+# are fanned out to a process pool; the decoded image is placed in shared
+# memory once and every worker maps it instead of receiving a pickled copy.
+# Workers are spawned (Flask serves requests from threads, so no fork()) and
+# set up by crop_worker.init; the encode functions they run live in leaf
+# modules (crop_codec) so a worker never imports detection and its upstream
+# clients. Spawning re-imports the launching script as __mp_main__, so entry
+# points keep their serving and warm-up under `if __name__ == '__main__'`.
+# The pool is only created in the serving process: a child process (a worker
+# itself, or anything else it spawns) always encodes in-thread.
+#
+#   CROP_WORKERS          process pool size (0 or 1 disables the pool)
+#   CROP_POOL_MIN_PIXELS  total crop pixels below which work stays in-thread
+
+load_dotenv()
+
+CROP_WORKERS = int(os.getenv('CROP_WORKERS', os.cpu_count() or 1))
+CROP_POOL_MIN_PIXELS = int(os.getenv('CROP_POOL_MIN_PIXELS', 8_000_000))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def _pool_enabled():
+    return CROP_WORKERS > 1 and multiprocessing.parent_process() is None
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=CROP_WORKERS, mp_context=multiprocessing.get_context('spawn'),
+                                            initializer=crop_worker.init)
+        return _executor
+
+def warm_up():
+    """Start every pool worker ahead of the first large job.
+
+    Spawned workers import numpy and OpenCV and load its codecs from scratch,
+    which otherwise lands on the first request big enough to use the pool.
+
+    Returns:
+        int: Number of worker processes started (0 when the pool is disabled)
+    """
+    if not _pool_enabled():
+        return 0
+    return len(set(_get_executor().map(crop_worker.warm, range(CROP_WORKERS))))
+
+def _partition(boxes, parts):
+    """Split box indices into ``parts`` groups with roughly equal pixel area."""
+    order = sorted(range(len(boxes)), key=lambda i: -(boxes[i][2] - boxes[i][0]) * (boxes[i][3] - boxes[i][1]))
+    groups = [[] for _ in range(parts)]
+    loads = [0] * parts
+    for i in order:
+        x_min, y_min, x_max, y_max = boxes[i]
+        target = loads.index(min(loads))
+        groups[target].append(i)
+        loads[target] += (x_max - x_min) * (y_max - y_min)
+    return [g for g in groups if g]
+
+def encode_crops(image, boxes, encode, args=None):
+    """Crop and encode every box, in a process pool when the job is large enough.
+
+    Args:
+        image (numpy.ndarray): Decoded image
+        boxes (list): Pixel boxes as (x_min, y_min, x_max, y_max)
+        encode (callable): Picklable function turning a crop into its output;
+            define it in a leaf module such as crop_codec, since every worker
+            imports the module it comes from
+        args (list): Optional per-box tuples of extra arguments for ``encode``
+
+    Returns:
+        list: ``encode`` results in the same order as ``boxes``
+    """
+    args = args or [()] * len(boxes)
+    pixels = sum(max(x_max - x_min, 0) * max(y_max - y_min, 0) for x_min, y_min, x_max, y_max in boxes)
+    if not _pool_enabled() or len(boxes) < 2 or pixels < CROP_POOL_MIN_PIXELS:
+        return [encode(image[y_min:y_max, x_min:x_max], *arg)
+                for (x_min, y_min, x_max, y_max), arg in zip(boxes, args)]
+
+    try:
+        shm = shared_memory.SharedMemory(create=True, size=image.nbytes)
+    except OSError as e:
+        # No /dev/shm (e.g. some serverless runtimes), stay in-thread
+        print(f"Shared memory unavailable, encoding crops in-thread: {e}")
+        return [encode(image[y_min:y_max, x_min:x_max], *arg)
+                for (x_min, y_min, x_max, y_max), arg in zip(boxes, args)]
+
+    try:
+        shared = np.ndarray(image.shape, dtype=image.dtype, buffer=shm.buf)
+        shared[...] = image
+        del shared
+
+        executor = _get_executor()
+        groups = _partition(boxes, CROP_WORKERS)
+        futures = [
+            executor.submit(crop_worker.encode_chunk, shm.name, image.shape, image.dtype.str, [boxes[i] for i in group], encode,
+                            [args[i] for i in group])
+            for group in groups
+        ]
+        results = [None] * len(boxes)
+        for group, future in zip(groups, futures):
+            for i, result in zip(group, future.result()):
+                results[i] = result
+        return results
+    finally:
+        shm.close()
+        shm.unlink()
@@ -0,0 +1,49 @@
+import os
+import time
+import cv2
+import numpy as np
+from multiprocessing import shared_memory
+
+# Functions run in crop_pool's worker processes. Workers import this module
+# (and the module of the encode function they are handed) on top of what
+# spawning brings in, so keep its imports to what cropping and encoding need.
+
+def _attach(name):
+    """Attach to the parent's shared memory block.
+
+    The parent owns and unlinks the block. Spawned workers share the parent's
+    resource tracker, so on Python < 3.13 re-registering the name is a no-op;
+    newer versions can skip tracking explicitly.
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:  # Python < 3.13
+        return shared_memory.SharedMemory(name=name)
+
+def encode_chunk(shm_name, shape, dtype, boxes, encode, args):
+    """Crop and encode a list of boxes from shared memory."""
+    shm = _attach(shm_name)
+    try:
+        image = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        results = [encode(image[y_min:y_max, x_min:x_max], *arg)
+                   for (x_min, y_min, x_max, y_max), arg in zip(boxes, args)]
+        del image
+        return results
+    finally:
+        shm.close()
+
+def init():
+    """Pool initializer: set up OpenCV for a worker process.
+
+    The workers already split the crops between them, so OpenCV's own thread
+    pool would only oversubscribe the cores. Encoding a tiny image loads the
+    codecs before the first real job.
+    """
+    cv2.setNumThreads(1)
+    cv2.imencode('.jpg', np.zeros((8, 8, 3), np.uint8))
+
+def warm(_):
+    """Report the worker's pid once it has started (for crop_pool.warm_up)."""
+    # Hold the worker briefly so every submission lands on a separate process
+    time.sleep(0.2)
+    return os.getpid()
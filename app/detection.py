@@ -1,82 +1,254 @@
 import json
-import requests
 from dotenv import load_dotenv
 import os
 import cv2
 import numpy as np
-from pathlib import Path
-import time
 import base64
+from functools import partial
+import upstream
+import crop_pool
+from crop_codec import CROP_FORMATS, encode_crop_bytes, encode_crop_variants, pricing_detail
+import memprof
+from image_header import read_image_size
+from blobstore import get_blob_store
+from tiling import should_tile, detect_tiled
 
 # Load environment variables for API configuration
 load_dotenv()
 
-def detect_and_crop_objects(input_data):
-    """Detect objects in an image and return cropped objects as base64 encoded images.
-    
-    This function:
-    1. Handles both local files and remote URLs
-    2. Uses Eden AI's object detection API to identify objects
-    3. Crops detected objects from the original image
-    4. Returns detected objects with base64 encoded images
-    
+# Minimum long side of an output crop; decoding is downscaled as far as this allows
+CROP_TARGET_SIZE = int(os.getenv('CROP_TARGET_SIZE', 1024))
+
+# OpenCV applies EXIF orientation for all of these, so normalized boxes line up
+# whichever factor is used
+REDUCED_DECODE_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+def load_image_bytes(input_data):
+    """Normalize the supported input formats to raw encoded image bytes.
+
     Args:
-        input_data (Union[str, bytes]): Image URL, file path, or binary data
-        
+        input_data (Union[str, bytes]): Data URL, base64 string or binary data
+
     Returns:
-        list: List of dictionaries containing object label, confidence, and base64 image
+        bytes: Encoded image bytes
     """
-    # Convert input_data to bytes if it's a string (likely base64)
     if isinstance(input_data, str):
         if input_data.startswith('data:'):
             # Handle data URL format
-            image_data = base64.b64decode(input_data.split(',')[1])
-        else:
-            # Assume it's a base64 string
-            image_data = base64.b64decode(input_data)
-    else:
-        # Already in bytes format
-        image_data = input_data
-    
-    # Convert to OpenCV format
-    nparr = np.frombuffer(image_data, np.uint8)
-    image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+            return base64.b64decode(input_data.split(',')[1])
+        # Assume it's a base64 string
+        return base64.b64decode(input_data)
+    # Already in bytes format
+    return input_data
+
+def decode_image(image_data, reduction=1):
+    """Decode encoded image bytes into an OpenCV BGR array.
+
+    Args:
+        image_data (bytes): Encoded image bytes
+        reduction (int): Downscale factor applied while decoding (1, 2, 4 or 8)
+
+    Returns:
+        numpy.ndarray: Decoded BGR image, rotated per its EXIF orientation
+    """
+    with memprof.stage('decode'):
+        image = cv2.imdecode(np.frombuffer(image_data, np.uint8), REDUCED_DECODE_FLAGS[reduction])
     if image is None:
         raise Exception('Failed to decode image')
-    
-    height, width = image.shape[:2]
-    
-    # Configure Eden AI API request
+    return image
+
+def choose_reduction(image_size, results, target=None):
+    """Pick the largest decode reduction that keeps every crop at the target size.
+
+    A crop keeps its native resolution if that is already below the target,
+    so small objects force a full-resolution decode.
+
+    Args:
+        image_size (tuple): Displayed (width, height) of the full image
+        results (list): Detected items with normalized box coordinates
+        target (int): Minimum long side in pixels for each output crop
+
+    Returns:
+        int: Reduction factor for decode_image
+    """
+    target = target or CROP_TARGET_SIZE
+    width, height = image_size
+    reduction = max(REDUCED_DECODE_FLAGS)
+    for obj in results:
+        long_side = max((obj['x_max'] - obj['x_min']) * width, (obj['y_max'] - obj['y_min']) * height)
+        wanted = min(target, long_side)
+        while reduction > 1 and long_side / reduction < wanted:
+            reduction //= 2
+    return reduction
+
+def request_detections(image_data):
+    """Send an image to Eden AI's object detection API.
+
+    Args:
+        image_data (bytes): Encoded image bytes
+
+    Returns:
+        list: Detected items with normalized box coordinates
+    """
+    url, kwargs = detection_request(image_data)
+    return parse_detections(upstream.post('edenai', url, **kwargs))
+
+def detection_request(image_data):
+    """Build the Eden AI object detection call, shared by the sync and async paths.
+
+    Returns:
+        tuple: (endpoint URL, keyword arguments for upstream.post)
+    """
     API_KEY = os.getenv('EDEN_API')
     url = 'https://api.edenai.run/v2/image/object_detection'
     data = {'providers': 'api4ai'}
     files = {'file': ('image.jpg', image_data, 'image/jpeg')}
-    
-    # Send request to Eden AI for object detection
-    response = requests.post(url, data=data, files=files, headers={'Authorization': f'Bearer {API_KEY}'})
-    results = json.loads(response.text)['api4ai']['items']
-    
-    # Process each detected object
+    return url, {'data': data, 'files': files, 'headers': {'Authorization': f'Bearer {API_KEY}'}}
+
+def parse_detections(response):
+    """Extract the detected items from an Eden AI object detection response."""
+    return json.loads(response.text)['api4ai']['items']
+
+def crop_boxes(image_shape, results):
+    """Convert normalized detection boxes to pixel coordinates.
+
+    Args:
+        image_shape (tuple): Shape of the decoded image
+        results (list): Detected items with normalized box coordinates
+
+    Returns:
+        list: Pixel boxes as (x_min, y_min, x_max, y_max)
+    """
+    height, width = image_shape[:2]
+    return [
+        (int(obj['x_min'] * width), int(obj['y_min'] * height),
+         int(obj['x_max'] * width), int(obj['y_max'] * height))
+        for obj in results
+    ]
+
+def crop_objects(image, results):
+    """Crop detected objects out of a decoded image.
+
+    Args:
+        image (numpy.ndarray): Decoded BGR image
+        results (list): Detected items with normalized box coordinates
+
+    Returns:
+        list: Cropped views of the image, one per detected item
+    """
+    return [image[y_min:y_max, x_min:x_max] for x_min, y_min, x_max, y_max in crop_boxes(image.shape, results)]
+
+def encode_crop(cropped, crop_format='jpeg', quality=None):
+    """Encode a cropped image as a data URL.
+
+    Args:
+        cropped (numpy.ndarray): Cropped BGR image
+        crop_format (str): One of CROP_FORMATS
+        quality (int): Encoder quality (1-100), encoder default if None
+
+    Returns:
+        str: Data URL, JPEG by default
+    """
+    return to_data_url(encode_crop_bytes(cropped, crop_format, quality), crop_format)
+
+def to_data_url(data, crop_format='jpeg'):
+    base64_image = base64.b64encode(data).decode('utf-8')
+    return f'data:{CROP_FORMATS[crop_format][1]};base64,{base64_image}'
+
+def detect_and_crop_objects(input_data, crop_format='jpeg', crop_quality=None, crop_output='inline', tiled=False,
+                            detections=None):
+    """Detect objects in an image and return cropped objects as base64 encoded images.
+
+    This function:
+    1. Handles both local files and remote URLs
+    2. Uses Eden AI's object detection API to identify objects
+    3. Crops detected objects from the original image
+    4. Returns detected objects with base64 encoded images
+
+    Args:
+        input_data (Union[str, bytes]): Image URL, file path, or binary data
+        crop_format (str): Crop encoding, one of CROP_FORMATS
+        crop_quality (int): Encoder quality (1-100), encoder default if None
+        crop_output (str): 'inline' for data URLs ('image_data'), 'reference'
+            to write each crop to the blob store and return its key as 'image_ref'
+        tiled (Union[bool, str]): Detect on overlapping tiles (one detection
+            call per tile); 'auto' tiles only very large and panoramic images
+        detections (list): Detection results already fetched for this image
+            (async mode); skips the detection call and tiling
+
+    Returns:
+        list: List of dictionaries containing object label, confidence,
+        normalized box, crop dimensions, base64 image or blob key, and a
+        resized base64 copy with its detail level for pricing
+    """
+    image_data = load_image_bytes(input_data)
+
+    # Read the size from the header; fall back to a full decode, which also
+    # rejects undecodable input before paying for detection
+    image_size = read_image_size(image_data)
+    image = None
+    if image_size is None:
+        image = decode_image(image_data)
+        image_size = (image.shape[1], image.shape[0])
+
+    if detections is not None:
+        results = detections
+        if image is None:
+            image = decode_image(image_data, choose_reduction(image_size, results))
+    elif should_tile(image_size, tiled):
+        # Tiles need full-resolution pixels, which the crops then reuse
+        if image is None:
+            image = decode_image(image_data)
+        results = detect_tiled(image, request_detections)
+    else:
+        # Send request to Eden AI for object detection
+        results = request_detections(image_data)
+
+        # Decode only at the resolution the crops need
+        if image is None:
+            image = decode_image(image_data, choose_reduction(image_size, results))
+
+    # Crop and encode each detected object (plus its pricing copy), fanning out
+    # to worker processes for large jobs
+    boxes = crop_boxes(image.shape, results)
+    details = [pricing_detail(x_max - x_min, y_max - y_min) for x_min, y_min, x_max, y_max in boxes]
+    with memprof.stage('crop'):
+        encoded = crop_pool.encode_crops(image, boxes,
+                                         partial(encode_crop_variants, crop_format=crop_format, quality=crop_quality),
+                                         [(detail,) for detail in details])
+
+    # Release the decoded pixels before building the response
+    del image
+
+    extension, content_type, _ = CROP_FORMATS[crop_format]
     detected_objects = []
-    for idx, obj in enumerate(results):
-        # Calculate object bounding box coordinates
-        x_min = int(obj['x_min'] * width)
-        x_max = int(obj['x_max'] * width)
-        y_min = int(obj['y_min'] * height)
-        y_max = int(obj['y_max'] * height)
-        
-        # Crop the object from the original image
-        cropped = image[y_min:y_max, x_min:x_max]
-        
-        # Convert cropped image to base64
-        _, buffer = cv2.imencode('.jpg', cropped)
-        base64_image = base64.b64encode(buffer).decode('utf-8')
-        
-        # Add object to results
-        detected_objects.append({
-            'label': obj['label'],
-            'confidence': obj.get('confidence', 1.0),
-            'image_data': f'data:image/jpeg;base64,{base64_image}'
-        })
-    
-    return detected_objects
\ No newline at end of file
+    # Pop each encoded crop as it becomes a data URL so raw bytes and base64
+    # copies of every crop are not held at the same time
+    encoded.reverse()
+    with memprof.stage('objects'):
+        for obj, (x_min, y_min, x_max, y_max), detail in zip(results, boxes, details):
+            data, pricing_data = encoded.pop()
+            detected = {
+                'label': obj['label'],
+                'confidence': obj.get('confidence', 1.0),
+                'box': {key: obj[key] for key in ('x_min', 'y_min', 'x_max', 'y_max')},
+                'pricing_image_data': to_data_url(pricing_data),
+                'pricing_detail': detail,
+                'width': x_max - x_min,
+                'height': y_max - y_min,
+                'content_type': content_type
+            }
+            # Reference output serves the crop from the blob store; only
+            # inline output carries it as a data URL
+            if crop_output == 'reference':
+                detected['image_ref'] = get_blob_store().put(data, extension)
+            else:
+                detected['image_data'] = to_data_url(data, crop_format)
+            detected_objects.append(detected)
+
+    return detected_objects
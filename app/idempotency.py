@@ -0,0 +1,175 @@
+import os
+import time
+import sqlite3
+import asyncio
+import hashlib
+import threading
+from functools import wraps
+from flask import request, jsonify, make_response, Response
+from dotenv import load_dotenv
+from singleflight import SingleFlight, AsyncSingleFlight
+
+# Idempotency-Key support for expensive endpoints. The first response for a
+# key is persisted in SQLite for IDEMPOTENCY_TTL seconds; a retry with the same
+# key while the first run is still going attaches to it, and one after it
+# finished gets the stored response straight away. idempotent() decorates
+# Flask views (app.py) and idempotent_async() Quart views (async_app.py); both
+# share the store and the rules below.
+#
+#   IDEMPOTENCY_DB   SQLite file for stored responses
+#   IDEMPOTENCY_TTL  how long responses are kept, in seconds
+
+load_dotenv()
+
+DEFAULT_DB = os.path.join(os.path.dirname(__file__), 'idempotency.sqlite3')
+TTL = int(os.getenv('IDEMPOTENCY_TTL', 24 * 60 * 60))
+MAX_KEY_LENGTH = 255
+
+class IdempotencyStore:
+    """SQLite-backed store of responses keyed by (route, idempotency key).
+
+    Args:
+        path (str): SQLite database file
+        ttl (int): Seconds a stored response stays valid
+    """
+
+    def __init__(self, path, ttl=TTL):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS responses (
+                    route TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    request_hash TEXT NOT NULL,
+                    status INTEGER NOT NULL,
+                    body BLOB NOT NULL,
+                    expires_at REAL NOT NULL,
+                    PRIMARY KEY (route, key)
+                )
+            ''')
+
+    def _connect(self):
+        # sqlite3 connections cannot be shared across threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=10)
+        return conn
+
+    def get(self, route, key):
+        """Return (request_hash, status, body) for a live entry, or None."""
+        row = self._connect().execute(
+            'SELECT request_hash, status, body FROM responses WHERE route = ? AND key = ? AND expires_at > ?',
+            (route, key, time.time())).fetchone()
+        return row
+
+    def put(self, route, key, request_hash, status, body):
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)',
+                (route, key, request_hash, status, body, time.time() + self.ttl))
+            conn.execute('DELETE FROM responses WHERE expires_at <= ?', (time.time(),))
+
+_store = None
+_store_lock = threading.Lock()
+_inflight = SingleFlight()
+_async_inflight = AsyncSingleFlight()
+
+KEY_TOO_LONG = 'Idempotency-Key is too long'
+KEY_REUSED = 'Idempotency-Key was already used with a different request'
+
+def get_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = IdempotencyStore(os.getenv('IDEMPOTENCY_DB', DEFAULT_DB))
+        return _store
+
+def _request_hash(body):
+    return hashlib.sha256(body).hexdigest()
+
+def _record(route, key, request_hash, status, body):
+    """Store a finished response unless it is a server error (5xx), which a retry should run again.
+
+    Returns:
+        tuple: (request_hash, status, body), the shape of a stored entry
+    """
+    if status < 500:
+        get_store().put(route, key, request_hash, status, body)
+    return request_hash, status, body
+
+def idempotent(route):
+    """Decorate a view so requests carrying an Idempotency-Key run at most once.
+
+    Server errors (5xx) are not stored, so a retry after one runs again.
+    Reusing a key with a different request body is rejected with 422.
+
+    Args:
+        route (str): Name used to scope keys, e.g. 'detect'
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            key = request.headers.get('Idempotency-Key')
+            if not key:
+                return view(*args, **kwargs)
+            if len(key) > MAX_KEY_LENGTH:
+                return jsonify({'error': KEY_TOO_LONG}), 400
+
+            request_hash = _request_hash(request.get_data())
+            executed = []
+
+            def run():
+                stored = get_store().get(route, key)
+                if stored is not None:
+                    return stored
+                response = make_response(view(*args, **kwargs))
+                executed.append(response)
+                return _record(route, key, request_hash, response.status_code, response.get_data())
+
+            # Concurrent retries attach to the run already in progress
+            stored_hash, status, body = _inflight.do((route, key), run)
+            if stored_hash != request_hash:
+                return jsonify({'error': KEY_REUSED}), 422
+            if executed:
+                return executed[0]
+            return Response(body, status=status, mimetype='application/json', headers={'Idempotent-Replayed': 'true'})
+        return wrapper
+    return decorator
+
+def idempotent_async(route):
+    """Quart counterpart of idempotent(), sharing its store and rules."""
+    # Quart is only installed for the asyncio service mode
+    from quart import request, jsonify, make_response, Response
+
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(*args, **kwargs):
+            key = request.headers.get('Idempotency-Key')
+            if not key:
+                return await view(*args, **kwargs)
+            if len(key) > MAX_KEY_LENGTH:
+                return jsonify({'error': KEY_TOO_LONG}), 400
+
+            request_hash = _request_hash(await request.get_data())
+            executed = []
+
+            async def run():
+                stored = await asyncio.to_thread(get_store().get, route, key)
+                if stored is not None:
+                    return stored
+                response = await make_response(await view(*args, **kwargs))
+                executed.append(response)
+                return await asyncio.to_thread(_record, route, key, request_hash, response.status_code,
+                                               await response.get_data())
+
+            # Concurrent retries attach to the run already in progress
+            stored_hash, status, body = await _async_inflight.do((route, key), run)
+            if stored_hash != request_hash:
+                return jsonify({'error': KEY_REUSED}), 422
+            if executed:
+                return executed[0]
+            return Response(body, status=status, mimetype='application/json', headers={'Idempotent-Replayed': 'true'})
+        return wrapper
+    return decorator
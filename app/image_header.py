@@ -0,0 +1,86 @@
+import struct
+
+# Cheap header parsing so decode decisions can be made before paying for a
+# full cv2.imdecode of the image.
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+EXIF_ORIENTATION_TAG = 0x0112
+# Start-of-frame markers carry the image dimensions; C4, C8 and CC share the
+# range but are table/extension markers
+SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+def _exif_orientation(tiff):
+    """Read the orientation tag from a TIFF-structured EXIF block.
+
+    Args:
+        tiff (bytes-like): EXIF payload starting at the TIFF header
+
+    Returns:
+        int: EXIF orientation (1-8), 1 if absent
+    """
+    if len(tiff) < 8:
+        return 1
+    endian = {b'II': '<', b'MM': '>'}.get(bytes(tiff[:2]))
+    if endian is None:
+        return 1
+    offset = struct.unpack(endian + 'I', tiff[4:8])[0]
+    if offset + 2 > len(tiff):
+        return 1
+    count = struct.unpack(endian + 'H', tiff[offset:offset + 2])[0]
+    for i in range(count):
+        entry = offset + 2 + i * 12
+        if entry + 12 > len(tiff):
+            break
+        tag = struct.unpack(endian + 'H', tiff[entry:entry + 2])[0]
+        if tag == EXIF_ORIENTATION_TAG:
+            return struct.unpack(endian + 'H', tiff[entry + 8:entry + 10])[0]
+    return 1
+
+def read_image_size(data):
+    """Read the displayed (EXIF-oriented) dimensions of a JPEG or PNG.
+
+    OpenCV rotates images according to their EXIF orientation when decoding,
+    so width and height are swapped for the transposing orientations (5-8)
+    to match what cv2.imdecode will return.
+
+    Args:
+        data (bytes-like): Encoded image bytes
+
+    Returns:
+        tuple: (width, height), or None if the header could not be parsed
+    """
+    if bytes(data[:8]) == PNG_SIGNATURE and len(data) >= 24:
+        return struct.unpack('>II', data[16:24])
+
+    if bytes(data[:2]) != b'\xff\xd8':
+        return None
+
+    orientation = 1
+    i = 2
+    while i + 4 <= len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:
+            # Fill byte before a marker
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            # Standalone markers have no length field
+            i += 2
+            continue
+        length = struct.unpack('>H', data[i + 2:i + 4])[0]
+        if marker == 0xE1 and bytes(data[i + 4:i + 10]) == b'Exif\x00\x00':
+            orientation = _exif_orientation(data[i + 10:i + 2 + length])
+        elif marker in SOF_MARKERS:
+            if i + 9 > len(data):
+                return None
+            height, width = struct.unpack('>HH', data[i + 5:i + 9])
+            if orientation in (5, 6, 7, 8):
+                width, height = height, width
+            return width, height
+        elif marker == 0xDA:
+            # Start of scan without a frame header
+            return None
+        i += 2 + length
+    return None
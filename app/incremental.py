@@ -0,0 +1,183 @@
+import os
+import cv2
+import numpy as np
+from dotenv import load_dotenv
+from image_header import read_image_size
+
+# Incremental re-detection: when a room is photographed again, align the new
+# photo to the previous one (ORB features + RANSAC homography), match new boxes
+# to the previous ones, and only send unmatched or visibly changed objects to
+# pricing. Matched objects keep their existing name, description and price.
+#
+#   INCREMENTAL_MATCH_IOU     minimum IoU between a new box and a projected prior box
+#   INCREMENTAL_MIN_SIMILARITY  minimum crop similarity for a match to count as unchanged
+
+load_dotenv()
+
+ALIGN_SIZE = 1024
+ORB_FEATURES = 2000
+MIN_INLIERS = 12
+MATCH_IOU = float(os.getenv('INCREMENTAL_MATCH_IOU', 0.5))
+MIN_SIMILARITY = float(os.getenv('INCREMENTAL_MIN_SIMILARITY', 0.5))
+REUSED_FIELDS = ('name', 'description', 'estimated_price')
+BOX_KEYS = ('x_min', 'y_min', 'x_max', 'y_max')
+
+GRAYSCALE_FLAGS = {
+    1: cv2.IMREAD_GRAYSCALE,
+    2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    8: cv2.IMREAD_REDUCED_GRAYSCALE_8,
+}
+
+def load_gray(image_data):
+    """Decode an image as grayscale, reduced so its long side is near ALIGN_SIZE.
+
+    Args:
+        image_data (bytes-like): Encoded image bytes
+
+    Returns:
+        numpy.ndarray: Grayscale image
+    """
+    size = read_image_size(image_data)
+    reduction = 1
+    if size is not None:
+        while reduction < 8 and max(size) / (reduction * 2) >= ALIGN_SIZE:
+            reduction *= 2
+    image = cv2.imdecode(np.frombuffer(image_data, np.uint8), GRAYSCALE_FLAGS[reduction])
+    if image is None:
+        raise Exception('Failed to decode image')
+    return image
+
+def estimate_homography(prior_gray, new_gray):
+    """Estimate the homography mapping prior-photo coordinates to the new photo.
+
+    Both sides work in normalized [0, 1] coordinates so boxes can be projected
+    directly regardless of either image's resolution.
+
+    Returns:
+        numpy.ndarray: 3x3 homography, or None if the photos could not be aligned
+    """
+    orb = cv2.ORB_create(ORB_FEATURES)
+    prior_kp, prior_des = orb.detectAndCompute(prior_gray, None)
+    new_kp, new_des = orb.detectAndCompute(new_gray, None)
+    if prior_des is None or new_des is None or len(prior_kp) < MIN_INLIERS or len(new_kp) < MIN_INLIERS:
+        return None
+
+    # Lowe's ratio test on the two nearest neighbours
+    pairs = cv2.BFMatcher(cv2.NORM_HAMMING).knnMatch(prior_des, new_des, k=2)
+    good = [p[0] for p in pairs if len(p) == 2 and p[0].distance < 0.75 * p[1].distance]
+    if len(good) < MIN_INLIERS:
+        return None
+
+    prior_scale = np.array([prior_gray.shape[1], prior_gray.shape[0]], dtype=np.float32)
+    new_scale = np.array([new_gray.shape[1], new_gray.shape[0]], dtype=np.float32)
+    src = np.float32([prior_kp[m.queryIdx].pt for m in good]) / prior_scale
+    dst = np.float32([new_kp[m.trainIdx].pt for m in good]) / new_scale
+    homography, mask = cv2.findHomography(src.reshape(-1, 1, 2), dst.reshape(-1, 1, 2), cv2.RANSAC, 0.01)
+    if homography is None or int(mask.sum()) < MIN_INLIERS:
+        return None
+    return homography
+
+def _as_array(boxes):
+    return np.array([[b[key] for key in BOX_KEYS] for b in boxes], dtype=np.float64).reshape(-1, 4)
+
+def project_boxes(homography, boxes):
+    """Project normalized boxes through a homography, returning axis-aligned boxes.
+
+    Args:
+        homography (numpy.ndarray): 3x3 homography
+        boxes (numpy.ndarray): N x 4 array of (x_min, y_min, x_max, y_max)
+
+    Returns:
+        numpy.ndarray: N x 4 projected boxes clipped to [0, 1]
+    """
+    if len(boxes) == 0:
+        return boxes
+    x0, y0, x1, y1 = boxes.T
+    corners = np.stack([np.stack([x0, y0], 1), np.stack([x1, y0], 1),
+                        np.stack([x1, y1], 1), np.stack([x0, y1], 1)], 1)
+    projected = cv2.perspectiveTransform(corners.reshape(-1, 1, 2), homography).reshape(-1, 4, 2)
+    result = np.concatenate([projected.min(axis=1), projected.max(axis=1)], axis=1)
+    return np.clip(result, 0, 1)
+
+def iou_matrix(a, b):
+    """Pairwise IoU between two sets of boxes (N x 4 and M x 4)."""
+    x0 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y0 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x1 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y1 = np.minimum(a[:, None, 3], b[None, :, 3])
+    intersection = np.clip(x1 - x0, 0, None) * np.clip(y1 - y0, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    union = area_a[:, None] + area_b[None, :] - intersection
+    return np.where(union > 0, intersection / np.maximum(union, 1e-12), 0)
+
+def match_boxes(new_boxes, new_labels, prior_boxes, prior_labels, min_iou=MATCH_IOU):
+    """Greedily pair new boxes with prior boxes of the same label by IoU.
+
+    Returns:
+        list: (new_index, prior_index) pairs
+    """
+    if len(new_boxes) == 0 or len(prior_boxes) == 0:
+        return []
+    iou = iou_matrix(new_boxes, prior_boxes)
+    same_label = np.array([[n.lower() == p.lower() for p in prior_labels] for n in new_labels])
+    iou[~same_label] = 0
+    pairs = []
+    while True:
+        i, j = np.unravel_index(np.argmax(iou), iou.shape)
+        if iou[i, j] < min_iou:
+            return pairs
+        pairs.append((int(i), int(j)))
+        iou[i, :] = 0
+        iou[:, j] = 0
+
+def _crop_gray(gray, box):
+    height, width = gray.shape[:2]
+    x0, y0, x1, y1 = (box * [width, height, width, height]).astype(int)
+    crop = gray[y0:max(y1, y0 + 1), x0:max(x1, x0 + 1)]
+    return cv2.resize(crop, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+
+def crop_similarity(new_gray, new_box, prior_gray, prior_box):
+    """Normalized cross-correlation between two object crops, in [-1, 1]."""
+    a = _crop_gray(new_gray, new_box)
+    b = _crop_gray(prior_gray, prior_box)
+    return float(cv2.matchTemplate(a, b, cv2.TM_CCOEFF_NORMED)[0, 0])
+
+def find_reusable(image_data, detected_objects, prior_objects, prior_image_data):
+    """Find detected objects that are unchanged since a prior photo of the room.
+
+    Args:
+        image_data (bytes-like): Encoded new photo
+        detected_objects (list): Output of detect_and_crop_objects (with 'box')
+        prior_objects (list): Objects from the earlier /detect response, each with
+            'box', 'label' and the fields to reuse (see results.parse_detect_options)
+        prior_image_data (bytes-like): Encoded prior photo. Crops are compared
+            against it, so it is required: comparing the new photo with itself
+            would call every object in the same place unchanged.
+
+    Returns:
+        dict: Index into detected_objects -> prior object to reuse
+    """
+    if not detected_objects or not prior_objects:
+        return {}
+
+    new_gray = load_gray(image_data)
+    prior_gray = load_gray(prior_image_data)
+    homography = estimate_homography(prior_gray, new_gray)
+    if homography is None:
+        print("Could not align with the prior photo, pricing every object")
+        return {}
+
+    new_boxes = _as_array([obj['box'] for obj in detected_objects])
+    prior_boxes = _as_array([obj['box'] for obj in prior_objects])
+    projected = project_boxes(homography, prior_boxes)
+
+    reusable = {}
+    pairs = match_boxes(new_boxes, [o['label'] for o in detected_objects],
+                        projected, [o['label'] for o in prior_objects])
+    for new_index, prior_index in pairs:
+        similarity = crop_similarity(new_gray, new_boxes[new_index], prior_gray, prior_boxes[prior_index])
+        if similarity >= MIN_SIMILARITY:
+            reusable[new_index] = prior_objects[prior_index]
+    return reusable
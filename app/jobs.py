@@ -0,0 +1,103 @@
+import os
+import json
+import time
+import secrets
+import sqlite3
+import threading
+from dotenv import load_dotenv
+
+# Background completion of /detect requests that ran out of time budget. The
+# response carries the objects priced so far plus a job id; objects still
+# being priced are filled into the job as they finish, and clients collect
+# them from /detect-jobs/<job_id>. Jobs are kept in the SQLite database shared
+# with the idempotency store, so a poll can be answered by any worker process
+# on the host, not only the one still pricing the job.
+#
+#   IDEMPOTENCY_DB   SQLite file for stored responses and detect jobs
+#   DETECT_JOB_TTL   seconds a job is kept after it was created
+
+load_dotenv()
+
+DEFAULT_DB = os.path.join(os.path.dirname(__file__), 'idempotency.sqlite3')
+JOB_TTL = int(os.getenv('DETECT_JOB_TTL', 600))
+
+class JobStore:
+    """SQLite-backed store of partially priced detection results.
+
+    Each object of a job is its own row, so completing one is a single update
+    and workers finishing objects of the same job never overwrite each other.
+
+    Args:
+        path (str): SQLite database file
+        ttl (int): Seconds a job is kept after creation
+    """
+
+    def __init__(self, path, ttl=JOB_TTL):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS detect_job_objects (
+                    job_id TEXT NOT NULL,
+                    position INTEGER NOT NULL,
+                    object TEXT NOT NULL,
+                    pending INTEGER NOT NULL,
+                    expires_at REAL NOT NULL,
+                    PRIMARY KEY (job_id, position)
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS detect_job_objects_expiry ON detect_job_objects (expires_at)')
+
+    def _connect(self):
+        # sqlite3 connections cannot be shared across threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=10)
+        return conn
+
+    def create(self, objects, pending):
+        """Register a partial result.
+
+        Args:
+            objects (list): Response objects, with placeholders for pending ones
+            pending (iterable): Indices into ``objects`` still being priced
+
+        Returns:
+            str: Job id
+        """
+        job_id = secrets.token_urlsafe(16)
+        pending = set(pending)
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute('DELETE FROM detect_job_objects WHERE expires_at <= ?', (now,))
+            conn.executemany(
+                'INSERT INTO detect_job_objects VALUES (?, ?, ?, ?, ?)',
+                [(job_id, i, json.dumps(obj), i in pending, now + self.ttl) for i, obj in enumerate(objects)])
+        return job_id
+
+    def complete(self, job_id, index, obj):
+        """Fill in a finished object; ignored if the job has expired."""
+        with self._connect() as conn:
+            conn.execute(
+                'UPDATE detect_job_objects SET object = ?, pending = 0 WHERE job_id = ? AND position = ?',
+                (json.dumps(obj), job_id, index))
+
+    def get(self, job_id):
+        """Return (objects, number still pending), or None for unknown or expired jobs."""
+        rows = self._connect().execute(
+            'SELECT object, pending FROM detect_job_objects WHERE job_id = ? AND expires_at > ? ORDER BY position',
+            (job_id, time.time())).fetchall()
+        if not rows:
+            return None
+        return [json.loads(obj) for obj, _ in rows], sum(pending for _, pending in rows)
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_job_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = JobStore(os.getenv('IDEMPOTENCY_DB', DEFAULT_DB))
+        return _store
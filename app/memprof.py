@@ -0,0 +1,172 @@
+import os
+import sys
+import json
+import tracemalloc
+import contextvars
+from contextlib import contextmanager
+from dotenv import load_dotenv
+import metrics
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Opt-in memory instrumentation for sizing workers. With MEMORY_PROFILE on,
+# tracemalloc traces Python and numpy allocations (OpenCV output arrays are
+# numpy arrays) and every request records its peak above the memory in use
+# when it started, the growth of the process's peak RSS, and the peak and
+# retained bytes of each named stage (download, decode, crop, ...). Totals are
+# exported as metrics, and each response carries them in an X-Memory-Profile
+# header.
+#
+# tracemalloc counts are process-wide, so per-request figures are only exact
+# when requests do not overlap: profile with one request at a time (this
+# applies to the async service mode too, where requests share one thread). Crops
+# encoded in crop_pool worker processes do not show up here.
+#
+# image-detection/benchmark_stages.py --budget checks the end-to-end peak
+# for a reference image against a memory budget.
+#
+#   MEMORY_PROFILE         enable tracing and per-request profiles
+#   MEMORY_PROFILE_TOP     also log this many top allocation sites per stage
+#                          (tracemalloc snapshot diffs; slow)
+#   MEMORY_PROFILE_FRAMES  stack frames kept per traced allocation
+
+load_dotenv()
+
+ENABLED = os.getenv('MEMORY_PROFILE', 'false').lower() in ('1', 'true', 'yes')
+TOP_ALLOCATIONS = int(os.getenv('MEMORY_PROFILE_TOP', 0))
+TRACE_FRAMES = int(os.getenv('MEMORY_PROFILE_FRAMES', 1))
+HEADER = 'X-Memory-Profile'
+
+metrics.describe('memory_profiled_requests_total', 'counter', 'Requests with a memory profile, by route')
+metrics.describe('memory_request_peak_bytes_total', 'counter', 'Sum of per-request traced peaks, by route')
+metrics.describe('memory_request_peak_bytes_max', 'gauge', 'Largest per-request traced peak, by route')
+metrics.describe('memory_rss_growth_bytes_total', 'counter', 'Growth of the process peak RSS, by route')
+metrics.describe('memory_stage_peak_bytes_max', 'gauge', 'Largest traced peak of a stage, by route and stage')
+
+class Profile:
+    """Memory observations for one request."""
+
+    def __init__(self, route):
+        self.route = route
+        self.baseline = tracemalloc.get_traced_memory()[0]
+        self.peak = self.baseline
+        self.rss_start = peak_rss()
+        self.stages = {}
+        # Open stages as [name, memory at start, peak seen, snapshot]
+        self.open = []
+
+_profile = contextvars.ContextVar('memory_profile', default=None)
+
+def peak_rss():
+    """Peak resident set size of this process in bytes, or 0 if unknown."""
+    if resource is None:
+        return 0
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return usage if sys.platform == 'darwin' else usage * 1024
+
+def start():
+    """Start tracing allocations if profiling is enabled."""
+    if ENABLED and not tracemalloc.is_tracing():
+        tracemalloc.start(TRACE_FRAMES)
+
+def _observe(profile):
+    # tracemalloc keeps one global peak; fold it into every open stage before
+    # a nested stage resets it
+    peak = tracemalloc.get_traced_memory()[1]
+    profile.peak = max(profile.peak, peak)
+    for entry in profile.open:
+        entry[2] = max(entry[2], peak)
+
+def begin(route):
+    """Start profiling the current request.
+
+    Returns:
+        Token for end(), or None when profiling is disabled
+    """
+    if not tracemalloc.is_tracing():
+        return None
+    tracemalloc.reset_peak()
+    return _profile.set(Profile(route))
+
+@contextmanager
+def stage(name):
+    """Record the peak and retained memory of a block as a named stage.
+
+    Stages nest; a nested stage is reported as 'outer/inner'. Outside a
+    profiled request this does nothing.
+    """
+    profile = _profile.get()
+    if profile is None:
+        yield
+        return
+
+    _observe(profile)
+    tracemalloc.reset_peak()
+    current = tracemalloc.get_traced_memory()[0]
+    snapshot = tracemalloc.take_snapshot() if TOP_ALLOCATIONS else None
+    full_name = '/'.join([entry[0] for entry in profile.open] + [name])
+    entry = [name, current, current, snapshot]
+    profile.open.append(entry)
+    try:
+        yield
+    finally:
+        _observe(profile)
+        profile.open.remove(entry)
+        end_current = tracemalloc.get_traced_memory()[0]
+        profile.stages[full_name] = {'peak': entry[2] - entry[1], 'retained': end_current - entry[1]}
+        if snapshot is not None:
+            print(f"[memory] {profile.route} {full_name} top allocations:")
+            for diff in tracemalloc.take_snapshot().compare_to(snapshot, 'lineno')[:TOP_ALLOCATIONS]:
+                print(f"[memory]   {diff}")
+
+def end(token):
+    """Finish the current request's profile and record its metrics.
+
+    Returns:
+        dict: 'peak' (traced bytes above the request's starting point),
+        'rss_growth' and per-stage 'peak'/'retained' bytes, or None when
+        the request was not profiled
+    """
+    if token is None:
+        return None
+    profile = _profile.get()
+    _profile.reset(token)
+    _observe(profile)
+
+    summary = {
+        'peak': profile.peak - profile.baseline,
+        'rss_growth': peak_rss() - profile.rss_start,
+        'stages': profile.stages,
+    }
+    route = profile.route
+    metrics.inc('memory_profiled_requests_total', route=route)
+    metrics.inc('memory_request_peak_bytes_total', summary['peak'], route=route)
+    metrics.set_gauge('memory_request_peak_bytes_max',
+                      max(summary['peak'], metrics.get('memory_request_peak_bytes_max', route=route)), route=route)
+    metrics.inc('memory_rss_growth_bytes_total', summary['rss_growth'], route=route)
+    for name, observed in profile.stages.items():
+        metrics.set_gauge('memory_stage_peak_bytes_max',
+                          max(observed['peak'], metrics.get('memory_stage_peak_bytes_max', route=route, stage=name)),
+                          route=route, stage=name)
+    return summary
+
+def header_value(summary):
+    """Compact JSON for the X-Memory-Profile response header."""
+    return json.dumps(summary, separators=(',', ':'))
+
+def finish(token, headers):
+    """End a request's profile and report it in the X-Memory-Profile response header.
+
+    Shared by the Flask and Quart after-request hooks.
+
+    Args:
+        token: Token from begin(), or None
+        headers: Response headers to add the summary to
+    """
+    summary = end(token)
+    if summary:
+        headers[HEADER] = header_value(summary)
@@ -0,0 +1,62 @@
+import threading
+
+# Minimal in-process metrics registry rendered in the Prometheus text format
+# by the /metrics endpoint. Counters and gauges are keyed by name and labels.
+
+_lock = threading.Lock()
+_types = {}
+_help = {}
+_values = {}
+
+def describe(name, kind, help_text):
+    """Declare a metric's type ('counter' or 'gauge') and help text."""
+    with _lock:
+        _types[name] = kind
+        _help[name] = help_text
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+def inc(name, value=1, **labels):
+    """Increase a counter."""
+    with _lock:
+        key = _key(name, labels)
+        _values[key] = _values.get(key, 0) + value
+
+def set_gauge(name, value, **labels):
+    """Set a gauge to an absolute value."""
+    with _lock:
+        _values[_key(name, labels)] = value
+
+def get(name, **labels):
+    """Return the current value of a metric, 0 if never recorded."""
+    with _lock:
+        return _values.get(_key(name, labels), 0)
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in labels)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + '}'
+
+def render():
+    """Render every metric in the Prometheus text exposition format.
+
+    Returns:
+        str: Exposition text
+    """
+    with _lock:
+        values = sorted(_values.items())
+        types = dict(_types)
+        helps = dict(_help)
+
+    lines = []
+    seen = set()
+    for (name, labels), value in values:
+        if name not in seen:
+            seen.add(name)
+            if name in helps:
+                lines.append(f'# HELP {name} {helps[name]}')
+            lines.append(f'# TYPE {name} {types.get(name, "untyped")}')
+        lines.append(f'{name}{_format_labels(labels)} {value}')
+    return '\n'.join(lines) + '\n'
@@ -1,52 +1,115 @@
 import os
 import json
-from groq import Groq
+import groq
+import openai
+from groq import Groq, AsyncGroq
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
+import upstream
+import async_upstream
+import accounting
 
 load_dotenv()
-client_groq = Groq(api_key=os.getenv('GROQ_API'))
-client = OpenAI(api_key=os.getenv('OPENAI_API'))
+# The SDK clients are handed their HTTP clients (with the SDKs' default
+# settings) so warmup can open their connections before the first request
+openai_http = openai.DefaultHttpxClient()
+groq_http = groq.DefaultHttpxClient()
+client_groq = Groq(api_key=os.getenv('GROQ_API'), http_client=groq_http)
+client = OpenAI(api_key=os.getenv('OPENAI_API'), http_client=openai_http)
+# Used only by the asyncio service mode
+async_openai_http = openai.DefaultAsyncHttpxClient()
+async_groq_http = groq.DefaultAsyncHttpxClient()
+async_client = AsyncOpenAI(api_key=os.getenv('OPENAI_API'), http_client=async_openai_http)
+async_client_groq = AsyncGroq(api_key=os.getenv('GROQ_API'), http_client=async_groq_http)
 
-def analyze_image(image_url):
-    """Analyze an image using OpenAI's Vision API to identify objects and estimate prices.
+def _complete(service, client, purpose, **kwargs):
+    """Create a chat completion with an output limit adapted to past responses.
+
+    A response cut off by a lowered limit is retried once at the full limit.
 
     Args:
-        image_url (str): URL or file path of the image to analyze
+        service (str): Upstream name, 'openai' or 'groq'
+        client: OpenAI or Groq client
+        purpose (str): Kind of call the limit is tracked for
+        **kwargs: Passed through to upstream.create_chat_completion
 
     Returns:
-        dict: Analysis results containing name, description, and estimated price
+        Chat completion object
     """
-    response = client.chat.completions.create(
+    limit = accounting.max_tokens(kwargs['model'], purpose)
+    response = upstream.create_chat_completion(service, client, max_tokens=limit, **kwargs)
+    if response.choices[0].finish_reason == 'length' and limit < accounting.MAX_TOKENS_CEILING:
+        print(f"{purpose} response hit max_tokens={limit}, retrying at {accounting.MAX_TOKENS_CEILING}")
+        response = upstream.create_chat_completion(service, client, max_tokens=accounting.MAX_TOKENS_CEILING, **kwargs)
+    accounting.observe_completion(kwargs['model'], purpose, response)
+    return response
+
+def image_analysis_request(image_url, detail='auto'):
+    """Build the chat completion arguments for pricing an object image.
+
+    Args:
+        image_url (str): URL or data URL of the image to analyze
+        detail (str): Vision detail level, 'low', 'high' or 'auto'
+
+    Returns:
+        dict: model and messages for a completion call
+    """
+    return dict(
         model="gpt-4o",
         messages=[{
             "role": "user",
             "content": [
                 {"type": "text", "text": "I want you to analyze the given image and come up with a name for the object in it (such as Bed and Matress, Sofa, Television, etc.). I also want you to come up with a short description of what the item is (such as King Sized Bed, Blue Cloth Sofa, Wide Ceiling Fan, etc.) Also estimate the price of the object in USD. Return the value in the following JSON format {'name': '{name}', 'description': '{description}', 'price': '${price}'}"},
-                {"type": "image_url", "image_url": {"url": image_url}}
+                {"type": "image_url", "image_url": {"url": image_url, "detail": detail}}
             ]
-        }],
-        max_tokens=3000
+        }]
     )
 
+def parse_json_content(response, fenced=False):
+    """Parse the JSON object in a completion's message.
+
+    Args:
+        response: Chat completion
+        fenced (bool): Strip the first and last line (a ``` code fence)
+
+    Returns:
+        dict: Parsed JSON
+
+    Raises:
+        ValueError: If the content is not valid JSON
+    """
     content = str(response.choices[0].message.content).strip()
-    content = '\n'.join(content.split('\n')[1:-1])
+    if fenced:
+        content = '\n'.join(content.split('\n')[1:-1])
     try:
         result = json.loads(content)
     except json.JSONDecodeError as error:
         raise ValueError(f"Failed to parse JSON from response: {error}\nContent received: {content}")
     return result
 
-def analyze_image_groq(image_url):
+def analyze_image(image_url, detail='auto'):
     """Analyze an image using OpenAI's Vision API to identify objects and estimate prices.
 
     Args:
         image_url (str): URL or file path of the image to analyze
+        detail (str): Vision detail level, 'low', 'high' or 'auto'
 
     Returns:
         dict: Analysis results containing name, description, and estimated price
     """
-    response = client_groq.chat.completions.create(
+    response = _complete('openai', client, 'analyze_image', **image_analysis_request(image_url, detail))
+    return parse_json_content(response, fenced=True)
+
+def groq_image_analysis_request(image_url):
+    """Build the chat completion arguments for analyzing an image on Groq.
+
+    Args:
+        image_url (str): URL or file path of the image to analyze
+
+    Returns:
+        dict: model, messages and response_format for a completion call
+    """
+    return dict(
         model="llama-3.3-70b-specdec",
         messages=[{
             "role": "user",
@@ -55,28 +118,31 @@ def analyze_image_groq(image_url):
                 {"type": "image_url", "image_url": {"url": image_url}}
             ]
         }],
-        response_format={"type": "json_object"},
-        max_tokens=3000
+        response_format={"type": "json_object"}
     )
 
-    content = str(response.choices[0].message.content).strip()
-    content = '\n'.join(content.split('\n')[1:-1])
-    try:
-        result = json.loads(content)
-    except json.JSONDecodeError as error:
-        raise ValueError(f"Failed to parse JSON from response: {error}\nContent received: {content}")
-    return result
+def analyze_image_groq(image_url):
+    """Analyze an image using OpenAI's Vision API to identify objects and estimate prices.
 
-def analyze_receipt_text(text):
-    """Analyze receipt text to extract item details and price.
+    Args:
+        image_url (str): URL or file path of the image to analyze
+
+    Returns:
+        dict: Analysis results containing name, description, and estimated price
+    """
+    response = _complete('groq', client_groq, 'analyze_image_groq', **groq_image_analysis_request(image_url))
+    return parse_json_content(response, fenced=True)
+
+def receipt_analysis_request(text):
+    """Build the chat completion arguments for extracting an item from receipt text.
 
     Args:
         text (str): The OCR text from the receipt
 
     Returns:
-        dict: Analysis results containing name, description, and price
+        dict: model and messages for a completion call
     """
-    response = client.chat.completions.create(
+    return dict(
         model="gpt-4",
         messages=[{
             "role": "user",
@@ -88,13 +154,47 @@ def analyze_receipt_text(text):
 
             Receipt text:
             {text}"""
-        }],
-        max_tokens=3000
+        }]
     )
 
-    content = str(response.choices[0].message.content).strip()
-    try:
-        result = json.loads(content)
-    except json.JSONDecodeError as error:
-        raise ValueError(f"Failed to parse JSON from response: {error}\nContent received: {content}")
-    return result
+def analyze_receipt_text(text):
+    """Analyze receipt text to extract item details and price.
+
+    Args:
+        text (str): The OCR text from the receipt
+
+    Returns:
+        dict: Analysis results containing name, description, and price
+    """
+    response = _complete('openai', client, 'analyze_receipt_text', **receipt_analysis_request(text))
+    return parse_json_content(response)
+
+# Async variants for the asyncio service mode (async_app.py)
+
+async def _complete_async(service, client, purpose, **kwargs):
+    """Async counterpart of _complete, on an AsyncOpenAI/AsyncGroq client."""
+    limit = accounting.max_tokens(kwargs['model'], purpose)
+    response = await async_upstream.create_chat_completion(service, client, max_tokens=limit, **kwargs)
+    if response.choices[0].finish_reason == 'length' and limit < accounting.MAX_TOKENS_CEILING:
+        print(f"{purpose} response hit max_tokens={limit}, retrying at {accounting.MAX_TOKENS_CEILING}")
+        response = await async_upstream.create_chat_completion(
+            service, client, max_tokens=accounting.MAX_TOKENS_CEILING, **kwargs)
+    accounting.observe_completion(kwargs['model'], purpose, response)
+    return response
+
+async def analyze_image_async(image_url, detail='auto'):
+    """Async counterpart of analyze_image."""
+    response = await _complete_async('openai', async_client, 'analyze_image',
+                                     **image_analysis_request(image_url, detail))
+    return parse_json_content(response, fenced=True)
+
+async def analyze_receipt_text_async(text):
+    """Async counterpart of analyze_receipt_text."""
+    response = await _complete_async('openai', async_client, 'analyze_receipt_text', **receipt_analysis_request(text))
+    return parse_json_content(response)
+
+async def analyze_image_groq_async(image_url):
+    """Async counterpart of analyze_image_groq."""
+    response = await _complete_async('groq', async_client_groq, 'analyze_image_groq',
+                                     **groq_image_analysis_request(image_url))
+    return parse_json_content(response, fenced=True)
@@ -0,0 +1,105 @@
+import os
+import time
+import asyncio
+import threading
+from dotenv import load_dotenv
+
+# Per-upstream token buckets. Callers over the rate are queued (each one
+# reserves the next free slot and sleeps until then) rather than rejected, so
+# bursts are smoothed out instead of tripping the provider's rate limits.
+#
+#   RATE_LIMIT_<SERVICE>   requests per second, optionally ',burst'
+#                          (e.g. RATE_LIMIT_OPENAI=8,16); 0 disables
+#   RATE_LIMIT_MAX_WAIT    longest a caller may queue, in seconds
+
+load_dotenv()
+
+DEFAULT_LIMITS = {
+    'edenai': '5,10',
+    'openai': '8,16',
+    'groq': '0.5,2',
+}
+MAX_WAIT = float(os.getenv('RATE_LIMIT_MAX_WAIT', 30))
+
+class RateLimitExceeded(Exception):
+    """Raised when a caller would have to queue longer than the allowed wait."""
+
+    def __init__(self, service, retry_after):
+        super().__init__(f"Rate limit for {service} exceeded, retry after {retry_after:.1f}s")
+        self.service = service
+        self.retry_after = retry_after
+
+class TokenBucket:
+    """Token bucket that queues callers instead of rejecting them.
+
+    Args:
+        name (str): Service name used in errors
+        rate (float): Tokens added per second
+        burst (int): Bucket capacity
+        max_wait (float): Longest a caller may wait for a token
+    """
+
+    def __init__(self, name, rate, burst, max_wait=MAX_WAIT):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.max_wait = max_wait
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Reserve a token and return how long to wait before using it.
+
+        Raises:
+            RateLimitExceeded: If the wait would exceed max_wait
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            wait = max(0.0, (1 - self._tokens) / self.rate)
+            if wait > self.max_wait:
+                raise RateLimitExceeded(self.name, wait)
+            # Tokens may go negative: that is the queue of reservations
+            self._tokens -= 1
+            return wait
+
+    def acquire(self):
+        """Block until a token is available."""
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+def _bucket(service):
+    with _buckets_lock:
+        if service not in _buckets:
+            spec = os.getenv(f'RATE_LIMIT_{service.upper()}', DEFAULT_LIMITS.get(service, '0'))
+            rate, _, burst = spec.partition(',')
+            rate = float(rate)
+            _buckets[service] = TokenBucket(service, rate, int(burst or max(1, rate))) if rate > 0 else None
+        return _buckets[service]
+
+def acquire(service):
+    """Wait for the rate limiter of an upstream service, if one is configured.
+
+    Args:
+        service (str): Upstream name, e.g. 'edenai' or 'openai'
+
+    Raises:
+        RateLimitExceeded: If the queue is longer than RATE_LIMIT_MAX_WAIT
+    """
+    bucket = _bucket(service)
+    if bucket is not None:
+        bucket.acquire()
+
+async def acquire_async(service):
+    """Async counterpart of acquire: waits without holding a thread."""
+    bucket = _bucket(service)
+    if bucket is not None:
+        wait = bucket.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
@@ -0,0 +1,260 @@
+import os
+import re
+import json
+import time
+import zlib
+import sqlite3
+import threading
+import cv2
+import numpy as np
+from urllib.parse import urlparse, unquote
+from dotenv import load_dotenv
+from incremental import load_gray
+
+# Per-user index of receipts already read, so a re-upload of the same receipt
+# (a second photo, a scan of it, a retry after an error) is answered from the
+# stored result instead of paying for OCR and text analysis again.
+#
+# Stage 1 matches a 1024-bit difference hash of the image within a small
+# Hamming distance, before any provider call. Receipts are mostly blank paper,
+# so the grid is 32x32 rather than the usual 8x8, and the aspect ratio has to
+# agree as well: two receipts from the same merchant share a layout, and a
+# coarse hash would match them on that alone. Stage 2 runs after OCR and matches a
+# normalized (merchant, date, total) fingerprint of the text, which catches the
+# same receipt photographed differently and still skips the analysis call.
+# Rows are inserted as receipts are read; results are stored once as
+# zlib-compressed JSON, and duplicates found by text only store a reference.
+#
+# The index is keyed on the verified uid from auth.py, and only the caller's
+# own uploads (Firebase Storage objects under their uid) are indexed or
+# returned as 'duplicate_of', so a request cannot read or seed another
+# user's receipts.
+#
+#   RECEIPT_INDEX_DB       SQLite file for the index
+#   RECEIPT_HASH_DISTANCE  maximum differing hash bits for an image match
+
+load_dotenv()
+
+DEFAULT_DB = os.path.join(os.path.dirname(__file__), 'receipt_index.sqlite3')
+HASH_DISTANCE = int(os.getenv('RECEIPT_HASH_DISTANCE', 6))
+HASH_SIZE = 32
+STORAGE_HOST = 'firebasestorage.googleapis.com'
+# Largest relative difference in aspect ratio for an image match
+ASPECT_TOLERANCE = 0.03
+
+AMOUNT = re.compile(r'(\d{1,3}(?:,\d{3})*|\d+)[.,](\d{2})\b')
+DATES = (
+    re.compile(r'\b(\d{4})[-/.](\d{1,2})[-/.](\d{1,2})\b'),
+    re.compile(r'\b(\d{1,2})[-/.](\d{1,2})[-/.](\d{2,4})\b'),
+)
+
+def image_hash(image_data):
+    """Compute the difference hash (dHash) of an encoded image.
+
+    Each bit says whether a pixel of the 33x32 grayscale thumbnail is brighter
+    than its right neighbour, which survives re-compression, resizing and
+    small exposure changes.
+
+    Args:
+        image_data (bytes-like): Encoded image bytes
+
+    Returns:
+        tuple: (128-byte hash, aspect ratio as width / height)
+    """
+    gray = load_gray(image_data)
+    thumb = cv2.resize(gray, (HASH_SIZE + 1, HASH_SIZE), interpolation=cv2.INTER_AREA)
+    return np.packbits(thumb[:, 1:] > thumb[:, :-1]).tobytes(), gray.shape[1] / gray.shape[0]
+
+def hash_distance(a, b):
+    """Number of differing bits between two image hashes."""
+    return (int.from_bytes(a, 'big') ^ int.from_bytes(b, 'big')).bit_count()
+
+def _merchant(lines):
+    # The merchant name is normally the first line with real words on it
+    for line in lines[:5]:
+        letters = re.sub(r'[^a-z0-9]', '', line.lower())
+        if sum(c.isalpha() for c in letters) >= 3:
+            return letters[:32]
+    return ''
+
+def _date(text):
+    for pattern in DATES:
+        match = pattern.search(text)
+        if match:
+            return '-'.join(part.lstrip('0') for part in match.groups())
+    return ''
+
+def _total(lines):
+    # The grand total is the largest amount on a 'total' line (not a subtotal)
+    amounts = [
+        amount for line in lines
+        if 'total' in line.lower() and 'sub' not in line.lower()
+        for amount in AMOUNT.findall(line)
+    ]
+    if not amounts:
+        return ''
+    return f"{max(float(whole.replace(',', '') + '.' + cents) for whole, cents in amounts):.2f}"
+
+def text_fingerprint(text):
+    """Reduce receipt OCR text to a normalized 'merchant|date|total' key.
+
+    Args:
+        text (str): OCR text of a receipt
+
+    Returns:
+        str: Fingerprint, or None if the text has no total or has neither a
+        merchant nor a date (too little to tell two receipts apart)
+    """
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    merchant, date, total = _merchant(lines), _date(text), _total(lines)
+    if not total or not (merchant or date):
+        return None
+    return f'{merchant}|{date}|{total}'
+
+class ReceiptIndex:
+    """SQLite-backed per-user index of read receipts.
+
+    Args:
+        path (str): SQLite database file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS receipts (
+                    id INTEGER PRIMARY KEY,
+                    user_id TEXT NOT NULL,
+                    image_hash BLOB,
+                    aspect REAL,
+                    fingerprint TEXT,
+                    image_url TEXT NOT NULL,
+                    result BLOB,
+                    original_id INTEGER,
+                    created_at REAL NOT NULL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS receipts_user ON receipts (user_id, fingerprint)')
+
+    def _connect(self):
+        # sqlite3 connections cannot be shared across threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=10)
+        return conn
+
+    def _load(self, receipt_id):
+        """Return the original receipt a row stands for as {'id', 'image_url', 'result'}."""
+        row = self._connect().execute('''
+            SELECT COALESCE(o.id, r.id), COALESCE(o.image_url, r.image_url), COALESCE(o.result, r.result)
+            FROM receipts r LEFT JOIN receipts o ON o.id = r.original_id
+            WHERE r.id = ?
+        ''', (receipt_id,)).fetchone()
+        return {'id': row[0], 'image_url': row[1], 'result': json.loads(zlib.decompress(row[2]))}
+
+    def match_image(self, user_id, image_hash):
+        """Find a receipt of this user whose image hash is within HASH_DISTANCE bits.
+
+        Args:
+            user_id (str): Owner of the receipts to search
+            image_hash (tuple): (hash, aspect ratio) from image_hash()
+
+        Returns:
+            dict: The closest match as {'id', 'image_url', 'result'}, or None
+        """
+        image_hash, aspect = image_hash
+        best = None
+        rows = self._connect().execute(
+            'SELECT id, image_hash FROM receipts '
+            'WHERE user_id = ? AND image_hash IS NOT NULL AND aspect BETWEEN ? AND ?',
+            (user_id, aspect * (1 - ASPECT_TOLERANCE), aspect * (1 + ASPECT_TOLERANCE)))
+        for receipt_id, stored in rows:
+            distance = hash_distance(stored, image_hash)
+            if distance <= HASH_DISTANCE and (best is None or distance < best[0]):
+                best = (distance, receipt_id)
+        return self._load(best[1]) if best else None
+
+    def match_text(self, user_id, fingerprint):
+        """Find a receipt of this user with the same text fingerprint.
+
+        Returns:
+            dict: The match as {'id', 'image_url', 'result'}, or None
+        """
+        row = self._connect().execute(
+            'SELECT id FROM receipts WHERE user_id = ? AND fingerprint = ? ORDER BY id LIMIT 1',
+            (user_id, fingerprint)).fetchone()
+        return self._load(row[0]) if row else None
+
+    def add(self, user_id, image_hash, fingerprint, image_url, result=None, original_id=None):
+        """Insert a receipt, or a reference to the original it duplicates.
+
+        Args:
+            user_id (str): Owner of the receipt
+            image_hash (tuple): (hash, aspect ratio) of the image, or None if it could not be read
+            fingerprint (str): Text fingerprint, or None
+            image_url (str): URL of the uploaded receipt
+            result (dict): Read result to store (for originals)
+            original_id (int): Row this upload duplicates (instead of a result)
+        """
+        blob = zlib.compress(json.dumps(result).encode('utf-8')) if result is not None else None
+        image_hash, aspect = image_hash or (None, None)
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT INTO receipts (user_id, image_hash, aspect, fingerprint, image_url, result, original_id, '
+                'created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (user_id, image_hash, aspect, fingerprint, image_url, blob, original_id, time.time()))
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_index():
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = ReceiptIndex(os.getenv('RECEIPT_INDEX_DB', DEFAULT_DB))
+        return _index
+
+def upload_owner(image_url):
+    """Return the uid a Firebase Storage upload belongs to.
+
+    Uploads are stored as '<uid>/...' or 'receipts/<uid>/...' (see
+    storage.rules), and download URLs look like
+    https://firebasestorage.googleapis.com/v0/b/<bucket>/o/<encoded path>?alt=media&token=...
+
+    Returns:
+        str: The owner's uid, or None for any other URL
+    """
+    parsed = urlparse(image_url)
+    prefix = '/v0/b/'
+    if parsed.hostname != STORAGE_HOST or not parsed.path.startswith(prefix):
+        return None
+    bucket_path = parsed.path[len(prefix):].split('/o/', 1)
+    if len(bucket_path) != 2:
+        return None
+    parts = unquote(bucket_path[1]).split('/')
+    if parts[0] == 'receipts':
+        parts = parts[1:]
+    return parts[0] if len(parts) > 1 and parts[0] else None
+
+def owned_match(match, user_id):
+    """Keep an index match only if its upload belongs to the user.
+
+    Returns:
+        dict: The match, or None
+    """
+    if match and upload_owner(match['image_url']) == user_id:
+        return match
+    return None
+
+def duplicate_result(match, how):
+    """Build a read result answered from an indexed receipt.
+
+    Args:
+        match (dict): Index match from match_image or match_text
+        how (str): Stage that matched, 'image' or 'text'
+
+    Returns:
+        dict: The stored text and analyzed data, flagged as a duplicate
+    """
+    return {**match['result'], 'duplicate': True, 'duplicate_of': match['image_url'], 'duplicate_match': how}
@@ -3,18 +3,18 @@ import json
 import requests
 from dotenv import load_dotenv
 from pricing import analyze_receipt_text
+from convert_image import download
+from receipt_index import get_index, image_hash, text_fingerprint, duplicate_result, upload_owner, owned_match
+import upstream
 
 load_dotenv()
 api_key = os.getenv('EDEN_API')
 
-def read_ocr(image_url):
-    """Process a receipt image through OCR and analyze its contents.
-    
-    Args:
-        image_url (str): URL of the receipt image
-        
+def ocr_request(image_url):
+    """Build the Eden AI OCR call, shared by the sync and async paths.
+
     Returns:
-        dict: Contains OCR text and analyzed receipt data
+        tuple: (endpoint URL, keyword arguments for upstream.post)
     """
     if not api_key:
         raise ValueError("EDEN_API environment variable is not set")
@@ -27,16 +27,31 @@ def read_ocr(image_url):
         "language": "en",
         "file_url": image_url,
     }
+    return url, {'json': json_payload, 'headers': headers}
 
-    try:
-        response = requests.post(url, json=json_payload, headers=headers)
-        response.raise_for_status()
-        result = response.json()
+def parse_ocr(response):
+    """Extract the OCR text from an Eden AI OCR response."""
+    response.raise_for_status()
+    result = response.json()
+
+    if "google" not in result or "text" not in result["google"]:
+        raise ValueError(f"Unexpected API response format: {result}")
+
+    return result["google"]["text"]
+
+def read_ocr(image_url):
+    """Process a receipt image through OCR and analyze its contents.
+    
+    Args:
+        image_url (str): URL of the receipt image
         
-        if "google" not in result or "text" not in result["google"]:
-            raise ValueError(f"Unexpected API response format: {result}")
-            
-        ocr_text = result["google"]["text"]
+    Returns:
+        dict: Contains OCR text and analyzed receipt data
+    """
+    url, kwargs = ocr_request(image_url)
+
+    try:
+        ocr_text = parse_ocr(upstream.post('edenai', url, **kwargs))
         
         # Analyze the receipt text to extract item details
         analyzed_data = analyze_receipt_text(ocr_text)
@@ -51,4 +66,54 @@ def read_ocr(image_url):
         raise
     except (KeyError, json.JSONDecodeError, ValueError) as e:
         print(f"Error processing API response: {e}")
-        raise
\ No newline at end of file
+        raise
+
+def hash_receipt_image(image_url):
+    """Download a receipt and compute its image hash, or None if that fails."""
+    try:
+        with download(image_url) as body:
+            return image_hash(body.buffer())
+    except Exception as e:
+        # Eden AI fetches the image itself, so the read can still go ahead
+        print(f"Could not hash receipt image: {e}")
+        return None
+
+def read_receipt_indexed(image_url, user_id=None):
+    """Read a receipt, answering repeat uploads from the user's receipt index.
+
+    An upload whose image matches one of the user's receipts is answered
+    without any provider call; one whose OCR text matches skips the text
+    analysis. Either way the result is flagged as a duplicate. Only the
+    user's own uploads are indexed and matched.
+
+    Args:
+        image_url (str): URL of the receipt image
+        user_id (str): Verified uid of the caller; without it the index is not used
+
+    Returns:
+        dict: OCR text and analyzed receipt data, plus 'duplicate' (and for
+        duplicates 'duplicate_of', the original upload's URL)
+    """
+    if not user_id or upload_owner(image_url) != user_id:
+        return {**read_ocr(image_url), 'duplicate': False}
+
+    index = get_index()
+    receipt_hash = hash_receipt_image(image_url)
+    match = owned_match(receipt_hash is not None and index.match_image(user_id, receipt_hash), user_id)
+    if match:
+        print(f"Receipt matches {match['image_url']} by image")
+        return duplicate_result(match, 'image')
+
+    url, kwargs = ocr_request(image_url)
+    ocr_text = parse_ocr(upstream.post('edenai', url, **kwargs))
+    fingerprint = text_fingerprint(ocr_text)
+    match = owned_match(fingerprint and index.match_text(user_id, fingerprint), user_id)
+    if match:
+        print(f"Receipt matches {match['image_url']} by text")
+        # Index this upload's image too, so the next copy of it matches in stage 1
+        index.add(user_id, receipt_hash, fingerprint, image_url, original_id=match['id'])
+        return duplicate_result(match, 'text')
+
+    result = {"text": ocr_text, "analyzed_data": analyze_receipt_text(ocr_text)}
+    index.add(user_id, receipt_hash, fingerprint, image_url, result)
+    return {**result, "image_url": image_url, "duplicate": False}
@@ -0,0 +1,296 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+import contextvars
+import cv2
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from convert_image import download
+from blobstore import get_blob_store
+from singleflight import SingleFlight
+
+# Privacy redaction of a user's documents and photos before they are shared.
+# Faces (Haar cascade) and text lines (morphological text-region detection,
+# e.g. account and card numbers on receipts) are found on a downscaled copy,
+# then obscured in one vectorized pass: the whole image is pixelated or blurred
+# once and copied back through a mask of the regions. Results are stored in
+# the blob store and cached by the SHA-256 of the source bytes, so a document
+# that has not changed is never processed twice. Re-encoding also drops EXIF
+# metadata such as GPS position.
+#
+# Text detection masks every line it finds, prices, dates and totals included,
+# so only faces are redacted unless a request asks for 'text' as well: use it
+# for documents being shared, never for receipts that still have to be read.
+#
+#   REDACT_WORKERS        documents redacted in parallel per batch
+#   REDACT_MAX_DOCUMENTS  largest batch accepted by /redact
+#   REDACTION_CACHE_DB    SQLite file mapping source hashes to redacted blobs
+
+load_dotenv()
+
+REDACT_WORKERS = int(os.getenv('REDACT_WORKERS', 4))
+MAX_DOCUMENTS = int(os.getenv('REDACT_MAX_DOCUMENTS', 50))
+DEFAULT_DB = os.path.join(os.path.dirname(__file__), 'redaction.sqlite3')
+
+MODES = ('pixelate', 'blur')
+TARGETS = ('faces', 'text')
+DEFAULT_TARGETS = ('faces',)
+# Bump when detection or obscuring changes so cached results are recomputed
+REDACTION_VERSION = 1
+
+# Region detection runs on a copy with at most this long side
+FACE_DETECT_SIZE = 1024
+TEXT_DETECT_SIZE = 1600
+FACE_PADDING = 0.15
+TEXT_PADDING = 0.25
+# Text lines: minimum width/height ratio, height range relative to the
+# detection image, and minimum share of the box covered by the joined line
+TEXT_MIN_ASPECT = 2.0
+TEXT_MIN_HEIGHT = 6
+TEXT_MAX_HEIGHT_FRACTION = 0.1
+TEXT_MIN_FILL = 0.5
+# Obscuring cell size as a fraction of the image's long side (minimum 8px)
+CELL_FRACTION = 1 / 80
+JPEG_QUALITY = 90
+
+_cascades = threading.local()
+_inflight = SingleFlight()
+executor = ThreadPoolExecutor(max_workers=REDACT_WORKERS)
+
+def parse_redact_options(json_data):
+    """Read and validate the redaction options of a /redact request.
+
+    Args:
+        json_data (dict): Request JSON
+
+    Returns:
+        tuple: ((urls, mode, targets), None) or (None, error message)
+    """
+    urls = json_data.get('urls')
+    if not isinstance(urls, list) or not urls or not all(isinstance(url, str) for url in urls):
+        return None, 'urls must be a non-empty list of document URLs'
+    if len(urls) > MAX_DOCUMENTS:
+        return None, f'At most {MAX_DOCUMENTS} documents can be redacted per request'
+    mode = json_data.get('mode', 'pixelate')
+    if mode not in MODES:
+        return None, "mode must be 'pixelate' or 'blur'"
+    targets = json_data.get('targets', list(DEFAULT_TARGETS))
+    if not isinstance(targets, list) or not targets or not set(targets) <= set(TARGETS):
+        return None, "targets must be a non-empty list of 'faces' and 'text'"
+    return (urls, mode, tuple(sorted(set(targets)))), None
+
+def _downscale(gray, max_side):
+    """Shrink a grayscale image to fit max_side, returning it and the scale used."""
+    height, width = gray.shape
+    scale = min(1.0, max_side / max(height, width))
+    if scale < 1.0:
+        gray = cv2.resize(gray, (max(1, int(width * scale)), max(1, int(height * scale))),
+                          interpolation=cv2.INTER_AREA)
+    return gray, scale
+
+def _face_cascade():
+    # CascadeClassifier is not safe to share between threads
+    cascade = getattr(_cascades, 'face', None)
+    if cascade is None:
+        if not hasattr(cv2, 'CascadeClassifier'):
+            raise RuntimeError('Face redaction needs an OpenCV build with Haar cascades (opencv-python-headless 4.x)')
+        cascade = _cascades.face = cv2.CascadeClassifier(
+            os.path.join(cv2.data.haarcascades, 'haarcascade_frontalface_default.xml'))
+    return cascade
+
+def detect_faces(gray):
+    """Find faces in a grayscale image.
+
+    Returns:
+        list: Boxes as (x, y, width, height) in the image's pixels
+    """
+    small, scale = _downscale(gray, FACE_DETECT_SIZE)
+    small = cv2.equalizeHist(small)
+    faces = _face_cascade().detectMultiScale(small, scaleFactor=1.1, minNeighbors=5, minSize=(24, 24))
+    return [tuple(int(v / scale) for v in face) for face in faces]
+
+def detect_text_regions(gray):
+    """Find lines of text in a grayscale image.
+
+    Character strokes show up in the morphological gradient; closing it with
+    a wide, flat kernel joins the characters of a line into one blob, and
+    blobs that are wide, short and dense enough are kept.
+
+    Returns:
+        list: Boxes as (x, y, width, height) in the image's pixels
+    """
+    small, scale = _downscale(gray, TEXT_DETECT_SIZE)
+    gradient = cv2.morphologyEx(small, cv2.MORPH_GRADIENT, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3)))
+    _, edges = cv2.threshold(gradient, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+    joined = cv2.morphologyEx(edges, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, (9, 1)))
+    contours, _ = cv2.findContours(joined, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    max_height = TEXT_MAX_HEIGHT_FRACTION * small.shape[0]
+    regions = []
+    for contour in contours:
+        x, y, width, height = cv2.boundingRect(contour)
+        if height < TEXT_MIN_HEIGHT or height > max_height or width < TEXT_MIN_ASPECT * height:
+            continue
+        if cv2.countNonZero(joined[y:y + height, x:x + width]) < TEXT_MIN_FILL * width * height:
+            continue
+        regions.append(tuple(int(v / scale) for v in (x, y, width, height)))
+    return regions
+
+def region_mask(shape, regions, padding):
+    """Build a boolean mask covering padded (x, y, width, height) regions."""
+    mask = np.zeros(shape[:2], dtype=bool)
+    for x, y, width, height in regions:
+        pad_x, pad_y = int(width * padding), int(height * padding)
+        mask[max(0, y - pad_y):y + height + pad_y, max(0, x - pad_x):x + width + pad_x] = True
+    return mask
+
+def obscure(image, mode):
+    """Pixelate or blur a whole image at a strength relative to its size."""
+    height, width = image.shape[:2]
+    cell = max(8, int(max(height, width) * CELL_FRACTION))
+    small = cv2.resize(image, (max(1, width // cell), max(1, height // cell)), interpolation=cv2.INTER_AREA)
+    if mode == 'pixelate':
+        return cv2.resize(small, (width, height), interpolation=cv2.INTER_NEAREST)
+    return cv2.resize(cv2.GaussianBlur(small, (5, 5), 0), (width, height), interpolation=cv2.INTER_LINEAR)
+
+def redact_image(data, mode='pixelate', targets=DEFAULT_TARGETS):
+    """Obscure faces and text in an encoded image.
+
+    Args:
+        data (bytes-like): Encoded image
+        mode (str): 'pixelate' or 'blur'
+        targets (tuple): Regions to redact, any of 'faces' and 'text'
+
+    Returns:
+        tuple: (redacted JPEG bytes, number of faces, number of text regions)
+
+    Raises:
+        ValueError: If the data is not a decodable image (e.g. a PDF)
+    """
+    image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError('Document is not a supported image')
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    faces = detect_faces(gray) if 'faces' in targets else []
+    text = detect_text_regions(gray) if 'text' in targets else []
+    del gray
+
+    mask = region_mask(image.shape, faces, FACE_PADDING) | region_mask(image.shape, text, TEXT_PADDING)
+    if mask.any():
+        np.copyto(image, obscure(image, mode), where=mask[..., None])
+    _, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+    return buffer.tobytes(), len(faces), len(text)
+
+class RedactionCache:
+    """SQLite-backed map from (source hash, settings) to the redacted blob.
+
+    Args:
+        path (str): SQLite database file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS redactions (
+                    source_hash TEXT NOT NULL,
+                    settings TEXT NOT NULL,
+                    image_ref TEXT NOT NULL,
+                    faces INTEGER NOT NULL,
+                    text_regions INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    PRIMARY KEY (source_hash, settings)
+                )
+            ''')
+
+    def _connect(self):
+        # sqlite3 connections cannot be shared across threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=10)
+        return conn
+
+    def get(self, source_hash, settings):
+        """Return (image_ref, faces, text_regions) for a cached redaction, or None."""
+        return self._connect().execute(
+            'SELECT image_ref, faces, text_regions FROM redactions WHERE source_hash = ? AND settings = ?',
+            (source_hash, settings)).fetchone()
+
+    def put(self, source_hash, settings, image_ref, faces, text_regions):
+        with self._connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO redactions VALUES (?, ?, ?, ?, ?, ?)',
+                         (source_hash, settings, image_ref, faces, text_regions, time.time()))
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = RedactionCache(os.getenv('REDACTION_CACHE_DB', DEFAULT_DB))
+        return _cache
+
+def redact_document(data, mode='pixelate', targets=DEFAULT_TARGETS):
+    """Redact one document, reusing the stored result for content seen before.
+
+    Identical documents redacted concurrently (e.g. twice in one batch) share
+    a single run.
+
+    Args:
+        data (bytes-like): Encoded image
+        mode (str): 'pixelate' or 'blur'
+        targets (tuple): Regions to redact, any of 'faces' and 'text'
+
+    Returns:
+        dict: image_ref (blob key of the redacted JPEG), faces, text_regions
+        and whether the result came from the cache
+    """
+    source_hash = hashlib.sha256(data).hexdigest()
+    settings = f"{mode}:{','.join(sorted(targets))}:v{REDACTION_VERSION}"
+    store = get_blob_store()
+
+    def run():
+        cached = get_cache().get(source_hash, settings)
+        if cached and store.exists(cached[0]):
+            image_ref, faces, text_regions = cached
+            return {'image_ref': image_ref, 'faces': faces, 'text_regions': text_regions, 'cached': True}
+        redacted, faces, text_regions = redact_image(data, mode, targets)
+        image_ref = store.put(redacted, 'jpg')
+        get_cache().put(source_hash, settings, image_ref, faces, text_regions)
+        return {'image_ref': image_ref, 'faces': faces, 'text_regions': text_regions, 'cached': False}
+
+    return dict(_inflight.do((source_hash, settings), run))
+
+def redact_url(url, mode='pixelate', targets=DEFAULT_TARGETS):
+    """Download a document and redact it (see redact_document)."""
+    with download(url) as body:
+        return redact_document(body.buffer(), mode, targets)
+
+def redact_batch(urls, mode='pixelate', targets=DEFAULT_TARGETS):
+    """Redact a set of documents in parallel.
+
+    A document that fails (download error, not an image) gets an 'error'
+    entry instead of failing the whole batch.
+
+    Args:
+        urls (list): Document URLs
+        mode (str): 'pixelate' or 'blur'
+        targets (tuple): Regions to redact, any of 'faces' and 'text'
+
+    Returns:
+        list: One result per URL, in order (see redact_document)
+    """
+    futures = [executor.submit(contextvars.copy_context().run, redact_url, url, mode, targets) for url in urls]
+    results = []
+    for url, future in zip(urls, futures):
+        try:
+            results.append(future.result())
+        except Exception as e:
+            print(f"Error redacting {url}: {str(e)}")
+            results.append({'error': str(e)[:100]})
+    return results
@@ -0,0 +1,233 @@
+import json
+import math
+from detection import CROP_FORMATS
+from incremental import REUSED_FIELDS, BOX_KEYS
+from convert_image import normalize_url, DownloadTooLarge
+from ratelimit import RateLimitExceeded
+
+# Request options and response objects for the detection routes, shared by the
+# threaded Flask service (app.py) and the asyncio service (async_app.py).
+
+# Image fields passed through from detection to the client
+CROP_IMAGE_FIELDS = ('box', 'image_ref', 'width', 'height', 'content_type')
+
+def crop_image_fields(obj):
+    """Build the client-facing image fields for a detected object.
+
+    Args:
+        obj (dict): Detected object from detect_and_crop_objects
+
+    Returns:
+        dict: 'image_url' (blob URL or inline data URL) plus box and crop metadata
+    """
+    fields = {'image_url': obj['image_url'] if 'image_url' in obj else obj['image_data']}
+    fields.update({key: obj[key] for key in CROP_IMAGE_FIELDS if key in obj})
+    return fields
+
+def pricing_image(obj):
+    """The image a detected object is priced from.
+
+    Args:
+        obj (dict): Detected object from detect_and_crop_objects
+
+    Returns:
+        tuple: (image URL, vision detail level), the resized pricing crop when
+        detection made one, else the client crop at 'auto' detail
+    """
+    if 'pricing_image_data' in obj:
+        return obj['pricing_image_data'], obj.get('pricing_detail', 'auto')
+    return obj['image_data'], 'auto'
+
+def parse_crop_options(json_data):
+    """Read and validate the crop delivery options of a detection request.
+
+    Args:
+        json_data (dict): Request JSON
+
+    Returns:
+        tuple: ((crop_output, crop_format, crop_quality), None) or (None, error message)
+    """
+    crop_output = json_data.get('crop_output', 'inline')
+    crop_format = json_data.get('crop_format', 'jpeg')
+    crop_quality = json_data.get('crop_quality')
+    if crop_output not in ('inline', 'reference') or crop_format not in CROP_FORMATS:
+        return None, 'Invalid crop_output or crop_format'
+    if crop_quality is not None and not (isinstance(crop_quality, int) and 1 <= crop_quality <= 100):
+        return None, 'crop_quality must be an integer between 1 and 100'
+    return (crop_output, crop_format, crop_quality), None
+
+def _valid_prior_object(obj):
+    # A prior object is an earlier /detect response object: a label, a box of
+    # four normalized coordinates and the priced fields to carry over
+    if not isinstance(obj, dict) or not isinstance(obj.get('label'), str):
+        return False
+    box = obj.get('box')
+    if not isinstance(box, dict) or not all(
+            isinstance(box.get(key), (int, float)) and not isinstance(box.get(key), bool) and
+            math.isfinite(box[key]) for key in BOX_KEYS):
+        return False
+    return all(isinstance(obj.get(key), str) for key in REUSED_FIELDS)
+
+def parse_detect_options(json_data):
+    """Read and validate the /detect options beyond the crop options.
+
+    Args:
+        json_data (dict): Request JSON
+
+    Returns:
+        tuple: ((prior_objects, prior_image_url, tiled, budget_ms), None) or
+        (None, error message)
+    """
+    # Incremental mode: reuse prices of objects unchanged since a prior photo
+    prior_objects = json_data.get('prior_objects')
+    prior_image_url = json_data.get('prior_image_url')
+    if prior_objects is not None:
+        if not isinstance(prior_objects, list) or not all(_valid_prior_object(obj) for obj in prior_objects):
+            return None, ('prior_objects must be a list of objects with a label, a box with numeric '
+                          f"{', '.join(BOX_KEYS)} and {', '.join(REUSED_FIELDS)}")
+        if prior_objects and not isinstance(prior_image_url, str):
+            return None, 'prior_image_url is required with prior_objects'
+
+    # Tiled detection for very large and panoramic photos: true, false (the
+    # default) or 'auto'; each tile is a separate detection call
+    tiled = json_data.get('tiled', False)
+    if tiled not in (True, False, 'auto'):
+        return None, "tiled must be true, false or 'auto'"
+
+    # Time budget: return by then with unfinished objects marked pending
+    budget_ms = json_data.get('budget_ms')
+    if budget_ms is not None and not (isinstance(budget_ms, int) and budget_ms > 0):
+        return None, 'budget_ms must be a positive integer'
+    return (prior_objects, prior_image_url, tiled, budget_ms), None
+
+def parse_detect_request(json_data):
+    """Read and validate a /detect request body.
+
+    Args:
+        json_data (dict): Request JSON
+
+    Returns:
+        tuple: ((image_url, crop_options, detect_options), None) or (None, error message)
+    """
+    if not json_data or 'url' not in json_data:
+        return None, 'No image URL provided'
+
+    # Crop delivery: inline data URLs (default) or blob store references
+    crop_options, error = parse_crop_options(json_data)
+    if error:
+        return None, error
+
+    # Incremental reuse, tiling and time budget
+    detect_options, error = parse_detect_options(json_data)
+    if error:
+        return None, error
+    return (json_data['url'], crop_options, detect_options), None
+
+def detect_key(image_url, crop_options, detect_options):
+    """Single-flight key under which identical concurrent /detect requests share one run."""
+    prior_objects, prior_image_url, tiled, budget_ms = detect_options
+    return ('detect', normalize_url(image_url), *crop_options, prior_image_url and normalize_url(prior_image_url),
+            json.dumps(prior_objects, sort_keys=True), tiled, budget_ms)
+
+def detect_response(analyzed_objects, job_id=None, job_url=None):
+    """Build the /detect response body, with the pending-pricing job if there is one."""
+    response_data = {
+        'success': True,
+        'detected_objects': analyzed_objects
+    }
+    if job_id:
+        response_data['job_id'] = job_id
+        response_data['job_url'] = job_url
+    return response_data
+
+def error_response(e):
+    """Map a failed detection request to its error body, status and headers.
+
+    Returns:
+        tuple: (JSON body, HTTP status, headers)
+    """
+    if isinstance(e, DownloadTooLarge):
+        return {'error': str(e)}, 413, {}
+    if isinstance(e, RateLimitExceeded):
+        return {'error': str(e)}, 503, {'Retry-After': str(int(e.retry_after) + 1)}
+    return {'error': str(e)[:100]}, 500, {}
+
+def merge_priced(detected_objects, reusable, priced, pending):
+    """Put reused and freshly priced objects back in detection order.
+
+    Args:
+        detected_objects (list): Detected objects
+        reusable (dict): Index into detected_objects -> prior object it reuses
+        priced (list): Results for the other objects, in detection order
+        pending (dict): Unfinished future or task -> index into priced
+
+    Returns:
+        tuple: (analyzed objects, dict of unfinished future or task -> index into them)
+    """
+    positions = [i for i in range(len(detected_objects)) if i not in reusable]
+    priced = iter(priced)
+    analyzed_objects = [reused_object(obj, reusable[i]) if i in reusable else next(priced)
+                        for i, obj in enumerate(detected_objects)]
+    return analyzed_objects, {task: positions[i] for task, i in pending.items()}
+
+def analyzed_object(obj, analysis):
+    """Build the response object for a priced detection.
+
+    Args:
+        obj (dict): Detected object
+        analysis (dict): Pricing result with name, description and price
+
+    Returns:
+        dict: Analyzed object with name, description and estimated price
+    """
+    # Extract price value, removing '$' if present
+    price_str = analysis.get('price', '$0').replace('$', '').replace(',', '')
+    try:
+        price = float(price_str)
+    except (ValueError, TypeError):
+        price = 0
+
+    return {
+        'label': obj['label'],
+        'confidence': obj['confidence'],
+        **crop_image_fields(obj),
+        'name': analysis.get('name', obj['label'].capitalize()),
+        'description': analysis.get('description', f'A {obj["label"]}'),
+        'estimated_price': f'${price:.2f}'
+    }
+
+def fallback_object(obj):
+    """Build the response object for a detection whose analysis failed."""
+    return {
+        'label': obj['label'],
+        'confidence': obj['confidence'],
+        **crop_image_fields(obj),
+        'name': obj['label'].capitalize(),
+        'description': f'A {obj["label"]}',
+        'estimated_price': f'${0:.2f}'
+    }
+
+def pending_object(obj):
+    """Build the placeholder for a detection still being priced.
+
+    It carries the same label-based name, description and zero price as
+    fallback_object, so clients that ignore 'pending' still get every field;
+    the priced object replaces it in the /detect-jobs result.
+    """
+    return {**fallback_object(obj), 'pending': True}
+
+def reused_object(obj, prior):
+    """Build the response object for a detection that keeps a prior object's price."""
+    return {
+        'label': obj['label'],
+        'confidence': obj['confidence'],
+        **crop_image_fields(obj),
+        **{key: prior[key] for key in REUSED_FIELDS},
+        'reused': True
+    }
+
+def pricing_order(detected_objects):
+    """Indices of detected objects, most prominent (confidence times crop area) first."""
+    return sorted(range(len(detected_objects)),
+                  key=lambda i: -detected_objects[i]['confidence'] * detected_objects[i].get('width', 1) *
+                  detected_objects[i].get('height', 1))
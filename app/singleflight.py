@@ -0,0 +1,90 @@
+import asyncio
+import threading
+
+# Merges concurrent identical work onto one in-flight computation. Used both
+# for whole routes (keyed by normalized URL) and for individual upstream calls
+# (keyed by request fingerprint, i.e. content hash).
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+class SingleFlight:
+    """Run at most one computation per key at a time.
+
+    Callers arriving while a computation for the same key is running wait for
+    it and receive its result (or exception) instead of starting their own.
+    Nothing is cached once the computation finishes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn, *args, **kwargs):
+        """Run ``fn(*args, **kwargs)`` unless an identical call is in flight.
+
+        Args:
+            key (hashable): Identity of the computation
+            fn (callable): Computation to run
+
+        Returns:
+            The result of the (possibly shared) computation
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                call.waiters += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def in_flight(self):
+        """Return the number of keys currently being computed."""
+        with self._lock:
+            return len(self._calls)
+
+class AsyncSingleFlight:
+    """asyncio counterpart of SingleFlight for coroutines on one event loop."""
+
+    def __init__(self):
+        self._calls = {}
+
+    async def do(self, key, fn, *args, **kwargs):
+        """Await ``fn(*args, **kwargs)`` unless an identical call is in flight.
+
+        Returns:
+            The coroutine's result, shared with every concurrent caller
+        """
+        future = self._calls.get(key)
+        if future is not None:
+            # shield: one caller being cancelled must not cancel the shared call
+            return await asyncio.shield(future)
+
+        future = self._calls[key] = asyncio.ensure_future(fn(*args, **kwargs))
+        future.add_done_callback(lambda _: self._calls.pop(key, None))
+        return await asyncio.shield(future)
+
+    def in_flight(self):
+        """Return the number of keys currently being computed."""
+        return len(self._calls)
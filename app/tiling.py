@@ -0,0 +1,167 @@
+import os
+import math
+import contextvars
+import cv2
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+
+# Tiled detection for very large and panoramic photos. Detection providers
+# downsample big images and miss small valuables, so the image is split into
+# overlapping tiles that are detected concurrently; tile-local boxes are mapped
+# back to global normalized coordinates and duplicates along the seams are
+# merged with class-aware NMS.
+#
+# Every tile is its own paid detection call, so tiling is opt-in per request
+# ('tiled': true, or 'auto' to tile only images past the thresholds below) and
+# can multiply a request's detection cost by up to MAX_TILES.
+#
+#   TILE_SIZE             target tile edge in pixels
+#   TILE_OVERLAP          overlap between neighbouring tiles in pixels
+#   MAX_TILES             upper bound on tiles per image (caps upstream cost)
+#   TILE_MIN_MEGAPIXELS   'auto' tiles images at least this large...
+#   TILE_MIN_ASPECT       ...or at least this elongated (panoramas)
+
+load_dotenv()
+
+TILE_SIZE = int(os.getenv('TILE_SIZE', 2048))
+TILE_OVERLAP = int(os.getenv('TILE_OVERLAP', 256))
+MAX_TILES = int(os.getenv('MAX_TILES', 9))
+TILE_MIN_MEGAPIXELS = float(os.getenv('TILE_MIN_MEGAPIXELS', 24))
+TILE_MIN_ASPECT = float(os.getenv('TILE_MIN_ASPECT', 2.5))
+# Boxes overlapping this much (intersection over the smaller box) are the same
+# object; using the smaller box lets a seam-clipped partial box merge into the
+# complete one from the neighbouring tile
+MERGE_THRESHOLD = 0.7
+
+def should_tile(image_size, tiled=False):
+    """Decide whether to use tiled detection.
+
+    Args:
+        image_size (tuple): (width, height) of the image
+        tiled (Union[bool, str]): True, False or 'auto'
+
+    Returns:
+        bool: True if the image should be tiled
+    """
+    if tiled != 'auto':
+        return bool(tiled)
+    width, height = image_size
+    aspect = max(width, height) / max(min(width, height), 1)
+    return width * height >= TILE_MIN_MEGAPIXELS * 1_000_000 or aspect >= TILE_MIN_ASPECT
+
+def plan_tiles(width, height, tile_size=TILE_SIZE, overlap=TILE_OVERLAP, max_tiles=MAX_TILES):
+    """Lay out overlapping tiles covering the image.
+
+    Tiles grow beyond ``tile_size`` when needed to stay within ``max_tiles``.
+
+    Returns:
+        list: Pixel rectangles (x_min, y_min, x_max, y_max)
+    """
+    cols = max(1, math.ceil((width - overlap) / (tile_size - overlap)))
+    rows = max(1, math.ceil((height - overlap) / (tile_size - overlap)))
+    while cols * rows > max_tiles:
+        # Drop a tile from the denser axis
+        if cols / width >= rows / height and cols > 1:
+            cols -= 1
+        else:
+            rows -= 1
+
+    def spans(length, count):
+        if count == 1:
+            return [(0, length)]
+        size = math.ceil((length + (count - 1) * overlap) / count)
+        step = (length - size) / (count - 1)
+        return [(int(round(i * step)), int(round(i * step)) + size) for i in range(count)]
+
+    return [(x0, y0, min(x1, width), min(y1, height))
+            for y0, y1 in spans(height, rows)
+            for x0, x1 in spans(width, cols)]
+
+def nms(boxes, scores, labels, threshold=MERGE_THRESHOLD):
+    """Class-aware non-maximum suppression on intersection over the smaller box.
+
+    Instead of discarding suppressed boxes, they are returned grouped under the
+    box that suppressed them, so callers can merge their extents.
+
+    Args:
+        boxes (numpy.ndarray): N x 4 boxes (x_min, y_min, x_max, y_max)
+        scores (numpy.ndarray): N confidences
+        labels (list): N labels; only boxes with the same label suppress each other
+        threshold (float): Overlap above which the lower-scoring box is dropped
+
+    Returns:
+        list: Groups of indices, each led by the kept box, highest score first
+    """
+    if len(boxes) == 0:
+        return []
+    _, label_ids = np.unique(np.array([label.lower() for label in labels]), return_inverse=True)
+    areas = np.maximum(boxes[:, 2] - boxes[:, 0], 0) * np.maximum(boxes[:, 3] - boxes[:, 1], 0)
+    order = np.argsort(-scores, kind='stable')
+    groups = []
+    while order.size:
+        i = order[0]
+        rest = order[1:]
+        x0 = np.maximum(boxes[i, 0], boxes[rest, 0])
+        y0 = np.maximum(boxes[i, 1], boxes[rest, 1])
+        x1 = np.minimum(boxes[i, 2], boxes[rest, 2])
+        y1 = np.minimum(boxes[i, 3], boxes[rest, 3])
+        intersection = np.clip(x1 - x0, 0, None) * np.clip(y1 - y0, 0, None)
+        overlap = intersection / np.maximum(np.minimum(areas[i], areas[rest]), 1e-12)
+        duplicate = (overlap > threshold) & (label_ids[rest] == label_ids[i])
+        groups.append([int(i)] + [int(j) for j in rest[duplicate]])
+        order = rest[~duplicate]
+    return groups
+
+def detect_tiled(image, request_fn, max_workers=MAX_TILES):
+    """Run detection on overlapping tiles of a decoded image and merge the results.
+
+    Args:
+        image (numpy.ndarray): Decoded BGR image
+        request_fn (callable): Detection call taking encoded image bytes and
+            returning items with tile-normalized boxes (request_detections)
+        max_workers (int): Tiles detected concurrently
+
+    Returns:
+        list: Items with boxes normalized to the full image
+    """
+    height, width = image.shape[:2]
+    tiles = plan_tiles(width, height)
+
+    def detect_tile(tile):
+        x0, y0, x1, y1 = tile
+        _, buffer = cv2.imencode('.jpg', image[y0:y1, x0:x1], [cv2.IMWRITE_JPEG_QUALITY, 92])
+        return request_fn(buffer.tobytes())
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(tiles))) as executor:
+        tile_results = list(executor.map(lambda tile, context: context.run(detect_tile, tile),
+                                         tiles, [contextvars.copy_context() for _ in tiles]))
+
+    items, boxes = [], []
+    for (x0, y0, x1, y1), results in zip(tiles, tile_results):
+        tile_width, tile_height = x1 - x0, y1 - y0
+        for obj in results:
+            box = [
+                (x0 + obj['x_min'] * tile_width) / width,
+                (y0 + obj['y_min'] * tile_height) / height,
+                (x0 + obj['x_max'] * tile_width) / width,
+                (y0 + obj['y_max'] * tile_height) / height,
+            ]
+            items.append(dict(obj, x_min=box[0], y_min=box[1], x_max=box[2], y_max=box[3]))
+            boxes.append(box)
+
+    if not items:
+        return []
+    boxes = np.array(boxes)
+    groups = nms(boxes, np.array([obj.get('confidence', 1.0) for obj in items]),
+                 [obj['label'] for obj in items])
+
+    # Keep the best-scoring item of each group, grown to cover boxes clipped at a seam
+    merged = []
+    for group in sorted(groups, key=lambda g: g[0]):
+        x_min, y_min = boxes[group, :2].min(axis=0)
+        x_max, y_max = boxes[group, 2:].max(axis=0)
+        merged.append(dict(items[group[0]], x_min=float(x_min), y_min=float(y_min),
+                           x_max=float(x_max), y_max=float(y_max)))
+    print(f"Tiled detection: {len(tiles)} tiles, {len(items)} raw boxes, {len(merged)} after merging")
+    return merged
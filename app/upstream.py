@@ -0,0 +1,147 @@
+import base64
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from openai.types.chat import ChatCompletion
+import cassette
+import accounting
+import ratelimit
+from singleflight import SingleFlight
+
+# Every call to a paid upstream API goes through this module so cross-cutting
+# behaviour (recording/replay, rate limiting, coalescing, usage accounting) is
+# applied in one place.
+
+# Identical concurrent upstream calls (same request fingerprint) share one call
+_inflight = SingleFlight()
+
+# Pooled keep-alive connections, so calls after the first skip DNS and TLS setup
+session = requests.Session()
+session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
+def _http_payload(kwargs):
+    return {k: kwargs.get(k) for k in ('data', 'json', 'files', 'params')}
+
+def _response_from_entry(entry, url):
+    """Rebuild a requests.Response from a cassette entry."""
+    response = requests.Response()
+    response.status_code = entry['status']
+    response.headers.update(entry.get('headers', {}))
+    response.url = url
+    if 'text' in entry:
+        response._content = entry['text'].encode('utf-8')
+        response.encoding = 'utf-8'
+    else:
+        response._content = base64.b64decode(entry['body_b64'])
+    return response
+
+def http_fingerprint(service, url, kwargs):
+    return cassette.fingerprint(service, url, _http_payload(kwargs))
+
+def chat_fingerprint(service, kwargs):
+    # max_tokens adapts over time (see accounting), so it is not part of the
+    # request's identity
+    return cassette.fingerprint(service, 'chat.completions', {k: v for k, v in kwargs.items() if k != 'max_tokens'})
+
+def replay_http(key, service, url):
+    """Serve an HTTP call from the cassette, accounting it like a live one."""
+    entry = cassette.replay(key)
+    response = _response_from_entry(entry, url)
+    accounting.record_http(service, response, entry.get('latency', 0))
+    return response
+
+def replay_chat(key, kwargs):
+    """Serve a chat completion from the cassette, accounting it like a live one."""
+    entry = cassette.replay(key)
+    response = ChatCompletion.model_validate(entry['response'])
+    accounting.record_completion(kwargs, response, entry.get('latency', 0))
+    return response
+
+def finish_http(key, service, url, response, latency):
+    """Account a live HTTP call and record it in record mode.
+
+    Works with both requests and httpx responses.
+    """
+    accounting.record_http(service, response, latency)
+    if cassette.mode() != 'record':
+        return
+
+    entry = {
+        'fingerprint': key,
+        'service': service,
+        'url': url,
+        'latency': round(latency, 4),
+        'status': response.status_code,
+        'headers': {'Content-Type': response.headers.get('Content-Type', '')},
+    }
+    try:
+        entry['text'] = response.content.decode('utf-8')
+    except UnicodeDecodeError:
+        entry['body_b64'] = base64.b64encode(response.content).decode('ascii')
+    cassette.record(entry)
+
+def finish_chat(key, service, kwargs, response, latency):
+    """Account a live chat completion and record it in record mode."""
+    accounting.record_completion(kwargs, response, latency)
+    if cassette.mode() != 'record':
+        return
+
+    cassette.record({
+        'fingerprint': key,
+        'service': service,
+        'model': kwargs.get('model'),
+        'latency': round(latency, 4),
+        'response': response.model_dump(mode='json'),
+    })
+
+def post(service, url, **kwargs):
+    """POST to an upstream HTTP API, honouring the cassette mode.
+
+    Live calls wait on the service's rate limiter, and identical concurrent
+    calls are coalesced into one.
+
+    Args:
+        service (str): Upstream name used for fingerprinting, e.g. 'edenai'
+        url (str): Endpoint URL
+        **kwargs: Passed through to session.post
+
+    Returns:
+        requests.Response: Live or replayed response
+    """
+    key = http_fingerprint(service, url, kwargs)
+    if cassette.mode() == 'replay':
+        return replay_http(key, service, url)
+    return _inflight.do(key, _post, key, service, url, kwargs)
+
+def _post(key, service, url, kwargs):
+    ratelimit.acquire(service)
+    started = time.perf_counter()
+    response = session.post(url, **kwargs)
+    finish_http(key, service, url, response, time.perf_counter() - started)
+    return response
+
+def create_chat_completion(service, client, **kwargs):
+    """Create a chat completion on an OpenAI-compatible client, honouring the cassette mode.
+
+    Live calls wait on the service's rate limiter, and identical concurrent
+    calls are coalesced into one.
+
+    Args:
+        service (str): Upstream name used for fingerprinting, e.g. 'openai' or 'groq'
+        client: OpenAI or Groq client
+        **kwargs: Passed through to client.chat.completions.create
+
+    Returns:
+        Chat completion object with ``choices`` and ``usage``
+    """
+    key = chat_fingerprint(service, kwargs)
+    if cassette.mode() == 'replay':
+        return replay_chat(key, kwargs)
+    return _inflight.do(key, _create_chat_completion, key, service, client, kwargs)
+
+def _create_chat_completion(key, service, client, kwargs):
+    ratelimit.acquire(service)
+    started = time.perf_counter()
+    response = client.chat.completions.create(**kwargs)
+    finish_chat(key, service, kwargs, response, time.perf_counter() - started)
+    return response
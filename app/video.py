@@ -0,0 +1,187 @@
+import os
+import contextvars
+import cv2
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from detection import detect_and_crop_objects
+from incremental import estimate_homography, project_boxes, match_boxes, crop_similarity, load_gray
+
+# Walkthrough video ingestion. The video is decoded as a stream, sampled a few
+# times per second, and split into segments of visually similar frames; the
+# sharpest frame of each segment becomes a keyframe. Only keyframes are sent to
+# detection, and objects seen in several keyframes are merged into one track
+# (boxes chained through frame-to-frame homographies, confirmed by crop
+# similarity) before a single pricing pass.
+#
+#   MAX_VIDEO_BYTES     size cap for the downloaded video
+#   MAX_VIDEO_SECONDS   only this much of the video is read
+#   VIDEO_KEYFRAMES     maximum keyframes sent to detection
+#   VIDEO_SAMPLE_FPS    frames per second inspected for keyframe selection
+
+load_dotenv()
+
+MAX_VIDEO_BYTES = int(os.getenv('MAX_VIDEO_BYTES', 200 * 1024 * 1024))
+MAX_VIDEO_SECONDS = float(os.getenv('MAX_VIDEO_SECONDS', 120))
+MAX_KEYFRAMES = int(os.getenv('VIDEO_KEYFRAMES', 12))
+SAMPLE_FPS = float(os.getenv('VIDEO_SAMPLE_FPS', 4))
+DETECTION_WORKERS = 4
+
+THUMB_WIDTH = 160
+# Frames less similar than this to the segment's first frame start a new segment
+SEGMENT_SIMILARITY = 0.6
+# Laplacian variance (on the thumbnail) below which a frame is too blurry to use
+MIN_SHARPNESS = 20.0
+TRACK_IOU = 0.3
+TRACK_SIMILARITY = 0.5
+APPEARANCE_SIMILARITY = 0.8
+
+def _thumbnail(frame):
+    height, width = frame.shape[:2]
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    return cv2.resize(gray, (THUMB_WIDTH, max(1, THUMB_WIDTH * height // width)), interpolation=cv2.INTER_AREA)
+
+def _similarity(a, b):
+    """Normalized cross-correlation of two equally sized thumbnails."""
+    return float(cv2.matchTemplate(a.astype(np.float32), b.astype(np.float32), cv2.TM_CCOEFF_NORMED)[0, 0])
+
+def select_keyframes(path, max_keyframes=MAX_KEYFRAMES, sample_fps=SAMPLE_FPS):
+    """Pick sharp, distinct keyframes from a video without holding it in memory.
+
+    Only sampled frames are decoded (the rest are grabbed and skipped), and at
+    most one full-resolution candidate frame is kept at a time. Keyframes are
+    returned JPEG-encoded.
+
+    Args:
+        path (str): Video file path
+        max_keyframes (int): Maximum keyframes to return; the blurriest are dropped
+        sample_fps (float): Frames per second to inspect
+
+    Returns:
+        list: (frame_index, jpeg_bytes) tuples in video order
+    """
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        raise Exception('Failed to open video')
+
+    fps = capture.get(cv2.CAP_PROP_FPS) or 30
+    step = max(1, round(fps / sample_fps))
+    max_frames = int(MAX_VIDEO_SECONDS * fps)
+
+    keyframes = []  # (sharpness, frame_index, jpeg_bytes)
+    anchor = None
+    best = None  # (sharpness, frame_index, frame) for the current segment
+
+    def flush():
+        if best is not None and best[0] >= MIN_SHARPNESS:
+            _, buffer = cv2.imencode('.jpg', best[2], [cv2.IMWRITE_JPEG_QUALITY, 92])
+            keyframes.append((best[0], best[1], buffer.tobytes()))
+            if len(keyframes) > max_keyframes:
+                keyframes.remove(min(keyframes, key=lambda k: k[0]))
+
+    try:
+        index = 0
+        while index < max_frames:
+            if index % step:
+                if not capture.grab():
+                    break
+                index += 1
+                continue
+            ok, frame = capture.read()
+            if not ok:
+                break
+            thumb = _thumbnail(frame)
+            sharpness = float(cv2.Laplacian(thumb, cv2.CV_64F).var())
+
+            if anchor is None or _similarity(anchor, thumb) < SEGMENT_SIMILARITY:
+                flush()
+                anchor, best = thumb, None
+            if best is None or sharpness > best[0]:
+                best = (sharpness, index, frame)
+            index += 1
+        flush()
+    finally:
+        capture.release()
+
+    return [(frame_index, data) for _, frame_index, data in sorted(keyframes, key=lambda k: k[1])]
+
+def _box_array(objects):
+    return np.array([[o['box']['x_min'], o['box']['y_min'], o['box']['x_max'], o['box']['y_max']] for o in objects],
+                    dtype=np.float64).reshape(-1, 4)
+
+def track_objects(frames):
+    """Merge detections of the same object across consecutive keyframes.
+
+    Args:
+        frames (list): (frame_index, gray_image, detected_objects) in video order
+
+    Returns:
+        list: Tracks, each a list of (frame_index, detected_object)
+    """
+    tracks = []
+    previous = None  # (gray, objects, track ids)
+    for frame_index, gray, objects in frames:
+        track_ids = [None] * len(objects)
+        if previous is not None and objects and previous[1]:
+            prev_gray, prev_objects, prev_ids = previous
+            homography = estimate_homography(prev_gray, gray)
+            prev_boxes = _box_array(prev_objects)
+            boxes = _box_array(objects)
+            if homography is not None:
+                pairs = match_boxes(boxes, [o['label'] for o in objects],
+                                    project_boxes(homography, prev_boxes), [o['label'] for o in prev_objects],
+                                    min_iou=TRACK_IOU)
+                threshold = TRACK_SIMILARITY
+            else:
+                # Camera moved too much to align: fall back to appearance only
+                pairs = [(i, j) for i, o in enumerate(objects) for j, p in enumerate(prev_objects)
+                         if o['label'].lower() == p['label'].lower()]
+                threshold = APPEARANCE_SIMILARITY
+            used = set()
+            for i, j in pairs:
+                if track_ids[i] is None and j not in used and \
+                        crop_similarity(gray, boxes[i], prev_gray, prev_boxes[j]) >= threshold:
+                    track_ids[i] = prev_ids[j]
+                    used.add(j)
+
+        for i, obj in enumerate(objects):
+            if track_ids[i] is None:
+                track_ids[i] = len(tracks)
+                tracks.append([])
+            tracks[track_ids[i]].append((frame_index, obj))
+        previous = (gray, objects, track_ids)
+    return tracks
+
+def _representative(track):
+    """Pick the detection with the best confidence-weighted crop area."""
+    def score(item):
+        obj = item[1]
+        return obj['confidence'] * obj['width'] * obj['height']
+    frame_index, obj = max(track, key=score)
+    return dict(obj, frame_index=frame_index, seen_in_frames=[f for f, _ in track])
+
+def detect_video_objects(path, crop_format='jpeg', crop_quality=None, crop_output='inline'):
+    """Detect the distinct objects in a walkthrough video.
+
+    Args:
+        path (str): Video file path
+        crop_format (str): Crop encoding passed to detect_and_crop_objects
+        crop_quality (int): Encoder quality, or None for the default
+        crop_output (str): 'inline' or 'reference'
+
+    Returns:
+        tuple: (number of keyframes, list of deduplicated detected objects with
+        'frame_index' and 'seen_in_frames')
+    """
+    keyframes = select_keyframes(path)
+
+    with ThreadPoolExecutor(max_workers=DETECTION_WORKERS) as executor:
+        detections = list(executor.map(
+            lambda keyframe, context: context.run(detect_and_crop_objects, keyframe[1], crop_format, crop_quality,
+                                                  crop_output),
+            keyframes, [contextvars.copy_context() for _ in keyframes]))
+
+    frames = [(frame_index, load_gray(data), objects)
+              for (frame_index, data), objects in zip(keyframes, detections)]
+    tracks = track_objects(frames)
+    return len(keyframes), [_representative(track) for track in tracks]
@@ -0,0 +1,134 @@
+import os
+import time
+import threading
+import multiprocessing
+import cv2
+import numpy as np
+from dotenv import load_dotenv
+import cassette
+import crop_pool
+import upstream
+import convert_image
+import pricing
+from detection import CROP_FORMATS, REDUCED_DECODE_FLAGS
+
+# Worker warm-up. The first request to a fresh worker otherwise pays for DNS
+# lookups and TLS handshakes to every upstream (Eden AI, Firebase Storage and
+# the OpenAI and Groq APIs, through the SDKs' own HTTP clients), OpenCV
+# loading its codecs and the crop pool spawning its processes. warm_up() does all of that before the
+# worker reports ready on /health. Network steps are best-effort: a provider
+# being down is logged but does not keep the worker out of rotation, since
+# requests would fail the same way. Nothing here calls a paid provider API.
+#
+# start() is called by the serving entry point (app.py's __main__ block, the
+# async app's startup hook); under another WSGI server call it from the
+# worker start hook, e.g. gunicorn's post_worker_init.
+#
+#   WARMUP_ON_START   run the warm-up in the background when the server starts
+#   WARMUP_TIMEOUT    per-connection timeout for network warm-up, in seconds
+
+load_dotenv()
+
+WARMUP_ON_START = os.getenv('WARMUP_ON_START', 'false').lower() in ('1', 'true', 'yes')
+WARMUP_TIMEOUT = float(os.getenv('WARMUP_TIMEOUT', 5))
+
+EDENAI_URL = 'https://api.edenai.run/'
+STORAGE_URL = 'https://firebasestorage.googleapis.com/'
+
+# (pooled requests session or httpx client, URL) pairs opened so later calls
+# reuse the connection. Each gets an unauthenticated HEAD of the base URL,
+# which no provider bills.
+WARM_CONNECTIONS = [
+    (upstream.session, EDENAI_URL),
+    (convert_image.session, STORAGE_URL),
+    (pricing.openai_http, str(pricing.client.base_url)),
+    (pricing.groq_http, str(pricing.client_groq.base_url)),
+]
+
+_lock = threading.Lock()
+_state = {'status': 'cold' if WARMUP_ON_START else 'ready', 'steps': {}}
+
+def status():
+    """Return a snapshot of the warm-up state for the health endpoint.
+
+    Returns:
+        dict: 'status' ('cold', 'warming', 'ready' or 'failed') and per-step results
+    """
+    with _lock:
+        return {'status': _state['status'], 'steps': dict(_state['steps'])}
+
+def is_ready():
+    with _lock:
+        return _state['status'] == 'ready'
+
+def _step(name, fn):
+    started = time.perf_counter()
+    try:
+        detail = fn()
+        result = {'ok': True}
+        if detail is not None:
+            result['detail'] = detail
+    except Exception as e:
+        print(f"Warm-up step {name} failed: {str(e)[:100]}")
+        result = {'ok': False, 'error': str(e)[:100]}
+    result['seconds'] = round(time.perf_counter() - started, 3)
+    with _lock:
+        _state['steps'][name] = result
+    return result['ok']
+
+def _warm_opencv():
+    """Encode and decode a tiny image through every codec path requests use."""
+    image = np.random.default_rng(0).integers(0, 255, (64, 64, 3), dtype=np.uint8)
+    for ext, _, quality_flag in CROP_FORMATS.values():
+        ok, buffer = cv2.imencode(f'.{ext}', image, [quality_flag, 80])
+        if not ok:
+            raise Exception(f'Failed to encode .{ext}')
+    ok, buffer = cv2.imencode('.jpg', image)
+    for flag in REDUCED_DECODE_FLAGS.values():
+        if cv2.imdecode(buffer, flag) is None:
+            raise Exception('Failed to decode image')
+
+def _warm_connection(session, url):
+    # Any response means DNS, TCP and TLS are done and the socket is pooled;
+    # requests sessions and httpx clients take the same arguments here
+    session.head(url, timeout=WARMUP_TIMEOUT).close()
+
+def warm_up():
+    """Run every warm-up step and mark the worker ready.
+
+    Local steps must succeed for the worker to become ready; network steps
+    are skipped in cassette replay mode.
+
+    Returns:
+        bool: True if the worker is ready
+    """
+    with _lock:
+        _state['status'] = 'warming'
+    started = time.perf_counter()
+
+    ready = _step('opencv', _warm_opencv)
+    ready = _step('crop_pool', crop_pool.warm_up) and ready
+    if cassette.mode() != 'replay':
+        for session, url in WARM_CONNECTIONS:
+            _step(f'connect:{url.split("/")[2]}', lambda: _warm_connection(session, url))
+
+    with _lock:
+        _state['status'] = 'ready' if ready else 'failed'
+    print(f"Warm-up {'finished' if ready else 'failed'} in {time.perf_counter() - started:.2f}s")
+    return ready
+
+def start():
+    """Warm up in the background, or mark the worker ready straight away if disabled.
+
+    Does nothing in child processes (e.g. crop pool workers), which must not
+    start warm-ups and pools of their own.
+    """
+    if multiprocessing.parent_process() is not None:
+        return None
+    if not WARMUP_ON_START:
+        with _lock:
+            _state['status'] = 'ready'
+        return None
+    thread = threading.Thread(target=warm_up, name='warmup', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,266 @@
+"""Offline micro-benchmarks for the CPU-bound image stages of /detect.
+
+Times every stage of ``detect_and_crop_objects`` (minus the Eden AI call) plus
+the base64 pass done by ``url_to_base64`` on synthetic photos from 1 MP to
+48 MP with 1 to 50 detected objects, and reports the bytes allocated by each
+stage through tracemalloc.
+
+``--budget`` instead runs the reference case end to end (decode, crops,
+response serialization) under the app's memory profiler and fails when its
+peak exceeds the memory budget with exit status 1. Nothing runs it
+automatically: add it as a CI step (see the README) so changes that add image
+copies are caught before they cause OOM kills. Crops are encoded in-process
+for this check.
+
+Usage:
+    python benchmark_stages.py                  # print a table
+    python benchmark_stages.py --write          # refresh the committed results
+    python benchmark_stages.py --compare        # diff against the committed results
+    python benchmark_stages.py --budget         # exit 1 if the reference peak is over budget
+"""
+import argparse
+import base64
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+# Reuse the stage functions from the Flask app, encoding crops in-process
+os.environ.setdefault('CROP_WORKERS', '1')
+sys.path.append(os.path.join(os.path.dirname(__file__), '../app'))
+from detection import (load_image_bytes, decode_image, choose_reduction, crop_objects, encode_crop,
+                       encode_crop_variants, pricing_detail, detect_and_crop_objects)
+from image_header import read_image_size
+import memprof
+
+RESULTS_PATH = os.path.join(os.path.dirname(__file__), 'benchmarks', 'stages.json')
+MEGAPIXELS = [1, 12, 24, 48]
+OBJECT_COUNTS = [1, 10, 50]
+# Reference case for --budget and its peak traced memory budget (measured at
+# about 85 MB: a 72 MB full decode plus crops)
+BUDGET_CASE = (24, 50)
+PEAK_BUDGET_MB = 100
+
+def make_image(megapixels, seed=0):
+    """Build a deterministic 4:3 JPEG with photo-like content.
+
+    Args:
+        megapixels (int): Target resolution in megapixels
+        seed (int): Seed for the noise layer
+
+    Returns:
+        bytes: Encoded JPEG
+    """
+    width = int((megapixels * 1_000_000 * 4 / 3) ** 0.5)
+    height = int(width * 3 / 4)
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    image = np.empty((height, width, 3), dtype=np.uint8)
+    image[..., 0] = (x + y) / 2
+    image[..., 1] = np.abs(x - y)
+    image[..., 2] = 255 - y
+    # Coarse noise blocks so the JPEG is not unrealistically small
+    noise = rng.integers(0, 48, size=(height // 16 + 1, width // 16 + 1), dtype=np.uint8)
+    image[..., 1] += np.kron(noise, np.ones((16, 16), dtype=np.uint8))[:height, :width]
+    _, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 90])
+    return buffer.tobytes()
+
+def make_detections(count, seed=0):
+    """Build deterministic Eden AI style detections.
+
+    Args:
+        count (int): Number of objects
+        seed (int): Seed for box placement
+
+    Returns:
+        list: Items with normalized box coordinates
+    """
+    rng = np.random.default_rng(seed)
+    items = []
+    for idx in range(count):
+        w, h = rng.uniform(0.05, 0.4, size=2)
+        x_min, y_min = rng.uniform(0, 1 - w), rng.uniform(0, 1 - h)
+        items.append({
+            'label': f'object_{idx}',
+            'confidence': 0.9,
+            'x_min': x_min, 'x_max': x_min + w,
+            'y_min': y_min, 'y_max': y_min + h,
+        })
+    return items
+
+def build_stages(jpeg_bytes, detections):
+    """Return the pipeline stages as (name, callable) pairs.
+
+    Each callable reads earlier stage outputs from a shared state dict, so
+    every stage can be timed in isolation on realistic inputs.
+    ``imdecode_reduced`` is the resolution-aware decode /detect uses; crops
+    are still taken from the full decode so their cost stays comparable.
+    ``encode_crop`` repeats ``imencode`` + ``b64encode`` through a single
+    helper, and ``encode_crop_variants`` is the per-crop encode /detect runs:
+    the client crop plus the resized JPEG sized for pricing.
+    """
+    return [
+        ('url_to_base64', lambda state: base64.b64encode(jpeg_bytes).decode('utf-8')),
+        ('load_image_bytes', lambda state: load_image_bytes(state['url_to_base64'])),
+        ('imdecode', lambda state: decode_image(state['load_image_bytes'])),
+        ('imdecode_reduced', lambda state: decode_image(
+            state['load_image_bytes'],
+            choose_reduction(read_image_size(state['load_image_bytes']), detections))),
+        ('crop', lambda state: crop_objects(state['imdecode'], detections)),
+        ('imencode', lambda state: [cv2.imencode('.jpg', crop)[1] for crop in state['crop']]),
+        ('b64encode', lambda state: [base64.b64encode(buf).decode('utf-8') for buf in state['imencode']]),
+        ('encode_crop', lambda state: [encode_crop(crop) for crop in state['crop']]),
+        ('encode_crop_variants', lambda state: [
+            encode_crop_variants(crop, pricing_detail(crop.shape[1], crop.shape[0])) for crop in state['crop']]),
+    ]
+
+def run_case(megapixels, count, repeat):
+    """Benchmark every stage for one image size and object count.
+
+    Returns:
+        dict: Per-stage median time in milliseconds and allocated bytes
+    """
+    jpeg_bytes = make_image(megapixels)
+    stages = build_stages(jpeg_bytes, make_detections(count))
+
+    timings = {name: [] for name, _ in stages}
+    for _ in range(repeat):
+        state = {}
+        for name, stage in stages:
+            started = time.perf_counter()
+            state[name] = stage(state)
+            timings[name].append((time.perf_counter() - started) * 1000)
+        del state
+
+    # Allocation pass runs separately so tracing does not skew the timings
+    allocations = {}
+    state = {}
+    tracemalloc.start()
+    for name, stage in stages:
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        state[name] = stage(state)
+        current, peak = tracemalloc.get_traced_memory()
+        allocations[name] = {'peak_bytes': peak - before, 'retained_bytes': current - before}
+    tracemalloc.stop()
+    del state
+
+    return {
+        'megapixels': megapixels,
+        'objects': count,
+        'input_bytes': len(jpeg_bytes),
+        'stages': {
+            name: {
+                'ms': round(statistics.median(timings[name]), 2),
+                'alloc_peak_bytes': allocations[name]['peak_bytes'],
+                'alloc_retained_bytes': allocations[name]['retained_bytes'],
+            }
+            for name, _ in stages
+        },
+    }
+
+def run_all(megapixels, counts, repeat):
+    results = []
+    for mp in megapixels:
+        for count in counts:
+            print(f'Benchmarking {mp} MP / {count} objects...', file=sys.stderr)
+            results.append(run_case(mp, count, repeat))
+    return {
+        'machine': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'opencv': cv2.__version__,
+            'numpy': np.__version__,
+        },
+        'repeat': repeat,
+        'results': results,
+    }
+
+def check_budget(megapixels, count, budget_mb):
+    """Profile one /detect pass end to end and compare its peak with a budget.
+
+    Returns:
+        bool: True if the peak traced memory is within the budget
+    """
+    jpeg_bytes = make_image(megapixels)
+    detections = make_detections(count)
+
+    tracemalloc.start()
+    token = memprof.begin('detect')
+    with memprof.stage('detect'):
+        detected_objects = detect_and_crop_objects(jpeg_bytes, detections=detections)
+    with memprof.stage('respond'):
+        body = json.dumps({'success': True, 'detected_objects': detected_objects})
+    summary = memprof.end(token)
+    tracemalloc.stop()
+    del body, detected_objects
+
+    print(f"{'stage':<18}{'peak MB':>10}{'kept MB':>10}")
+    for name, stage in summary['stages'].items():
+        print(f"{name:<18}{stage['peak'] / 1e6:>10.2f}{stage['retained'] / 1e6:>10.2f}")
+    peak_mb = summary['peak'] / 1e6
+    within = peak_mb <= budget_mb
+    print(f"{megapixels} MP / {count} objects: peak {peak_mb:.1f} MB, budget {budget_mb:g} MB"
+          f" -> {'ok' if within else 'OVER BUDGET'}")
+    return within
+
+def print_table(report, baseline=None):
+    """Print per-stage timings and allocations, with deltas against a baseline."""
+    previous = {}
+    if baseline:
+        for case in baseline['results']:
+            previous[(case['megapixels'], case['objects'])] = case['stages']
+
+    print(f"{'case':<12}{'stage':<22}{'ms':>10}{'peak MB':>10}{'kept MB':>10}{'Δms':>10}{'Δpeak MB':>10}")
+    for case in report['results']:
+        key = (case['megapixels'], case['objects'])
+        label = f'{key[0]}MP/{key[1]}'
+        for name, stage in case['stages'].items():
+            line = (f"{label:<12}{name:<22}{stage['ms']:>10.2f}"
+                    f"{stage['alloc_peak_bytes'] / 1e6:>10.2f}{stage['alloc_retained_bytes'] / 1e6:>10.2f}")
+            old = previous.get(key, {}).get(name)
+            if old:
+                line += (f"{stage['ms'] - old['ms']:>+10.2f}"
+                         f"{(stage['alloc_peak_bytes'] - old['alloc_peak_bytes']) / 1e6:>+10.2f}")
+            print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--megapixels', type=int, nargs='+', default=MEGAPIXELS)
+    parser.add_argument('--objects', type=int, nargs='+', default=OBJECT_COUNTS)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--write', action='store_true', help=f'write results to {RESULTS_PATH}')
+    parser.add_argument('--compare', action='store_true', help='show deltas against the committed results')
+    parser.add_argument('--budget', action='store_true',
+                        help=f'check the {BUDGET_CASE[0]} MP / {BUDGET_CASE[1]} object peak against the budget')
+    parser.add_argument('--budget-mb', type=float, default=PEAK_BUDGET_MB)
+    args = parser.parse_args()
+
+    if args.budget:
+        sys.exit(0 if check_budget(*BUDGET_CASE, args.budget_mb) else 1)
+
+    baseline = None
+    if args.compare and os.path.exists(RESULTS_PATH):
+        with open(RESULTS_PATH) as f:
+            baseline = json.load(f)
+
+    report = run_all(args.megapixels, args.objects, args.repeat)
+    print_table(report, baseline)
+
+    if args.write:
+        os.makedirs(os.path.dirname(RESULTS_PATH), exist_ok=True)
+        with open(RESULTS_PATH, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print(f'Wrote {RESULTS_PATH}', file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
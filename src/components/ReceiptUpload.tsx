@@ -60,7 +60,9 @@ export const ReceiptUpload: React.FC<ReceiptUploadProps> = ({
 
         toast({
           title: 'Upload successful',
-          description: 'Receipt processed successfully',
+          description: result.duplicate
+            ? 'This receipt was already uploaded; reused its earlier results'
+            : 'Receipt processed successfully',
           status: 'success',
           duration: 5000,
         });
@@ -117,6 +117,7 @@ export type TranslationKey =
   | 'documents.categories.other'
   | 'documents.description'
   | 'documents.noCategoryDocuments'
+  | 'documents.blurFaces'
   | 'collaborate.description'
   | 'collaborate.roles.editor'
   | 'collaborate.roles.viewer'
@@ -274,6 +275,7 @@ export const translations: Translations = {
     'documents.categories.other': 'Other',
     'documents.description': 'Upload and manage your documentation for the insurance claim.',
     'documents.noCategoryDocuments': 'No documents found in the selected category',
+    'documents.blurFaces': 'Blur faces in photos',
     'collaborate.description': 'Invite others to help with your insurance claim documentation.',
     'collaborate.roles.editor': 'Editor',
     'collaborate.roles.viewer': 'Viewer',
@@ -423,6 +425,7 @@ export const translations: Translations = {
     'documents.categories.other': 'Otros',
     'documents.description': 'Suba y administre su documentación para el reclamo de seguro.',
     'documents.noCategoryDocuments': 'No se encontraron documentos en la categoría seleccionada',
+    'documents.blurFaces': 'Difuminar rostros en las fotos',
     'collaborate.description': 'Invite a otros a ayudar con la documentación de su reclamo de seguro.',
     'collaborate.roles.editor': 'Editor',
     'collaborate.roles.viewer': 'Visualizador',
@@ -572,6 +575,7 @@ export const translations: Translations = {
     'documents.categories.other': 'Autre',
     'documents.description': 'Téléchargez et gérez votre documentation pour la réclamation d\'assurance.',
     'documents.noCategoryDocuments': 'Aucun document trouvé dans la catégorie sélectionnée',
+    'documents.blurFaces': 'Flouter les visages sur les photos',
     'collaborate.description': 'Invitez d\'autres personnes à vous aider avec la documentation de votre réclamation d\'assurance.',
     'collaborate.roles.editor': 'Éditeur',
     'collaborate.roles.viewer': 'Lecteur',
@@ -721,6 +725,7 @@ export const translations: Translations = {
     'documents.categories.other': 'Sonstiges',
     'documents.description': 'Laden Sie Ihre Dokumentation für den Versicherungsanspruch hoch und verwalten Sie sie.',
     'documents.noCategoryDocuments': 'Keine Dokumente in der ausgewählten Kategorie gefunden',
+    'documents.blurFaces': 'Gesichter in Fotos verpixeln',
     'collaborate.description': 'Laden Sie andere ein, bei der Dokumentation Ihres Versicherungsanspruchs zu helfen.',
     'collaborate.roles.editor': 'Bearbeiter',
     'collaborate.roles.viewer': 'Betrachter',
@@ -870,6 +875,7 @@ export const translations: Translations = {
     'documents.categories.other': 'अन्य',
     'documents.description': 'बीमा दावे के लिए अपना दस्तावेज़ीकरण अपलोड करें और प्रबंधित करें।',
     'documents.noCategoryDocuments': 'चयनित श्रेणी में कोई दस्तावेज़ नहीं मिला',
+    'documents.blurFaces': 'फ़ोटो में चेहरे धुंधले करें',
     'collaborate.description': 'अपने बीमा दावे के दस्तावेज़ीकरण में मदद के लिए दूसरों को आमंत्रित करें।',
     'collaborate.roles.editor': 'संपादक',
     'collaborate.roles.viewer': 'दर्शक',
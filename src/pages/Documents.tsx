@@ -16,6 +16,7 @@ import {
   Progress,
   Flex,
   Select,
+  Checkbox,
 } from '@chakra-ui/react';
 import { DeleteIcon, DownloadIcon, AddIcon } from '@chakra-ui/icons';
 import { useAuth } from '../contexts/AuthContext';
@@ -23,6 +24,7 @@ import { useLocalization } from '../hooks/useLocalization';
 import { storage, db } from '../config/firebase';
 import { 
   ref, 
+  uploadBytes,
   uploadBytesResumable, 
   getDownloadURL,
   deleteObject 
@@ -34,15 +36,24 @@ import {
   where, 
   getDocs,
   deleteDoc,
+  updateDoc,
   doc 
 } from 'firebase/firestore';
 import { StoredDocument } from '../types/models';
+import { apiService } from '../services/apiService';
+
+interface RedactionResult {
+  url: string;
+  image_url?: string;
+  error?: string;
+}
 
 const Documents = () => {
   const [documents, setDocuments] = useState<StoredDocument[]>([]);
   const [uploading, setUploading] = useState(false);
   const [uploadProgress, setUploadProgress] = useState(0);
   const [selectedCategory, setSelectedCategory] = useState<string>('');
+  const [blurFaces, setBlurFaces] = useState(false);
 
   const { currentUser } = useAuth();
   const { t } = useLocalization();
@@ -93,6 +104,43 @@ const Documents = () => {
     fetchDocuments();
   }, [currentUser, toast]);
 
+  /**
+   * Replaces freshly uploaded photos with versions whose faces are blurred.
+   * The whole batch goes to the backend in one /redact call; each redacted
+   * image is then written over the original in Storage and the document is
+   * marked as blurred. Photos the backend could not redact are left as they are.
+   */
+  const blurUploadedPhotos = useCallback(async (uploaded: StoredDocument[]) => {
+    const photos = uploaded.filter(document => document.type === 'photo');
+    if (photos.length === 0) return;
+
+    const { documents: results } = await apiService.redactDocuments(
+      photos.map(document => document.storageUrl),
+      'blur'
+    ) as { documents: RedactionResult[] };
+
+    await Promise.all(photos.map(async (document, index) => {
+      const result = results[index];
+      if (!result?.image_url) {
+        console.error('Redaction failed:', document.fileName, result?.error);
+        return;
+      }
+      const response = await fetch(result.image_url);
+      if (!response.ok) {
+        console.error('Redacted image unavailable:', document.fileName, response.status);
+        return;
+      }
+      const redacted = await response.blob();
+      const storageRef = ref(storage, document.id);
+      await uploadBytes(storageRef, redacted, { contentType: 'image/jpeg' });
+      const storageUrl = await getDownloadURL(storageRef);
+      await updateDoc(doc(db, 'documents', document.firestoreId), { storageUrl, isBlurred: true });
+      setDocuments(prev => prev.map(d =>
+        d.firestoreId === document.firestoreId ? { ...d, storageUrl, isBlurred: true } : d
+      ));
+    }));
+  }, []);
+
   const handleFileUpload = useCallback(async (event: React.ChangeEvent<HTMLInputElement>) => {
     const files = event.target.files;
     if (!files || !currentUser || !selectedCategory) {
@@ -107,6 +155,7 @@ const Documents = () => {
     }
 
     setUploading(true);
+    const uploaded: StoredDocument[] = [];
 
     try {
       for (const file of Array.from(files)) {
@@ -160,6 +209,7 @@ const Documents = () => {
                 };
 
                 setDocuments(prev => [...prev, newDoc]);
+                uploaded.push(newDoc);
                 resolve();
               } catch (error) {
                 reject(error);
@@ -169,6 +219,21 @@ const Documents = () => {
         });
       }
 
+      if (blurFaces) {
+        try {
+          await blurUploadedPhotos(uploaded);
+        } catch (error) {
+          console.error('Redaction error:', error);
+          toast({
+            title: 'Redaction Error',
+            description: 'Files were uploaded, but faces could not be blurred',
+            status: 'warning',
+            duration: 5000,
+            isClosable: true,
+          });
+        }
+      }
+
       toast({
         title: 'Upload Complete',
         description: `Successfully uploaded ${files.length} file(s)`,
@@ -188,7 +253,7 @@ const Documents = () => {
       setUploading(false);
       setUploadProgress(0);
     }
-  }, [currentUser, selectedCategory, toast]);
+  }, [currentUser, selectedCategory, blurFaces, blurUploadedPhotos, toast]);
 
   const handleDelete = async (document: StoredDocument) => {
     if (!document.firestoreId) return;
@@ -293,6 +358,14 @@ const Documents = () => {
               {t('documents.upload')}
             </Button>
           </Box>
+
+          <Checkbox
+            isChecked={blurFaces}
+            onChange={(e) => setBlurFaces(e.target.checked)}
+            isDisabled={uploading}
+          >
+            {t('documents.blurFaces')}
+          </Checkbox>
         </Flex>
 
         {uploading && (
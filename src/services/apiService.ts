@@ -1,7 +1,55 @@
 import { loggingService } from './loggingService';
+import { auth } from '../config/firebase';
 
 const API_BASE_URL = 'http://localhost:4000';
 
+const sleep = (ms: number) => new Promise(resolve => setTimeout(resolve, ms));
+
+/**
+ * POSTs JSON to the backend with an Idempotency-Key, retrying on network
+ * errors and on 429/503 load shedding. Every attempt reuses the same key, so
+ * a retry attaches to (or replays) the first run instead of re-running the
+ * expensive detection/OCR pipeline. The signed-in user's Firebase ID token is
+ * sent as a bearer token so the backend can verify who the request is for.
+ *
+ * @param url - Endpoint URL
+ * @param body - JSON request body
+ * @param retries - Number of retries after the first attempt
+ * @returns Promise resolving to the final fetch Response
+ */
+export const postJsonIdempotent = async (
+  url: string,
+  body: unknown,
+  retries = 2
+): Promise<Response> => {
+  const idempotencyKey = crypto.randomUUID();
+  const idToken = auth.currentUser ? await auth.currentUser.getIdToken() : null;
+  for (let attempt = 0; ; attempt++) {
+    try {
+      const response = await fetch(url, {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/json',
+          'Idempotency-Key': idempotencyKey,
+          ...(idToken ? { Authorization: `Bearer ${idToken}` } : {})
+        },
+        body: JSON.stringify(body)
+      });
+      if ((response.status === 429 || response.status === 503) && attempt < retries) {
+        const retryAfter = Number(response.headers.get('Retry-After')) || 1;
+        await sleep(retryAfter * 1000);
+        continue;
+      }
+      return response;
+    } catch (error) {
+      if (attempt >= retries) {
+        throw error;
+      }
+      await sleep(1000 * 2 ** attempt);
+    }
+  }
+};
+
 export const apiService = {
   async detectObjects(image: File) {
     try {
@@ -45,5 +93,34 @@ export const apiService = {
       loggingService.logAPIResponse('/analyze', 'POST', null, error);
       throw error;
     }
+  },
+
+  /**
+   * Redacts faces, and optionally text (e.g. account numbers), in a set of
+   * stored documents on the backend. Documents redacted before with the
+   * same settings come back from the backend's cache.
+   *
+   * @param urls - Storage URLs of the documents to redact
+   * @param mode - 'pixelate' (default) or 'blur'
+   * @param targets - Regions to redact (default: faces only; text also masks prices and totals)
+   * @returns Promise resolving to one result per URL, with the redacted image_url or an error
+   */
+  async redactDocuments(
+    urls: string[],
+    mode: 'pixelate' | 'blur' = 'pixelate',
+    targets: Array<'faces' | 'text'> = ['faces']
+  ) {
+    try {
+      const response = await postJsonIdempotent(`${API_BASE_URL}/redact`, { urls, mode, targets });
+      const data = await response.json();
+
+      // Log the API response
+      loggingService.logAPIResponse('/redact', 'POST', data);
+
+      return data;
+    } catch (error) {
+      loggingService.logAPIResponse('/redact', 'POST', null, error);
+      throw error;
+    }
   }
 };
\ No newline at end of file
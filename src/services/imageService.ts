@@ -1,6 +1,7 @@
 import { storage, db } from '../config/firebase';
 import { ref, uploadBytes, getDownloadURL } from 'firebase/storage';
 import { doc, setDoc, collection } from 'firebase/firestore';
+import { postJsonIdempotent } from './apiService';
 
 /**
  * Interface representing a detected object in an image
@@ -16,6 +17,37 @@ export interface DetectedObject {
   description: string;   // Optional object description
 }
 
+// Polling for objects the backend was still pricing when it responded
+const JOB_POLL_INTERVAL_MS = 1000;
+const JOB_POLL_ATTEMPTS = 60;
+
+/**
+ * Returns the detected objects of a /detect response, waiting for any that
+ * were returned as pending placeholders (the request's time budget ran out
+ * before they were priced) by polling the response's job URL. If the job does
+ * not finish in time, placeholders keep their label-based name and $0.00 price.
+ *
+ * @param detectionResult - Parsed /detect response
+ * @returns Promise resolving to the detected objects, priced where possible
+ */
+const collectDetectedObjects = async (detectionResult: any): Promise<any[]> => {
+  if (!detectionResult.job_url) {
+    return detectionResult.detected_objects;
+  }
+  for (let attempt = 0; attempt < JOB_POLL_ATTEMPTS; attempt++) {
+    await new Promise(resolve => setTimeout(resolve, JOB_POLL_INTERVAL_MS));
+    const response = await fetch(detectionResult.job_url);
+    if (!response.ok) {
+      break;
+    }
+    const job = await response.json();
+    if (job.complete) {
+      return job.detected_objects;
+    }
+  }
+  return detectionResult.detected_objects;
+};
+
 /**
  * Interface representing the result of an image upload and processing operation
  * Contains URLs and metadata for both the main image and any detected objects
@@ -73,8 +105,10 @@ export const processAndUploadImage = async (
     // const formData = new FormData();
     // formData.append('image', file);
     // formData.append('url', mainImageUrl);
+    // Ask for crops as short blob references instead of inline base64 data URLs
     const formData = {
-      url: mainImageUrl
+      url: mainImageUrl,
+      crop_output: 'reference'
     };
 
     // Send image to Python backend for object detection
@@ -82,13 +116,7 @@ export const processAndUploadImage = async (
 
 
     const api = 'http://127.0.0.1:4000';
-    const detectionResponse = await fetch(`${api}/detect`, {
-      method: 'POST',
-      headers: {
-        'Content-Type': 'application/json'
-      },
-      body: JSON.stringify(formData)
-    });
+    const detectionResponse = await postJsonIdempotent(`${api}/detect`, formData);
     // const detectionResponse = await fetch('/api/detect-objects', {
     //   method: 'POST',
     //   body: formData
@@ -103,7 +131,7 @@ export const processAndUploadImage = async (
     console.log(detectionResult)
 
     // Process each detected object from the response
-    for (const object of detectionResult.detected_objects) {
+    for (const object of await collectDetectedObjects(detectionResult)) {
       // Upload the cropped object image to Firebase
       const objectImageRef = ref(storage, `${folderPath}/object_${object.label}.jpg`);
       const objectImageBlob = await fetch(object.image_url).then(r => r.blob());
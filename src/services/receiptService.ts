@@ -1,6 +1,7 @@
 import { ref, uploadBytes, getDownloadURL } from 'firebase/storage';
 import { doc, setDoc, collection, updateDoc, query, where, getDocs } from 'firebase/firestore';
 import { storage, db } from '../config/firebase';
+import { postJsonIdempotent } from './apiService';
 
 export interface AnalyzedData {
   name: string;
@@ -13,6 +14,8 @@ export interface ReceiptProcessResult {
   text: string;
   folderPath: string;
   analyzedData: AnalyzedData;
+  // True when the backend recognised this receipt as one the user uploaded before
+  duplicate: boolean;
 }
 
 export const processAndUploadReceipt = async (
@@ -31,13 +34,7 @@ export const processAndUploadReceipt = async (
 
     // Send receipt to Python backend for OCR processing and analysis
     const api = 'http://127.0.0.1:4000';
-    const ocrResponse = await fetch(`${api}/read-receipt`, {
-      method: 'POST',
-      headers: {
-        'Content-Type': 'application/json'
-      },
-      body: JSON.stringify({ url: mainImageUrl })
-    });
+    const ocrResponse = await postJsonIdempotent(`${api}/read-receipt`, { url: mainImageUrl });
 
     if (!ocrResponse.ok) {
       throw new Error('OCR processing failed');
@@ -96,7 +93,8 @@ export const processAndUploadReceipt = async (
       mainImageUrl,
       text: ocrResult.text,
       folderPath,
-      analyzedData: ocrResult.analyzed_data
+      analyzedData: ocrResult.analyzed_data,
+      duplicate: ocrResult.duplicate ?? false
     };
   } catch (error) {
     console.error('Error in processAndUploadReceipt:', error);